@@ -0,0 +1,126 @@
+'''
+Local memory cache backend with a least recently used eviction.
+
+The LocMemCache of Django culls a fraction of the keys, any of them, when
+it's full. This one drops the least recently used keys, so the votings
+being voted stay in the cache of mods.get while the old ones go out.
+
+    CACHES = {
+        'mods': {
+            'BACKEND': 'base.cache.LRUCache',
+            'OPTIONS': {'MAX_ENTRIES': 1000},
+        },
+    }
+
+The values are pickled like in LocMemCache, a caller that changes the
+value it got doesn't change the cached one.
+
+>>> cache = LRUCache('doctest', {'OPTIONS': {'MAX_ENTRIES': 2}})
+>>> cache.set('a', 1); cache.set('b', 2)
+>>> cache.get('a')
+1
+>>> cache.set('c', 3)
+>>> cache.get('b') is None, cache.get('a'), cache.get('c')
+(True, 1, 3)
+>>> cache.add('a', 5), cache.incr('a')
+(False, 2)
+>>> cache.set('d', 4, timeout=-1)
+>>> cache.has_key('d')
+False
+'''
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+# the caches handler builds a backend for each thread, all of them with the
+# same name share the entries
+stores = {}
+stores_lock = threading.Lock()
+
+
+class LRUCache(BaseCache):
+    def __init__(self, name, params):
+        super().__init__(params)
+        with stores_lock:
+            self._store, self._lock = stores.setdefault(name, (OrderedDict(), threading.Lock()))
+
+    def _expired(self, key):
+        expiry = self._store[key][0]
+        return expiry is not None and expiry <= time.time()
+
+    def _get(self, key):
+        if key not in self._store:
+            return None
+        if self._expired(key):
+            del self._store[key]
+            return None
+        self._store.move_to_end(key)
+        return self._store[key]
+
+    def _set(self, key, value, timeout):
+        expiry = self.get_backend_timeout(timeout)
+        self._store[key] = (expiry, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        self._store.move_to_end(key)
+        while len(self._store) > self._max_entries:
+            self._store.popitem(last=False)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            entry = self._get(key)
+        if entry is None:
+            return default
+        return pickle.loads(entry[1])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._set(key, value, timeout)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(entry[1]) + delta
+            self._store[key] = (entry[0], pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        return value
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            return self._get(key) is not None
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._store.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,218 @@
+'''
+Counters and histograms of this process in the Prometheus text format,
+served at /metrics, see base.views.metrics_view.
+
+The queries between modules are timed in base.mods, the requests and
+their database queries in base.middleware.MetricsMiddleware and the
+messages of the mixnet in mixnet.mixcrypt. Each process has its own
+values, with several workers each scrape reads the one that answers.
+
+>>> registry = Registry()
+>>> ops = registry.counter('ops_total', 'Operations', ('op',))
+>>> ops.inc(op='decrypt')
+>>> ops.inc(3, op='decrypt')
+>>> t = registry.histogram('query_seconds', 'Query time', ('module',), buckets=(0.1, 1))
+>>> t.observe(0.05, module='voting')
+>>> t.observe(0.5, module='voting')
+>>> print(registry.render())
+# HELP ops_total Operations
+# TYPE ops_total counter
+ops_total{op="decrypt"} 4
+# HELP query_seconds Query time
+# TYPE query_seconds histogram
+query_seconds_bucket{module="voting",le="0.1"} 1
+query_seconds_bucket{module="voting",le="1"} 2
+query_seconds_bucket{module="voting",le="+Inf"} 2
+query_seconds_sum{module="voting"} 0.55
+query_seconds_count{module="voting"} 2
+<BLANKLINE>
+>>> ops.value(op='decrypt'), t.value(module='voting')[-1]
+(4, 2)
+'''
+
+import bisect
+import re
+import threading
+import time
+
+
+# seconds, from a local view call to a tally
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# ids in the paths, /voting/3/ and /voting/4/ are the same label
+IDS = re.compile(r'/\d+(?=/|$)')
+
+
+def path_label(path):
+    '''
+    >>> path_label('/census/12/')
+    '/census/<id>/'
+    '''
+
+    return IDS.sub('/<id>', path)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(round(value, 9))
+    return str(value)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in pairs) + '}'
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines += self.samples(key, value)
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def samples(self, key, value):
+        return ['{}{} {}'.format(self.name, self.label_text(key), number(value))]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, amount, **labels):
+        key = self.key(labels)
+        i = bisect.bisect_left(self.buckets, amount)
+        with self.lock:
+            value = self.values.get(key)
+            if value is None:
+                value = self.values[key] = [[0] * len(self.buckets), 0]
+            value[0][i] += 1
+            value[1] += amount
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def value(self, **labels):
+        '''
+        The cumulative count of each bucket
+        '''
+
+        with self.lock:
+            value = self.values.get(self.key(labels))
+            counts = list(value[0]) if value else [0] * len(self.buckets)
+        return [sum(counts[:i + 1]) for i in range(len(counts))]
+
+    def samples(self, key, value):
+        counts, total = value
+        lines = []
+        n = 0
+        for bucket, count in zip(self.buckets, counts):
+            n += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name, self.label_text(key, [('le', number(bucket))]), n))
+        lines.append('{}_sum{} {}'.format(self.name, self.label_text(key), number(total)))
+        lines.append('{}_count{} {}'.format(self.name, self.label_text(key), n))
+        return lines
+
+
+class Timer:
+    '''
+    Context manager that observes the seconds of its block
+    '''
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def add(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=TIME_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = [self.metrics[name] for name in sorted(self.metrics)]
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+mods_query = registry.histogram(
+    'decide_mods_query_seconds', 'Queries between modules by base.mods',
+    ('module', 'entry_point', 'method', 'local'))
+request_time = registry.histogram(
+    'decide_request_seconds', 'Requests to the views of this process',
+    ('view', 'method', 'status'))
+request_queries = registry.histogram(
+    'decide_request_db_queries', 'Database queries of each request',
+    ('view',), buckets=COUNT_BUCKETS)
+mixcrypt_msgs = registry.counter(
+    'decide_mixcrypt_messages_total', 'Messages processed by the mixnet crypto',
+    ('op',))
+mixcrypt_time = registry.counter(
+    'decide_mixcrypt_seconds_total', 'Seconds of the mixnet crypto operations',
+    ('op',))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
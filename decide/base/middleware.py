@@ -0,0 +1,86 @@
+import time
+
+from django.db import connection
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import metrics
+from . import tracing
+
+
+def view_label(request):
+    '''
+    The view that answered the request, module.Class, or none if the url
+    didn't match
+    '''
+
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'none'
+    func = match.func
+    return '{}.{}'.format(func.__module__, getattr(func, '__name__', type(func).__name__))
+
+
+class MetricsMiddleware:
+    '''
+    Time and database queries of each request, by view, see base.metrics.
+    The queries of the views called through base.mods in this process are
+    counted in the request that called them.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        view = view_label(request)
+        metrics.request_time.observe(elapsed, view=view, method=request.method,
+                                     status=response.status_code)
+        metrics.request_queries.observe(queries[0], view=view)
+        return response
+
+
+def authenticated(request):
+    '''
+    The request has a valid token, like the chain calls of the tally
+    '''
+
+    try:
+        return TokenAuthentication().authenticate(request) is not None
+    except AuthenticationFailed:
+        return False
+
+
+class TracingMiddleware:
+    '''
+    The requests with a traceparent header, the queries of other modules
+    in a trace, are spans of that trace, see base.tracing. The others
+    aren't traced, and neither are the anonymous ones, anybody could fill
+    the TRACE_FILE with them.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        parent = None
+        if tracing.trace_file():
+            parent = tracing.parse_traceparent(request.META.get('HTTP_TRACEPARENT'))
+        if parent is None or not authenticated(request):
+            return self.get_response(request)
+
+        with tracing.span('request', parent=parent, method=request.method,
+                          path=request.path) as sp:
+            response = self.get_response(request)
+            sp.set(view=view_label(request), status=response.status_code)
+        return response
@@ -34,6 +34,8 @@ class Key(models.Model):
     g = BigBigField()
     y = BigBigField()
     x = BigBigField(blank=True, null=True)
+    # elliptic curve of the key, empty for the multiplicative group mod p
+    curve = models.CharField(max_length=20, blank=True, default='')
 
     def __str__(self):
         if self.x:
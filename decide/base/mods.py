@@ -1,6 +1,202 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+import http.cookiejar
+import io
+import json
+import sys
+import threading
 import urllib
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import Resolver404, resolve
+
+from . import metrics
+from . import tracing
+
+
+# requests.Session of each thread for each base url, the connections are
+# kept alive and reused by the next queries to the same module
+local = threading.local()
+
+# connections opened and reused by the queries of all the threads
+stats_lock = threading.Lock()
+connection_stats = {'opened': 0, 'reused': 0, 'local': 0, 'cached': 0}
+
+# threads of the async queries, see aquery
+executor_lock = threading.Lock()
+executor = None
+
+
+def session(baseurl):
+    '''
+    The pooled requests.Session of this thread for the baseurl. It's
+    shared by the queries of all the users, so it keeps no cookies.
+    '''
+
+    sessions = getattr(local, 'sessions', None)
+    if sessions is None:
+        sessions = local.sessions = {}
+
+    s = sessions.get(baseurl)
+    if s is None:
+        s = requests.Session()
+        # no allowed domains, every cookie is rejected
+        s.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=settings.MODS_POOL_CONNECTIONS,
+                              pool_maxsize=settings.MODS_POOL_MAXSIZE)
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        sessions[baseurl] = s
+    return s
+
+
+def opened_connections(s):
+    '''
+    Connections opened by the pools of the session s
+    '''
+
+    n = 0
+    for adapter in s.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            n += pools[key].num_connections
+    return n
+
+
+def stats():
+    '''
+    Connections opened and reused by the queries since the start or the
+    last reset_stats, queries to modules of this process, that don't use
+    any connection, and gets answered from the cache
+    '''
+
+    with stats_lock:
+        return dict(connection_stats)
+
+
+def reset_stats():
+    with stats_lock:
+        connection_stats.update(opened=0, reused=0, local=0, cached=0)
+
+
+def module_url(modname, baseurl=None):
+    '''
+    The base url of the module, the baseurl if any or its APIS entry. The
+    modname can have a path, census/1 is the census module.
+    '''
+
+    if baseurl:
+        return baseurl
+    if modname in settings.APIS:
+        return settings.APIS[modname]
+    return settings.APIS.get(modname.split('/')[0], settings.BASEURL)
+
+
+def is_local(modname, mod):
+    '''
+    If the module runs in this process, its url is this one and it's in
+    MODULES
+    '''
+
+    if not settings.MODS_LOCAL:
+        return False
+    return (mod.rstrip('/') == settings.BASEURL.rstrip('/') and
+            modname.split('/')[0] in settings.MODULES)
+
+
+class LocalResponse:
+    '''
+    Answer of a view called in this process, with the attributes of a
+    requests response
+    '''
+
+    def __init__(self, response):
+        if hasattr(response, 'render'):
+            response.render()
+        self.status_code = response.status_code
+        self.content = response.content
+        self.headers = CaseInsensitiveDict(response.items())
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def local_query(url, method, headers, **kwargs):
+    '''
+    Calls the view of the url, a path, in this process, without the
+    network. Returns a LocalResponse.
+
+    The request is built from a WSGI environ like the one of the server,
+    but the view is called without the MIDDLEWARE: the query itself is
+    measured and traced, the views authenticate the Authorization header
+    with the REST_FRAMEWORK classes, and none of them uses the session,
+    the messages, the CSRF cookie, the redirects of CommonMiddleware nor
+    the headers of SecurityMiddleware and XFrameOptionsMiddleware.
+    '''
+
+    base = urllib.parse.urlsplit(settings.BASEURL)
+    path, _, query = url.partition('?')
+
+    if method == 'get':
+        body, content_type = b'', 'application/octet-stream'
+    elif 'data' in kwargs:
+        body = kwargs['data']
+        content_type = kwargs.get('content_type', 'application/octet-stream')
+    else:
+        body = json.dumps(kwargs.get('json', {}))
+        content_type = 'application/json'
+    if isinstance(body, str):
+        body = body.encode()
+
+    environ = {
+        'REQUEST_METHOD': method.upper(),
+        # the WSGI path is decoded, as latin-1 like the server does
+        'PATH_INFO': urllib.parse.unquote_to_bytes(path).decode('iso-8859-1'),
+        'QUERY_STRING': query,
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': base.hostname or 'localhost',
+        'SERVER_PORT': str(base.port or (443 if base.scheme == 'https' else 80)),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_HOST': base.netloc,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': base.scheme,
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+    request = WSGIRequest(environ)
+    try:
+        match = resolve(request.path_info)
+    except Resolver404 as e:
+        return LocalResponse(response_for_exception(request, e))
+
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Exception as e:
+        # the same error answer than the server
+        response = response_for_exception(request, e)
+    return LocalResponse(response)
 
 
 def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
@@ -19,7 +215,16 @@ def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
 
     This function can receive optional parameters to complete the query,
     you can complete the query with GET params using the **params** keyword
-    and with json data, using the **json** keyword.
+    and with json data, using the **json** keyword. Other bodies can be
+    sent with the **data** and **content_type** keywords, and the
+    **accept** keyword sets the Accept header. The **timeout** keyword
+    overrides MODS_TIMEOUT.
+
+    The queries of each thread to the same base url share a requests
+    Session, so the connections are kept alive and reused, see stats. The
+    queries to the modules of this process call the view without any
+    request, see MODS_LOCAL and local_query. The time of each query is measured in
+    base.metrics, and it's a span of the trace, see base.tracing.
 
     Examples
 
@@ -30,49 +235,247 @@ def query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
     >>> assert(len(r) == len(msgs))
     '''
 
-    if not baseurl:
-        mod = settings.APIS.get(modname, settings.BASEURL)
-    else:
-        mod = baseurl
-
-    q = getattr(requests, method)
-    url = '{}/{}{}'.format(mod, modname, entry_point)
+    mod = module_url(modname, baseurl)
+    path = '/{}{}'.format(modname, entry_point)
+    labels = {
+        'module': modname.split('/')[0],
+        'entry_point': metrics.path_label(path),
+        'method': method,
+    }
 
     headers = {}
     if 'HTTP_AUTHORIZATION' in kwargs:
         headers['Authorization'] = kwargs['HTTP_AUTHORIZATION']
+    if 'accept' in kwargs:
+        headers['Accept'] = kwargs['accept']
 
     params = kwargs.get('params', None)
     if params:
-        url += '?{}'.format(urllib.parse.urlencode(params))
+        path += '?{}'.format(urllib.parse.urlencode(params))
 
-    if method == 'get':
-        response = q(url, headers=headers)
-    else:
-        json_data = kwargs.get('json', {})
-        response = q(url, json=json_data, headers=headers)
+    with tracing.span('{} {}'.format(method.upper(), labels['entry_point']),
+                      module=labels['module']) as sp:
+        # the spans of the module that answers are children of this one
+        parent = tracing.traceparent()
+        if parent:
+            headers['traceparent'] = parent
+        if is_local(modname, mod):
+            with metrics.mods_query.time(local='1', **labels):
+                response = local_query(path, method, headers, **kwargs)
+            sp.set(status=response.status_code, local=True)
+            with stats_lock:
+                connection_stats['local'] += 1
+            if kwargs.get('response', False):
+                return response
+            return response.json()
 
-    if kwargs.get('response', False):
-        return response
-    else:
-        return response.json()
+        s = session(mod)
+        q = getattr(s, method)
+        url = mod + path
+
+        timeout = kwargs.get('timeout', settings.MODS_TIMEOUT)
+        opened = opened_connections(s)
+        with metrics.mods_query.time(local='0', **labels):
+            if method == 'get':
+                response = q(url, headers=headers, timeout=timeout)
+            elif 'data' in kwargs:
+                headers['Content-Type'] = kwargs.get('content_type', 'application/octet-stream')
+                response = q(url, data=kwargs['data'], headers=headers, timeout=timeout)
+            else:
+                json_data = kwargs.get('json', {})
+                response = q(url, json=json_data, headers=headers, timeout=timeout)
+
+        with stats_lock:
+            if opened_connections(s) > opened:
+                connection_stats['opened'] += 1
+            else:
+                connection_stats['reused'] += 1
+        sp.set(status=response.status_code, url=mod)
 
+        if kwargs.get('response', False):
+            return response
+        else:
+            return response.json()
+
+
+# the real query, mock_query replaces query in the tests
+http_query = query
+
+
+def cache():
+    return caches[settings.MODS_CACHE]
+
+
+def cache_key(modname, entry_point, baseurl, kwargs):
+    '''
+    The cache key of the get and its ttl, or None if it isn't cached: the
+    module isn't in MODS_CACHE_TTL, the caller wants the response or the
+    query has a token, the answer depends on the user.
+
+    The key has the generation of the module, a new one when the cache of
+    the module is invalidated.
+    '''
+
+    module = modname.split('/')[0]
+    ttl = settings.MODS_CACHE_TTL.get(module)
+    if not ttl or kwargs.get('response', False) or 'HTTP_AUTHORIZATION' in kwargs:
+        return None, None
+
+    # the generation isn't a counter, if it's evicted the new one is unique
+    genkey = 'mods:gen:{}'.format(module)
+    gen = cache().get(genkey)
+    if gen is None:
+        cache().add(genkey, uuid.uuid4().hex, None)
+        gen = cache().get(genkey)
+
+    q = [module_url(modname, baseurl), modname, entry_point,
+         sorted((kwargs.get('params') or {}).items()), kwargs.get('accept')]
+    h = hashlib.sha1(json.dumps(q, default=str).encode()).hexdigest()
+    return 'mods:{}:{}:{}'.format(module, gen, h), ttl
+
+
+def cache_get(key):
+    value = cache().get(key)
+    if value is not None:
+        with stats_lock:
+            connection_stats['cached'] += 1
+    return value
+
+
+def cache_set(key, ttl, response):
+    '''
+    Caches the json of the response if it's ok, the errors aren't cached
+    '''
+
+    value = response.json()
+    if response.status_code == 200:
+        cache().set(key, value, ttl)
+    return value
+
+
+def invalidate(modname):
+    '''
+    Drops the cached gets of the module, a new generation in the keys
+    '''
+
+    cache().set('mods:gen:{}'.format(modname), uuid.uuid4().hex, None)
+
+
+def get(modname, entry_point='/', baseurl=None, cached=True, **kwargs):
+    '''
+    The get query, cached for the modules in MODS_CACHE_TTL, see cache_key.
+    With cached=False it's always queried, the cache of each process is
+    only invalidated in the process that saves the voting.
+    '''
+
+    key, ttl = cache_key(modname, entry_point, baseurl, kwargs) if cached else (None, None)
+    if key is None:
+        return query(modname, entry_point, method='get', baseurl=baseurl, **kwargs)
 
-def get(*args, **kwargs):
-    return query(*args, method='get', **kwargs)
+    value = cache_get(key)
+    if value is None:
+        kwargs['response'] = True
+        response = query(modname, entry_point, method='get', baseurl=baseurl, **kwargs)
+        value = cache_set(key, ttl, response)
+    return value
 
 
 def post(*args, **kwargs):
     return query(*args, method='post', **kwargs)
 
 
+def query_executor():
+    global executor
+
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=settings.MODS_ASYNC_WORKERS,
+                                          thread_name_prefix='mods')
+        return executor
+
+
+async def aquery(modname, entry_point='/', method='get', baseurl=None, **kwargs):
+    '''
+    The query as a coroutine, the same params and result. Several of them
+    awaited together with gather are done concurrently.
+
+    The requests run in the threads of the MODS_ASYNC_WORKERS executor,
+    each one with its pooled session. The queries to the modules of this
+    process, and all of them in the tests with mock_query, are run in the
+    thread of the caller because the views use its database connection.
+
+    >>> voting, voter = run(aget('voting', params={'id': 1}),
+    ...                     apost('authentication/getuser', json={'token': token}))
+    '''
+
+    call = functools.partial(query, modname, entry_point, method, baseurl, **kwargs)
+    if query is not http_query or is_local(modname, module_url(modname, baseurl)):
+        return call()
+
+    # the thread continues the trace of the caller
+    context = contextvars.copy_context()
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(query_executor(), context.run, call)
+
+
+async def aget(modname, entry_point='/', baseurl=None, cached=True, **kwargs):
+    key, ttl = cache_key(modname, entry_point, baseurl, kwargs) if cached else (None, None)
+    if key is None:
+        return await aquery(modname, entry_point, method='get', baseurl=baseurl, **kwargs)
+
+    value = cache_get(key)
+    if value is None:
+        kwargs['response'] = True
+        response = await aquery(modname, entry_point, method='get', baseurl=baseurl, **kwargs)
+        value = cache_set(key, ttl, response)
+    return value
+
+
+async def apost(*args, **kwargs):
+    return await aquery(*args, method='post', **kwargs)
+
+
+async def gather(*calls):
+    '''
+    Awaits the calls concurrently, returns their results in order. The
+    first exception is raised once all of them are done, none is left
+    running in the executor.
+    '''
+
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    for r in results:
+        if isinstance(r, BaseException):
+            raise r
+    return results
+
+
+def run(*calls):
+    '''
+    The sync wrapper of gather, for the views of the WSGI workers, that
+    don't have an event loop. Each call gets a new loop so the threads of
+    the worker don't share it.
+
+    >>> voting, perms = run(aget('voting', params={'id': 1}),
+    ...                     aget('census/1', params={'voter_id': 1}, response=True))
+    '''
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather(*calls))
+    finally:
+        loop.close()
+
+
 def mock_query(client):
     '''
     Function to build a mock to override the query function in this module.
 
-    The client param should be a rest_framework.tests.APIClient
+    The client param should be a rest_framework.tests.APIClient. The
+    cache of get is emptied, the tests reuse the ids of the objects.
     '''
 
+    cache().clear()
+
     def test_query(modname, entry_point='/', method='get', baseurl=None, **kwargs):
         url = '/{}{}'.format(modname, entry_point)
         params = kwargs.get('params', None)
@@ -81,11 +484,18 @@ def mock_query(client):
 
         q = getattr(client, method)
 
+        extra = {}
+        if 'accept' in kwargs:
+            extra['HTTP_ACCEPT'] = kwargs['accept']
+
         if method == 'get':
-            response = q(url, format='json')
+            response = q(url, format='json', **extra)
+        elif 'data' in kwargs:
+            content_type = kwargs.get('content_type', 'application/octet-stream')
+            response = q(url, data=kwargs['data'], content_type=content_type, **extra)
         else:
             json_data = kwargs.get('json', {})
-            response = q(url, data=json_data, format='json')
+            response = q(url, data=json_data, format='json', **extra)
 
         if kwargs.get('response', False):
             return response
@@ -1,8 +1,20 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from django.test import override_settings
+from unittest import mock
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
 from base import mods
+from base import tracing
 
 
 class BaseTestCase(APITestCase):
@@ -34,3 +46,242 @@ class BaseTestCase(APITestCase):
 
     def logout(self):
         self.client.credentials()
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    delay = 0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        data = {'path': self.path}
+        if self.headers.get('Cookie'):
+            data['cookie'] = self.headers['Cookie']
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'sessionid={}; Path=/'.format(self.path))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ModsTestCase(SimpleTestCase):
+    '''
+    The real query, against a local http server with keep-alive
+    '''
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        mods.reset_stats()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reused(self):
+        with override_settings(APIS={'voting': self.url}):
+            for i in range(3):
+                r = mods.http_query('voting', entry_point='/{}/'.format(i))
+                self.assertEqual(r, {'path': '/voting/{}/'.format(i)})
+        self.assertEqual(mods.stats(), {'opened': 1, 'reused': 2, 'local': 0, 'cached': 0})
+
+        # other threads have their own session
+        t = threading.Thread(target=mods.http_query, args=('voting',),
+                             kwargs={'baseurl': self.url})
+        t.start()
+        t.join()
+        self.assertEqual(mods.stats(), {'opened': 2, 'reused': 2, 'local': 0, 'cached': 0})
+        self.assertIs(mods.session(self.url), mods.session(self.url))
+
+    def test_no_cookies(self):
+        # the session of the thread is shared by the queries of all users
+        with override_settings(APIS={'voting': self.url}):
+            mods.http_query('voting', entry_point='/1/')
+            r = mods.http_query('voting', entry_point='/2/')
+        self.assertEqual(r, {'path': '/voting/2/'})
+        self.assertEqual(len(mods.session(self.url).cookies), 0)
+
+    @override_settings(MODS_CACHE_TTL={'voting': 60})
+    def test_cache(self):
+        mods.cache().clear()
+        with override_settings(APIS={'voting': self.url}), \
+                mock.patch.object(mods, 'query', mods.http_query):
+            for i in range(3):
+                r = mods.get('voting', params={'id': 1})
+                self.assertEqual(r, {'path': '/voting/?id=1'})
+            mods.get('voting', params={'id': 2})
+            self.assertEqual(mods.stats(), {'opened': 1, 'reused': 1, 'local': 0, 'cached': 2})
+
+            # the answer can be changed by the caller
+            r['path'] = 'changed'
+            self.assertEqual(mods.run(mods.aget('voting', params={'id': 1})),
+                             [{'path': '/voting/?id=1'}])
+
+            # not cached
+            mods.get('voting', params={'id': 1}, response=True)
+            mods.get('voting', params={'id': 1}, HTTP_AUTHORIZATION='Token x')
+            mods.get('mixnet', baseurl=self.url)
+            self.assertEqual(mods.stats()['reused'], 4)
+
+            mods.invalidate('voting')
+            mods.get('voting', params={'id': 1})
+            self.assertEqual(mods.stats()['reused'], 5)
+
+    @mock.patch.object(KeepAliveHandler, 'delay', 0.5)
+    def test_gather(self):
+        with override_settings(APIS={'voting': self.url}), \
+                mock.patch.object(mods, 'query', mods.http_query):
+            start = time.time()
+            r = mods.run(*(mods.aget('voting', entry_point='/{}/'.format(i))
+                           for i in range(3)))
+            elapsed = time.time() - start
+
+        self.assertEqual(r, [{'path': '/voting/{}/'.format(i)} for i in range(3)])
+        # concurrent, not one after another
+        self.assertLess(elapsed, 1.4)
+        self.assertEqual(mods.stats()['opened'], 3)
+
+
+class ModsLocalTestCase(BaseTestCase):
+    '''
+    The real query to the modules of this process, without the mock
+    '''
+
+    def test_local_query(self):
+        mods.reset_stats()
+        data = {'username': 'admin', 'password': 'qwerty'}
+        response = mods.http_query('authentication/login', method='post', json=data,
+                                   response=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'application/json')
+        token = response.json()['token']
+
+        user = mods.http_query('authentication/getuser', method='post', json={'token': token})
+        self.assertEqual(user['username'], 'admin')
+
+        votings = mods.http_query('voting', params={'id': 1})
+        self.assertEqual(votings, [])
+
+        response = mods.http_query('voting', entry_point='/tally/1/', response=True)
+        self.assertEqual(response.status_code, 401)
+        response = mods.http_query('voting', entry_point='/nope/', response=True)
+        self.assertEqual(response.status_code, 404)
+
+        self.assertEqual(mods.stats(), {'opened': 0, 'reused': 0, 'local': 5, 'cached': 0})
+
+        self.assertTrue(mods.is_local('voting', settings.BASEURL + '/'))
+        self.assertFalse(mods.is_local('voting', 'http://10.0.0.1:8000'))
+        with override_settings(MODS_LOCAL=False):
+            self.assertFalse(mods.is_local('voting', settings.BASEURL))
+
+
+class MetricsTestCase(BaseTestCase):
+
+    @override_settings(METRICS=True)
+    def test_metrics(self):
+        from mixnet.mixcrypt import MixCrypt
+
+        response = self.client.get('/voting/', format='json')
+        self.assertEqual(response.status_code, 200)
+        mods.http_query('voting', entry_point='/tally/1/')
+        k = MixCrypt(bits=256)
+        k.multiple_decrypt([k.encrypt(i) for i in range(2, 5)])
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('decide_request_seconds_count{view="voting.views.VotingView",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('decide_request_db_queries_bucket{view="voting.views.VotingView",'
+                      'le="+Inf"}', text)
+        self.assertIn('decide_mods_query_seconds_count{module="voting",'
+                      'entry_point="/voting/tally/<id>/",method="get",local="1"}', text)
+        self.assertIn('decide_mixcrypt_messages_total{op="decrypt"}', text)
+
+        with override_settings(METRICS=False):
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 404)
+
+    @override_settings(METRICS=True, METRICS_TOKEN='scraper', METRICS_ALLOWED_IPS=[])
+    def test_metrics_allowed(self):
+        # the test client comes from 127.0.0.1
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+        # not even for staff, only for the scraper
+        self.login()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 403)
+
+        for auth, status in (('Bearer other', 403), ('Bearer scraper', 200)):
+            self.client.credentials(HTTP_AUTHORIZATION=auth)
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, status)
+
+        with override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.logout()
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS=True, METRICS_TOKEN='scraper')
+    def test_metrics_proxied(self):
+        # through the local nginx every request comes from 127.0.0.1
+        proxied = {'REMOTE_ADDR': '127.0.0.1', 'HTTP_X_FORWARDED_FOR': '203.0.113.7',
+                   'HTTP_X_REAL_IP': '203.0.113.7'}
+        response = self.client.get('/metrics', **proxied)
+        self.assertEqual(response.status_code, 403)
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer scraper')
+        response = self.client.get('/metrics', **proxied)
+        self.assertEqual(response.status_code, 200)
+
+
+class TracingTestCase(BaseTestCase):
+
+    def test_traceparent(self):
+        with override_settings(TRACE_FILE=tempfile.mktemp()):
+            with tracing.span('root') as root:
+                mods.http_query('voting', params={'id': 1})
+                header = tracing.traceparent()
+            # not traced for anonymous callers
+            response = self.client.get('/voting/', HTTP_TRACEPARENT=header)
+            self.assertEqual(response.status_code, 200)
+            self.login()
+            response = self.client.get('/voting/', HTTP_TRACEPARENT=header)
+            self.assertEqual(response.status_code, 200)
+            # not traced without the header
+            self.client.get('/voting/')
+            spans = tracing.load([settings.TRACE_FILE])
+
+        names = [(depth, s['name']) for depth, s in tracing.tree(spans, root.trace)]
+        self.assertEqual(names, [(0, 'root'), (1, 'GET /voting/'), (1, 'request')])
+        self.assertEqual(len(spans), 3)
+        query, request = tracing.find(spans, 'GET /voting/'), tracing.find(spans, 'request')
+        self.assertEqual(query[0]['attrs'], {'module': 'voting', 'status': 200, 'local': True})
+        self.assertEqual(request[0]['attrs']['view'], 'voting.views.VotingView')
+        self.assertEqual(request[0]['parent'], header.split('-')[2])
+
+        # disabled
+        with tracing.span('root') as span:
+            self.assertIsInstance(span, tracing.NoSpan)
+            self.assertIsNone(tracing.traceparent())
+        self.assertIsNone(tracing.parse_traceparent('00-xyz'))
+
+    def test_trace_file_rotation(self):
+        path = tempfile.mktemp()
+        with override_settings(TRACE_FILE=path, TRACE_FILE_MAX_SIZE=1000):
+            for i in range(10):
+                with tracing.span('step', i=i):
+                    pass
+        paths = [p for p in (path + '.1', path) if os.path.exists(p)]
+        steps = [s['attrs']['i'] for s in tracing.load(paths)]
+        # only the last spans are kept
+        self.assertLess(len(steps), 10)
+        self.assertEqual(steps, list(range(10 - len(steps), 10)))
@@ -0,0 +1,217 @@
+'''
+Traces of the calls between modules, like the tally through the auths.
+
+A span is a timed step, inside another span of the same trace. The spans
+of this process are nested with a context variable, and base.mods sends
+the current one in the W3C traceparent header, so the spans of the module
+that answers, see base.middleware.TracingMiddleware, are children of the
+query span in the same trace.
+
+Each process appends its spans to TRACE_FILE as json lines, '' disables
+the tracing. Past TRACE_FILE_MAX_SIZE bytes the file is renamed to
+TRACE_FILE.1, replacing the previous one, and a new one is started. The
+tallytrace command reads the files of the auths and draws the waterfall of
+a tally.
+
+>>> import tempfile
+>>> path = tempfile.mktemp()
+>>> with span('tally', output=path, voting=1) as root:
+...     with span('shuffle', output=path):
+...         header = traceparent()
+>>> header == '00-{}-{}-01'.format(root.trace, header.split('-')[2])
+True
+>>> with span('request', output=path, parent=parse_traceparent(header)):
+...     pass
+>>> spans = load([path])
+>>> [(depth, s['name']) for depth, s in tree(spans, root.trace)]
+[(0, 'tally'), (1, 'shuffle'), (2, 'request')]
+>>> find(spans, 'tally', voting=1)[0]['trace'] == root.trace
+True
+'''
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+
+
+current = contextvars.ContextVar('decide_span', default=None)
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+write_lock = threading.Lock()
+
+
+def new_id(size):
+    return os.urandom(size).hex()
+
+
+def trace_file():
+    return getattr(settings, 'TRACE_FILE', '')
+
+
+def write(path, line):
+    '''
+    Appends the line to the file, rotated when it's too big
+    '''
+
+    limit = getattr(settings, 'TRACE_FILE_MAX_SIZE', 0)
+    with write_lock:
+        with open(path, 'a') as f:
+            f.write(line)
+            size = f.tell()
+        if limit and size > limit:
+            try:
+                os.replace(path, path + '.1')
+            except FileNotFoundError:
+                # other process rotated it
+                pass
+
+
+class Span:
+    def __init__(self, name, trace, parent, path, attrs):
+        self.name = name
+        self.trace = trace
+        self.id = new_id(8)
+        self.parent = parent
+        self.path = path
+        self.attrs = attrs
+        self.error = ''
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.time()
+        self.clock = time.perf_counter()
+        self.token = current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.clock
+        current.reset(self.token)
+        if exc_type is not None:
+            self.error = '{}: {}'.format(exc_type.__name__, exc)
+        record = {
+            'trace': self.trace,
+            'span': self.id,
+            'parent': self.parent,
+            'name': self.name,
+            'service': settings.BASEURL,
+            'start': self.start,
+            'duration': duration,
+            'attrs': self.attrs,
+            'error': self.error,
+        }
+        write(self.path, json.dumps(record, default=str) + '\n')
+
+
+class NoSpan:
+    '''
+    The span when the tracing is disabled
+    '''
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def span(name, parent=None, output=None, **attrs):
+    '''
+    A span in the current trace, or a new trace. parent is a (trace, span)
+    of other process, see parse_traceparent. output overrides TRACE_FILE.
+    '''
+
+    path = output or trace_file()
+    if not path:
+        return NoSpan()
+
+    if parent:
+        trace, parent_id = parent
+    else:
+        cur = current.get()
+        trace, parent_id = (cur.trace, cur.id) if cur else (new_id(16), None)
+    return Span(name, trace, parent_id, path, attrs)
+
+
+def traceparent():
+    '''
+    The header value of the current span, or None
+    '''
+
+    cur = current.get()
+    if cur is None:
+        return None
+    return '00-{}-{}-01'.format(cur.trace, cur.id)
+
+
+def parse_traceparent(value):
+    '''
+    The (trace, span) of a traceparent header, or None if not valid
+    '''
+
+    m = TRACEPARENT.match(value or '')
+    if not m:
+        return None
+    return m.group(1), m.group(2)
+
+
+def load(paths):
+    '''
+    The spans of the files, the broken lines are skipped
+    '''
+
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue
+    return spans
+
+
+def find(spans, name, **attrs):
+    '''
+    The spans with the name and the attrs, the last one first
+    '''
+
+    found = [s for s in spans if s['name'] == name and
+             all(s['attrs'].get(k) == v for k, v in attrs.items())]
+    return sorted(found, key=lambda s: s['start'], reverse=True)
+
+
+def tree(spans, trace):
+    '''
+    (depth, span) of the spans of the trace, each one after its parent and
+    the children by start time
+    '''
+
+    spans = [s for s in spans if s['trace'] == trace]
+    ids = set(s['span'] for s in spans)
+    children = {}
+    for s in spans:
+        parent = s['parent'] if s['parent'] in ids else None
+        children.setdefault(parent, []).append(s)
+
+    def walk(parent, depth):
+        for s in sorted(children.get(parent, []), key=lambda s: s['start']):
+            yield depth, s
+            yield from walk(s['span'], depth + 1)
+
+    return list(walk(None, 0))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
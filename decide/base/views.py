@@ -1,3 +1,42 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+from . import metrics
+
+
+# headers set by a proxy, see docker/docker-nginx.conf
+PROXY_HEADERS = ('HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP', 'HTTP_FORWARDED')
+
+
+def metrics_allowed(request):
+    '''
+    The scraper sends the METRICS_TOKEN as a bearer token, or comes from
+    one of the METRICS_ALLOWED_IPS without a proxy. Behind a proxy, like the
+    nginx of docker, every request comes from its ip, so a proxied request
+    needs the token.
+    '''
+
+    token = settings.METRICS_TOKEN
+    auth = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(auth.encode(), 'Bearer {}'.format(token).encode()):
+        return True
+    if any(h in request.META for h in PROXY_HEADERS):
+        return False
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    '''
+    The metrics of this process in the Prometheus text format, only for
+    the scrapers allowed by metrics_allowed, they have per voting and per
+    auth timings
+    '''
+
+    if not settings.METRICS:
+        raise Http404
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
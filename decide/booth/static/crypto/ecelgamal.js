@@ -0,0 +1,128 @@
+// ElGamal over an elliptic curve, the same scheme as mixnet/ecmixcrypt.py.
+// The points are sent as ints, the SEC1 compressed point read as a number,
+// and 0 is the point at infinity.
+ECElGamal = {};
+
+ECElGamal.CURVES = {
+  // NIST P-256, y^2 = x^3 - 3x + b
+  p256: {
+    p: 'ffffffff00000001000000000000000000000000ffffffffffffffffffffffff',
+    b: '5ac635d8aa3a93e7b3ebbd55769886bc651d06b0cc53b0f63bce3c3e27d2604b',
+    n: 'ffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551',
+  }
+};
+
+// bits of the message padding to find a valid x, like mixnet.ecgroup
+ECElGamal.EMBED_BITS = 8;
+
+ECElGamal.curve = function(name) {
+  var params = ECElGamal.CURVES[name];
+  if (!params)
+    throw "Unknown curve " + name;
+  var p = new BigInt(params.p, 16);
+  var size = p.bitLength();
+  return {
+    p: p,
+    b: new BigInt(params.b, 16),
+    n: new BigInt(params.n, 16),
+    size: size,
+    mask: BigInt.ONE.shiftLeft(size).subtract(BigInt.ONE),
+  };
+};
+
+ECElGamal.double = function(c, P) {
+  if (!P || P.y.signum() == 0)
+    return null;
+  var three = BigInt.fromInt(3);
+  var l = P.x.multiply(P.x).multiply(three).subtract(three)
+    .multiply(P.y.shiftLeft(1).modInverse(c.p)).mod(c.p);
+  var x = l.multiply(l).subtract(P.x.shiftLeft(1)).mod(c.p);
+  var y = l.multiply(P.x.subtract(x)).subtract(P.y).mod(c.p);
+  return {x: x, y: y};
+};
+
+ECElGamal.add = function(c, P, Q) {
+  if (!P)
+    return Q;
+  if (!Q)
+    return P;
+  if (P.x.equals(Q.x)) {
+    if (P.y.equals(Q.y))
+      return ECElGamal.double(c, P);
+    return null;
+  }
+  var l = Q.y.subtract(P.y).multiply(Q.x.subtract(P.x).mod(c.p).modInverse(c.p)).mod(c.p);
+  var x = l.multiply(l).subtract(P.x).subtract(Q.x).mod(c.p);
+  var y = l.multiply(P.x.subtract(x)).subtract(P.y).mod(c.p);
+  return {x: x, y: y};
+};
+
+ECElGamal.mul = function(c, P, k) {
+  var R = null;
+  for (var i = k.bitLength() - 1; i >= 0; i--) {
+    R = ECElGamal.double(c, R);
+    if (k.testBit(i))
+      R = ECElGamal.add(c, R, P);
+  }
+  return R;
+};
+
+ECElGamal.rhs = function(c, x) {
+  return x.multiply(x).multiply(x).subtract(x.multiply(BigInt.fromInt(3)))
+    .add(c.b).mod(c.p);
+};
+
+ECElGamal.sqrt = function(c, a) {
+  // p = 3 mod 4
+  var r = a.modPow(c.p.add(BigInt.ONE).shiftRight(2), c.p);
+  if (!r.multiply(r).mod(c.p).equals(a))
+    return null;
+  return r;
+};
+
+ECElGamal.encode = function(c, P) {
+  if (!P)
+    return BigInt.ZERO;
+  var prefix = BigInt.fromInt(P.y.testBit(0) ? 3 : 2);
+  return prefix.shiftLeft(c.size).add(P.x);
+};
+
+ECElGamal.decode = function(c, n) {
+  if (n.signum() == 0)
+    return null;
+  var odd = n.shiftRight(c.size).testBit(0);
+  var x = n.and(c.mask);
+  var y = ECElGamal.sqrt(c, ECElGamal.rhs(c, x));
+  if (!y)
+    throw "Invalid point";
+  if (y.testBit(0) != odd)
+    y = c.p.subtract(y);
+  return {x: x, y: y};
+};
+
+// point for the clear message m, the message is x without the last bits
+ECElGamal.embed = function(name, m) {
+  var c = ECElGamal.curve(name);
+  var base = m.shiftLeft(ECElGamal.EMBED_BITS);
+  for (var i = 0; i < (1 << ECElGamal.EMBED_BITS); i++) {
+    var x = base.add(BigInt.fromInt(i));
+    var y = ECElGamal.sqrt(c, ECElGamal.rhs(c, x));
+    if (y)
+      return ECElGamal.encode(c, {x: x, y: y});
+  }
+  throw "Can't embed the message in the curve";
+};
+
+// pk.g, pk.y and m are encoded points, pk.curve the curve name
+ECElGamal.encrypt = function(pk, m, r) {
+  var c = ECElGamal.curve(pk.curve);
+  if (!r)
+    r = ElGamal.getRandomInteger(c.n.subtract(BigInt.ONE)).add(BigInt.ONE);
+
+  var G = ECElGamal.decode(c, pk.g);
+  var Y = ECElGamal.decode(c, pk.y);
+  var alpha = ECElGamal.mul(c, G, r);
+  var beta = ECElGamal.add(c, ECElGamal.decode(c, m), ECElGamal.mul(c, Y, r));
+
+  return { alpha: ECElGamal.encode(c, alpha), beta: ECElGamal.encode(c, beta) };
+};
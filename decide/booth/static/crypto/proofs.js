@@ -0,0 +1,113 @@
+// Proofs of the homomorphic votes, the same as mixnet/proofs.py. Each
+// option is a cipher of g^0 or g^1 with a disjunctive Chaum-Pedersen proof
+// that it's one of them, and the vote has a proof that the product of the
+// options is a cipher of g, so only one option is chosen.
+Proofs = {};
+
+// group of the key, mod p or the curve, on the ints of the ciphers
+Proofs.group = function(pk) {
+  if (pk.curve) {
+    var c = ECElGamal.curve(pk.curve);
+    var dec = function(a) { return ECElGamal.decode(c, a); };
+    var enc = function(P) { return ECElGamal.encode(c, P); };
+    return {
+      identity: BigInt.ZERO,
+      order: c.n,
+      op: function(a, b) { return enc(ECElGamal.add(c, dec(a), dec(b))); },
+      power: function(a, e) { return enc(ECElGamal.mul(c, dec(a), e)); },
+      inverse: function(a) {
+        var P = dec(a);
+        return enc(P && {x: P.x, y: c.p.subtract(P.y)});
+      },
+    };
+  }
+  var p = pk.p;
+  var q = p.subtract(BigInt.ONE).shiftRight(1);
+  return {
+    identity: BigInt.ONE,
+    // q for a square g mod a safe prime p = 2q + 1
+    order: pk.g.modPow(q, p).equals(BigInt.ONE) ? q : p.subtract(BigInt.ONE),
+    op: function(a, b) { return a.multiply(b).mod(p); },
+    power: function(a, e) { return a.modPow(e, p); },
+    inverse: function(a) { return a.modInverse(p); },
+  };
+};
+
+// sha256 of the decimal numbers joined by commas, mod the order
+Proofs.challenge = function(order, values) {
+  var text = values.map(function(v) { return v.toString(); }).join(',');
+  var hash = sjcl.codec.hex.fromBits(sjcl.hash.sha256.hash(text));
+  return new BigInt(hash, 16).mod(order);
+};
+
+Proofs.random = function(order) {
+  return ElGamal.getRandomInteger(order.subtract(BigInt.ONE)).add(BigInt.ONE);
+};
+
+// (g^z / a^c, y^z / b^c)
+Proofs.commitment = function(G, pk, a, b, c, z) {
+  return [G.op(G.power(pk.g, z), G.inverse(G.power(a, c))),
+          G.op(G.power(pk.y, z), G.inverse(G.power(b, c)))];
+};
+
+Proofs.unexp = function(G, pk, b, m) {
+  return G.op(b, G.inverse(G.power(pk.g, BigInt.fromInt(m))));
+};
+
+// proof that cipher is (g^r, g^m y^r) with m 0 or 1
+Proofs.proveBit = function(G, pk, cipher, m, r, context) {
+  var other = 1 - m;
+  var fake = [Proofs.random(G.order), Proofs.random(G.order)];
+  var w = Proofs.random(G.order);
+
+  var commits = [];
+  commits[m] = [G.power(pk.g, w), G.power(pk.y, w)];
+  commits[other] = Proofs.commitment(G, pk, cipher.alpha,
+    Proofs.unexp(G, pk, cipher.beta, other), fake[0], fake[1]);
+
+  var c = Proofs.challenge(G.order, context.concat(
+    [pk.g, pk.y, cipher.alpha, cipher.beta], commits[0], commits[1]));
+  var cm = c.subtract(fake[0]).mod(G.order);
+  var proof = [];
+  proof[m] = [cm, w.add(cm.multiply(r)).mod(G.order)];
+  proof[other] = fake;
+  return proof;
+};
+
+// proof that the product of the ciphers is (g^r, g y^r)
+Proofs.proveSum = function(G, pk, ciphers, r, context) {
+  var a = ciphers.reduce(function(x, v) { return G.op(x, v.alpha); }, G.identity);
+  var b = ciphers.reduce(function(x, v) { return G.op(x, v.beta); }, G.identity);
+  var w = Proofs.random(G.order);
+  var c = Proofs.challenge(G.order, context.concat(
+    [pk.g, pk.y, a, b, G.power(pk.g, w), G.power(pk.y, w)]));
+  return [c, w.add(c.multiply(r)).mod(G.order)];
+};
+
+// the vote for the option in the position choice, with its proofs. The
+// context is ['decide', voting id, voter id].
+Proofs.encryptVote = function(pk, choice, options, context) {
+  var G = Proofs.group(pk);
+  var ciphers = [];
+  var total = BigInt.ZERO;
+  var vote = {options: []};
+  for (var i = 0; i < options; i++) {
+    var m = i == choice ? 1 : 0;
+    var r = Proofs.random(G.order);
+    var cipher = {
+      alpha: G.power(pk.g, r),
+      beta: G.op(G.power(pk.g, BigInt.fromInt(m)), G.power(pk.y, r)),
+    };
+    var proof = Proofs.proveBit(G, pk, cipher, m, r, context);
+    ciphers.push(cipher);
+    total = total.add(r);
+    vote.options.push({
+      a: cipher.alpha.toString(),
+      b: cipher.beta.toString(),
+      proof: proof.map(function(cz) { return cz.map(function(n) { return n.toString(); }); }),
+    });
+  }
+  var proof = Proofs.proveSum(G, pk, ciphers, total.mod(G.order), context);
+  vote.proof = proof.map(function(n) { return n.toString(); });
+  return vote;
+};
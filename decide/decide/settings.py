@@ -72,6 +72,8 @@ MODULES = [
 BASEURL = 'http://localhost:8000'
 
 MIDDLEWARE = [
+    'base.middleware.MetricsMiddleware',
+    'base.middleware.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -169,6 +171,119 @@ STATIC_URL = '/static/'
 # number of bits for the key, all auths should use the same number of bits
 KEYBITS = 256
 
+# big integer backend for the mixnet crypto: 'python', 'gmpy2' or 'auto' to
+# use gmpy2 when it's installed
+MIXNET_BACKEND = 'auto'
+
+# the decryption mod p blinds each cipher with a random power of g before
+# the power to the secret key, a side-channel countermeasure that costs the
+# encryption of 1 per cipher. False drops it, only when the timing of the
+# auths can't be measured by whoever sends the ciphers
+MIXNET_DECRYPT_BLINDING = True
+
+# processes used to reencrypt the votes in the mixnet shuffle, 0 means one
+# per core and 1 disables the process pool. The pool is started for each
+# shuffle or decrypt request, so it's off by default and only worth it in
+# the settings of an auth that runs big tallies
+MIXNET_WORKERS = 1
+# votes sent to each worker process at once, smaller shuffles don't use the
+# process pool
+MIXNET_CHUNK_SIZE = 1000
+# folder for the precomputed reencryption factors, see the mixnetpool command
+MIXNET_POOL_DIR = os.path.join(BASE_DIR, 'mixnetpool')
+# folder for the discrete log tables of the homomorphic tally results
+MIXNET_DLOG_DIR = os.path.join(BASE_DIR, 'mixnetdlog')
+# new mixnets use the standard group (RFC 7919 'ffdhe' or RFC 3526 'modp')
+# of KEYBITS size if there's one, then the pregenerated groups from the
+# mixnetgroups command and generate a new group only if the pool is empty
+MIXNET_STANDARD_GROUPS = 'ffdhe'
+# format of the msgs in the shuffle and decrypt calls between auths and from
+# the voting, 'binary' (see mixnet.wire) or 'json'. The views accept both.
+MIXNET_WIRE = 'binary'
+# zlib for the binary msgs, random ciphers hardly compress so it's only
+# worth on slow links
+MIXNET_WIRE_COMPRESS = False
+# max bytes of the msgs of a binary body once decompressed
+MIXNET_WIRE_MAX_SIZE = 1 << 30
+# ballots per chunk when the voting streams the tally through the auths,
+# see mixnet.stream, 0 sends all the ballots in one call
+MIXNET_STREAM_CHUNK_SIZE = 0
+# send each chunk from a thread while the next one is reencrypted
+MIXNET_STREAM_PIPELINE = True
+# folder for the ballots of the streams being received
+MIXNET_STREAM_DIR = os.path.join(BASE_DIR, 'mixnetstream')
+# seconds after which the files of the unfinished streams are removed, when
+# other stream starts
+MIXNET_STREAM_EXPIRY = 24 * 3600
+# key generation of a new mixnet: 'parallel', the first auth calls all the
+# others at once, or 'chain', each auth calls the next one
+MIXNET_KEYGEN = 'parallel'
+# threads for the parallel key generation calls, 0 is one per auth and 1
+# calls the auths one after the other
+MIXNET_KEYGEN_WORKERS = 0
+# folder for the checkpoints of the output of each auth in the tally, a
+# failed tally run again resumes from the first auth without checkpoint,
+# see mixnet.checkpoint. Disabled by default, they hold the ciphers of the
+# whole voting and are never removed by the tally, they are kept until
+# `./manage.py mixnetcheckpoints [voting_id] --purge [--older-than DAYS]`
+MIXNET_CHECKPOINT_DIR = None
+
+# seconds without heartbeat of its worker after which a running tally job
+# is taken again by other worker, see voting.models.TallyJob
+TALLY_JOB_TIMEOUT = 300
+
+# connections kept alive by base.mods for each module, in each thread
+MODS_POOL_CONNECTIONS = 10
+MODS_POOL_MAXSIZE = 10
+# (connect, read) timeout in seconds of the queries between modules, the
+# tally calls to the auths can take long so there's no read timeout
+MODS_TIMEOUT = (5, None)
+# the queries to the modules of this process, the ones in MODULES with
+# the BASEURL in APIS, call the views directly instead of a request to
+# BASEURL
+MODS_LOCAL = True
+# threads of the concurrent queries between modules, see mods.aquery,
+# None is the default of ThreadPoolExecutor
+MODS_ASYNC_WORKERS = None
+# seconds the answers of mods.get are cached for each module, the modules
+# not listed aren't cached. Saving a voting invalidates the cached ones of
+# its process, so the store, that checks the dates of the voting, doesn't
+# use the cache
+MODS_CACHE_TTL = {
+    'voting': 5,
+}
+# cache of mods.get in CACHES
+MODS_CACHE = 'mods'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # each worker has its entries, for all the workers of the node use
+    #   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #   'LOCATION': '/var/tmp/decide_mods',
+    'mods': {
+        'BACKEND': 'base.cache.LRUCache',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# /metrics, the counters and histograms of each process in the Prometheus
+# text format, see base.metrics. Only for the scrapers that send the
+# METRICS_TOKEN as a bearer token or come from the METRICS_ALLOWED_IPS. The
+# ips are only checked for requests without proxy headers, behind the nginx
+# of docker all the requests come from it and the token is needed
+METRICS = False
+METRICS_TOKEN = ''
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+# json lines file where each process appends the spans of the traces, the
+# tally through the auths, see base.tracing and the tallytrace command.
+# '' disables the tracing. Only the requests with a valid token follow the
+# traceparent of the caller. Past TRACE_FILE_MAX_SIZE bytes the file is
+# moved to TRACE_FILE.1 and a new one is started, 0 never rotates it
+TRACE_FILE = ''
+TRACE_FILE_MAX_SIZE = 64 * 2**20
+
 # Versioning
 ALLOWED_VERSIONS = ['v1', 'v2']
 DEFAULT_VERSION = 'v1'
@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_swagger.views import get_swagger_view
 
+from base.views import metrics_view
+
 
 schema_view = get_swagger_view(title='Decide API')
 
@@ -25,6 +27,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('doc/', schema_view),
     path('gateway/', include('gateway.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 for module in settings.MODULES:
@@ -0,0 +1,115 @@
+'''
+Big integer backends for the mixnet modular arithmetic.
+
+All the ElGamal operations done by MixCrypt are expressed in terms of the
+small interface defined here, so the engine can be changed without touching
+the crypto code. The pure python backend is always available, the gmpy2
+backend uses GMP and is much faster with big keys.
+
+>>> py = get_backend('python')
+>>> py.powmod(156, 130, 167)
+89
+>>> py.invert(130, 167) * 130 % 167
+1
+>>> py.batch_invert([2, 3, 130], 167) == [py.invert(i, 167) for i in (2, 3, 130)]
+True
+'''
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+from Crypto.Util.number import inverse
+
+
+class PythonBackend:
+    name = 'python'
+
+    def mpz(self, n):
+        return int(n)
+
+    def powmod(self, b, e, m):
+        return pow(b, e, m)
+
+    def mulmod(self, a, b, m):
+        return (a * b) % m
+
+    def invert(self, a, m):
+        return inverse(a, m)
+
+    def batch_invert(self, values, m):
+        '''
+        Montgomery's trick, inverts all the values with only one modular
+        inversion and 3 multiplications per value. m should be prime.
+        '''
+
+        if not values:
+            return []
+
+        prods = []
+        acc = self.mpz(1)
+        for v in values:
+            acc = acc * v % m
+            prods.append(acc)
+        if not acc:
+            raise ValueError('Value not invertible')
+
+        inv = self.invert(acc, m)
+        invs = [None] * len(values)
+        for i in range(len(values) - 1, 0, -1):
+            invs[i] = inv * prods[i - 1] % m
+            inv = inv * values[i] % m
+        invs[0] = inv
+        return invs
+
+
+class GMPBackend(PythonBackend):
+    name = 'gmpy2'
+
+    def mpz(self, n):
+        return gmpy2.mpz(int(n))
+
+    def powmod(self, b, e, m):
+        return gmpy2.powmod(b, e, m)
+
+    def invert(self, a, m):
+        return gmpy2.invert(a, m)
+
+
+BACKENDS = {
+    'python': PythonBackend,
+    'gmpy2': GMPBackend,
+}
+
+
+def available():
+    '''
+    List of the backend names that can be used in this installation
+    '''
+
+    return [name for name in BACKENDS if name != 'gmpy2' or gmpy2]
+
+
+def get_backend(name=None):
+    '''
+    Returns a backend instance by name.
+
+    With 'auto' or no name, gmpy2 is used if it's installed and the pure
+    python backend otherwise.
+    '''
+
+    if not name or name == 'auto':
+        name = 'gmpy2' if gmpy2 else 'python'
+
+    if name not in BACKENDS:
+        raise ValueError('Unknown mixnet backend: {}'.format(name))
+    if name == 'gmpy2' and not gmpy2:
+        raise ImportError('The gmpy2 mixnet backend requires gmpy2 installed')
+
+    return BACKENDS[name]()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
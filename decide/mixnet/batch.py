@@ -0,0 +1,186 @@
+'''
+Compact container for a list of ElGamal ciphers.
+
+A list of [a, b] python ints costs more than 100 bytes per int, so a
+million ballots take hundreds of MB. CiphertextBatch keeps the a and the b
+of every cipher as fixed-width big-endian byte columns, all the a and then
+all the b in one contiguous buffer, so a 2048-bit cipher takes 512 bytes.
+
+Slicing doesn't copy anything, the slice is a view of the same buffer, so a
+batch can be split in chunks for the process pool workers. The list form
+used by the API is still available with from_list and to_list.
+
+>>> batch = CiphertextBatch.from_list([[1, 2], [3, 4], [5, 6]], width=2)
+>>> len(batch), batch.nbytes
+(3, 12)
+>>> batch[1]
+(3, 4)
+>>> chunk = batch[1:]
+>>> chunk.to_list()
+[[3, 4], [5, 6]]
+>>> chunk[0] = (7, 8)
+>>> batch.to_list()
+[[1, 2], [7, 8], [5, 6]]
+>>> batch.permute([2, 0, 1]).to_list()
+[[5, 6], [1, 2], [7, 8]]
+>>> CiphertextBatch.concat([batch[:1], batch[2:]]).to_list()
+[[1, 2], [5, 6]]
+'''
+
+
+def key_width(p, curve=''):
+    '''
+    Bytes of each int of a cipher for the key with prime p
+    '''
+
+    width = (int(p).bit_length() + 7) // 8
+    if curve:
+        # compressed points have a prefix byte
+        width += 1
+    return width
+
+
+class CiphertextBatch:
+    def __init__(self, width, a, b):
+        '''
+        a and b are the columns, memoryviews or bytes-like objects of the
+        same size, a multiple of width
+        '''
+
+        self.width = width
+        self.a = memoryview(a)
+        self.b = memoryview(b)
+        if len(self.a) != len(self.b) or len(self.a) % width:
+            raise ValueError('Wrong column sizes for width {}'.format(width))
+
+    @classmethod
+    def empty(cls, n, width):
+        data = memoryview(bytearray(2 * n * width))
+        return cls(width, data[:n * width], data[n * width:])
+
+    @classmethod
+    def frombuffer(cls, data, width):
+        '''
+        Batch on a buffer with the a column and then the b column
+        '''
+
+        data = memoryview(data)
+        half = len(data) // 2
+        return cls(width, data[:half], data[half:])
+
+    @classmethod
+    def from_list(cls, msgs, width):
+        '''
+        Batch with the [a, b] pairs of msgs, any iterable of pairs
+        '''
+
+        a, b = bytearray(), bytearray()
+        try:
+            for x, y in msgs:
+                a += int(x).to_bytes(width, 'big')
+                b += int(y).to_bytes(width, 'big')
+        except OverflowError:
+            raise ValueError('Cipher too big for {} bytes'.format(width))
+        return cls.frombuffer(a + b, width)
+
+    @classmethod
+    def concat(cls, batches):
+        batches = list(batches)
+        if not batches:
+            raise ValueError('No batches to concat')
+        width = batches[0].width
+        data = b''.join([bytes(x.a) for x in batches] + [bytes(x.b) for x in batches])
+        return cls.frombuffer(bytearray(data), width)
+
+    def __len__(self):
+        return len(self.a) // self.width
+
+    @property
+    def nbytes(self):
+        return len(self.a) + len(self.b)
+
+    def item(self, column, i):
+        w = self.width
+        return int.from_bytes(column[i * w:(i + 1) * w], 'big')
+
+    def __getitem__(self, i):
+        w = self.width
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step != 1:
+                raise ValueError('Batch slices must be contiguous')
+            stop = max(start, stop)
+            return self.__class__(w, self.a[start * w:stop * w],
+                                  self.b[start * w:stop * w])
+
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('Batch index out of range')
+        return self.item(self.a, i), self.item(self.b, i)
+
+    def __setitem__(self, i, cipher):
+        w = self.width
+        a, b = cipher
+        self.a[i * w:(i + 1) * w] = int(a).to_bytes(w, 'big')
+        self.b[i * w:(i + 1) * w] = int(b).to_bytes(w, 'big')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.item(self.a, i), self.item(self.b, i)
+
+    def __eq__(self, other):
+        if not isinstance(other, CiphertextBatch):
+            return NotImplemented
+        return self.to_list() == other.to_list()
+
+    def __reduce__(self):
+        # memoryviews can't be pickled, the process pool gets the bytes
+        return (self.__class__.frombuffer, (self.tobytes(), self.width))
+
+    def tobytes(self):
+        return self.a.tobytes() + self.b.tobytes()
+
+    def to_list(self):
+        return [[a, b] for a, b in self]
+
+    def column(self, name):
+        '''
+        Ints of the a or b column
+        '''
+
+        column = getattr(self, name)
+        return [self.item(column, i) for i in range(len(self))]
+
+    def chunks(self, chunk_size):
+        return [self[i:i + chunk_size] for i in range(0, len(self), chunk_size)]
+
+    def permute(self, perm):
+        '''
+        New batch with the cipher perm[i] in the position i
+        '''
+
+        w = self.width
+        out = self.empty(len(perm), w)
+        for i, j in enumerate(perm):
+            out.a[i * w:(i + 1) * w] = self.a[j * w:(j + 1) * w]
+            out.b[i * w:(i + 1) * w] = self.b[j * w:(j + 1) * w]
+        return out
+
+    def replace_b(self, values):
+        '''
+        New batch with the same a column and the values as b, like the
+        partial decryptions of the auths that aren't the last one
+        '''
+
+        a = bytearray(self.a)
+        b = bytearray()
+        for v in values:
+            b += int(v).to_bytes(self.width, 'big')
+        return self.__class__(self.width, a, b)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
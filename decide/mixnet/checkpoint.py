@@ -0,0 +1,192 @@
+'''
+Checkpoints of the output of each auth in the tally.
+
+The shuffle and the decrypt of a big voting take hours, and if one auth
+fails the work of the others was lost. Each auth saves its output in
+
+    MIXNET_CHECKPOINT_DIR/<voting>/<position>/<op>-<digest>.<ext>
+
+where digest is a sha256 of everything the output depends on, the op, the
+keys, the options of the call and the msgs. When a failed tally is run
+again, the auths that already did their part answer from the checkpoint,
+the same output as before, so the next auth finds its checkpoint too and
+the tally resumes from the first auth that didn't finish.
+
+The ciphers are saved in the binary format of mixnet.wire, one body or
+several appended ones, and the clears of the last decrypt as json. See the
+mixnetcheckpoints command to list and purge them.
+
+>>> import tempfile
+>>> directory = tempfile.mkdtemp()
+>>> batch = CiphertextBatch.from_list([[1, 2], [3, 4]], 2)
+>>> key = digest('shuffle', (7, 2, 4), [batch.a, batch.b])
+>>> ckpt = Checkpoint(directory, 1, 0, 'shuffle', key)
+>>> ckpt.load() is None
+True
+>>> ckpt.save(batch.permute([1, 0]))
+>>> ckpt.load().to_list()
+[[3, 4], [1, 2]]
+>>> Checkpoint(directory, 1, 1, 'decrypt', key).save([5, 6])
+>>> [(c.position, c.op, c.load()) for c in Checkpoint.all(directory, 1)][1:]
+[(1, 'decrypt', [5, 6])]
+>>> writer = Checkpoint(directory, 2, 0, 'shuffle', key).writer()
+>>> writer.append(batch[:1])
+>>> writer.append(batch[1:])
+>>> writer.commit()
+>>> Checkpoint(directory, 2, 0, 'shuffle', key).load().to_list()
+[[1, 2], [3, 4]]
+>>> key == digest('shuffle', (7, 2, 4), [batch.a, batch.b], last=False)
+False
+'''
+
+import hashlib
+import json
+import os
+import re
+
+from .batch import CiphertextBatch
+from . import wire
+
+
+NAME = re.compile(r'^(?P<op>[a-z]+)-(?P<digest>[0-9a-f]{64})\.(?P<ext>dmx|json)$')
+
+
+def digest(op, keys, blocks, **options):
+    '''
+    sha256 of the op, the keys (ints), the options and the blocks of bytes
+    of the msgs
+    '''
+
+    h = hashlib.sha256()
+    meta = [op, [int(k) for k in keys], options]
+    h.update(json.dumps(meta, sort_keys=True).encode())
+    for block in blocks:
+        h.update(block)
+    return h.hexdigest()
+
+
+class Checkpoint:
+    def __init__(self, directory, voting_id, position, op, digest):
+        self.voting_id = int(voting_id)
+        self.position = int(position)
+        self.op = op
+        self.digest = digest
+        self.directory = os.path.join(directory, str(self.voting_id), str(self.position))
+        self.base = os.path.join(self.directory, '{}-{}'.format(op, digest))
+
+    def __str__(self):
+        return '{}/{} {} {}'.format(self.voting_id, self.position, self.op, self.digest[:16])
+
+    @classmethod
+    def all(cls, directory, voting_id=None):
+        '''
+        Saved checkpoints, of all the votings or only of one
+        '''
+
+        if voting_id is not None:
+            votings = [str(voting_id)]
+        elif os.path.isdir(directory):
+            votings = sorted(os.listdir(directory), key=lambda v: (len(v), v))
+        else:
+            votings = []
+
+        for vid in votings:
+            vdir = os.path.join(directory, vid)
+            if not vid.isdigit() or not os.path.isdir(vdir):
+                continue
+            for position in sorted(os.listdir(vdir), key=lambda p: (len(p), p)):
+                pdir = os.path.join(vdir, position)
+                if not position.isdigit() or not os.path.isdir(pdir):
+                    continue
+                for name in sorted(os.listdir(pdir)):
+                    m = NAME.match(name)
+                    if m:
+                        yield cls(directory, vid, position, m.group('op'), m.group('digest'))
+
+    @property
+    def path(self):
+        for ext in ('dmx', 'json'):
+            path = '{}.{}'.format(self.base, ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def size(self):
+        path = self.path
+        return os.path.getsize(path) if path else 0
+
+    def mtime(self):
+        path = self.path
+        return os.path.getmtime(path) if path else 0
+
+    def load(self):
+        '''
+        The saved output, a CiphertextBatch or the list of clears, or None
+        '''
+
+        path = self.path
+        if not path:
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.endswith('.json'):
+            return json.loads(data.decode())
+        batches = [wire.decode(body)['msgs'] for body in wire.split(data)]
+        return batches[0] if len(batches) == 1 else CiphertextBatch.concat(batches)
+
+    def save(self, msgs):
+        if isinstance(msgs, CiphertextBatch):
+            writer = self.writer()
+            writer.append(msgs)
+        else:
+            writer = self.writer('.json')
+            writer.write(json.dumps(list(msgs)).encode())
+        writer.commit()
+
+    def writer(self, ext='.dmx'):
+        '''
+        Writer of the output as it is computed, see CheckpointWriter
+        '''
+
+        os.makedirs(self.directory, exist_ok=True)
+        return CheckpointWriter(self.base + ext)
+
+    def remove(self):
+        path = self.path
+        if path:
+            os.remove(path)
+
+
+class CheckpointWriter:
+    '''
+    Append-only temp file of a checkpoint, the batches are written as they
+    come and the file is synced and renamed by commit, a crash never leaves
+    half a checkpoint
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = '{}.{}.tmp'.format(path, os.getpid())
+        self.file = open(self.tmp, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def append(self, batch):
+        self.write(wire.encode({}, batch))
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp, self.path)
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.tmp)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
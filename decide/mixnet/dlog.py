@@ -0,0 +1,138 @@
+'''
+Discrete logs for the results of the homomorphic tally.
+
+The auths decrypt g^count and the count is at most the census size n, so
+the baby-step giant-step algorithm finds it with about sqrt(n)
+multiplications, using a table of the m = sqrt(n) baby steps g^j. The table
+only depends on (p, g), so it's stored on disk sorted by g^j, and memory
+mapped and binary searched when it's used again, by the next tally with the
+same group. The group can be the multiplicative group mod p or an elliptic
+curve, the elements are ints in both cases and the table keeps the low 64
+bits of each one.
+
+>>> import tempfile
+>>> table = DlogTable.get(167, 2, 100, tempfile.mkdtemp())
+>>> table.m
+11
+>>> table.log(pow(2, 57, 167), 100)
+57
+>>> table.log(1, 100)
+0
+'''
+
+import os
+import math
+import mmap
+import struct
+import hashlib
+
+from .groups import ModGroup
+
+
+# number of baby steps of the table
+HEADER = struct.Struct('>Q')
+# low 64 bits of g^j and j, the full g^j is checked on each match
+RECORD = struct.Struct('>QI')
+MASK = (1 << 64) - 1
+
+# tables already mapped by this process, by path
+_tables = {}
+
+
+class DlogTable:
+    def __init__(self, p, g, path, group=None):
+        self.p = int(p)
+        self.g = int(g)
+        self.group = group or ModGroup(p)
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.m, = HEADER.unpack_from(self.data, 0)
+        # g^-m, each giant step
+        self.giant = self.group.power(self.group.inverse(self.g), self.m)
+
+    @staticmethod
+    def table_path(p, g, directory):
+        key = '{},{}'.format(int(p), int(g)).encode()
+        name = hashlib.sha256(key).hexdigest()[:32]
+        return os.path.join(directory, '{}.dlog'.format(name))
+
+    @classmethod
+    def get(cls, p, g, bound, directory, group=None):
+        '''
+        Table to find discrete logs up to bound, the table on disk is reused
+        if it's big enough or replaced by a bigger one
+        '''
+
+        m = math.isqrt(bound) + 1
+        path = cls.table_path(p, g, directory)
+        group = group or ModGroup(p)
+
+        table = _tables.get(path)
+        if not table and os.path.exists(path):
+            table = cls(p, g, path, group)
+        if not table or table.m < m:
+            cls.build(g, m, path, group)
+            table = cls(p, g, path, group)
+        _tables[path] = table
+        return table
+
+    @staticmethod
+    def build(g, m, path, group):
+        records = []
+        x = group.identity
+        for j in range(m):
+            records.append((x & MASK, j))
+            x = group.op(x, g)
+        records.sort()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, so other processes never map half a table
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(m))
+            f.write(b''.join(RECORD.pack(*r) for r in records))
+        os.replace(tmp, path)
+
+    def record(self, i):
+        return RECORD.unpack_from(self.data, HEADER.size + i * RECORD.size)
+
+    def baby_steps(self, key):
+        '''
+        Exponents j of the records whose g^j has these low 64 bits
+        '''
+
+        lo, hi = 0, self.m
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        while lo < self.m:
+            k, j = self.record(lo)
+            if k != key:
+                break
+            yield j
+            lo += 1
+
+    def log(self, h, bound):
+        '''
+        Exponent 0 <= e <= bound with g^e = h (mod p)
+        '''
+
+        group = self.group
+        h = int(h)
+        for i in range(bound // self.m + 1):
+            for j in self.baby_steps(h & MASK):
+                e = i * self.m + j
+                if e <= bound and group.power(self.g, j) == h:
+                    return e
+            h = group.op(h, self.giant)
+        raise ValueError('discrete log not found up to {}'.format(bound))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
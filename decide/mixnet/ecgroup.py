@@ -0,0 +1,177 @@
+'''
+Elliptic curve group for the EC ElGamal mixnet keys.
+
+The point arithmetic is the one of pycryptodome, Crypto.PublicKey.ECC, this
+module only adapts it to the group interface of the mixnet. Outside this
+module a point is always an int, its SEC1 compressed form (0x02 or 0x03 and
+then x) read as a big-endian number, and 0 is the point at infinity. So the
+ciphers are still pairs of ints, like in the multiplicative group, but much
+smaller.
+
+The clear messages are mapped to points with the Koblitz method, the
+message is the x coordinate without its last 8 bits.
+
+>>> group = EcGroup('p256', 'python')
+>>> group.extract(group.embed(42))
+42
+>>> P = group.power(group.g, 12345)
+>>> group.op(P, group.inverse(P))
+0
+>>> group.op(group.power(group.g, 2), group.g) == group.power(group.g, 3)
+True
+>>> group.power(group.g, group.n)
+0
+'''
+
+from Crypto.PublicKey.ECC import EccPoint
+
+from .backends import get_backend
+
+
+# NIST P-256 (FIPS 186-4), y^2 = x^3 - 3x + b
+CURVES = {
+    'p256': {
+        'p': 0xffffffff00000001000000000000000000000000ffffffffffffffffffffffff,
+        'b': 0x5ac635d8aa3a93e7b3ebbd55769886bc651d06b0cc53b0f63bce3c3e27d2604b,
+        'n': 0xffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551,
+        'gx': 0x6b17d1f2e12c4247f8bce6e563a440f277037d812deb33a0f4a13945d898c296,
+        'gy': 0x4fe342e2fe1a7f9b8ee7eb4a7c0f9e162bce33576b315ececbb6406837bf51f5,
+    },
+}
+
+# bits of the message padding to find a valid x
+EMBED_BITS = 8
+
+
+class EcGroup:
+    identity = 0
+
+    def __init__(self, curve='p256', backend=None):
+        if curve not in CURVES:
+            raise ValueError('Unknown curve {}'.format(curve))
+        if isinstance(backend, str) or backend is None:
+            backend = get_backend(backend)
+        # only for the square roots of the decoding and the embedding
+        self.backend = bk = backend
+
+        params = CURVES[curve]
+        self.curve = curve
+        self.p = bk.mpz(params['p'])
+        self.b = bk.mpz(params['b'])
+        self.n = params['n']
+        self.size = int(self.p).bit_length()
+        self.mask = (1 << self.size) - 1
+        self.g = self.encode_affine(params['gx'], params['gy'])
+
+    # points of pycryptodome
+
+    @property
+    def infinity(self):
+        return EccPoint(0, 0, self.curve)
+
+    def add(self, P, Q):
+        return P + Q
+
+    def neg(self, P):
+        return -P
+
+    def mul(self, P, k):
+        return P * (int(k) % self.n)
+
+    # encoding
+
+    def encode_affine(self, x, y):
+        return ((2 + (int(y) & 1)) << self.size) | int(x)
+
+    def encode(self, P):
+        if P.is_point_at_infinity():
+            return 0
+        x, y = P.xy
+        return self.encode_affine(x, y)
+
+    def encode_many(self, points):
+        return [self.encode(P) for P in points]
+
+    def rhs(self, x):
+        return (x * x * x - 3 * x + self.b) % self.p
+
+    def sqrt(self, a):
+        # p = 3 mod 4
+        r = self.backend.powmod(a, (self.p + 1) // 4, self.p)
+        if r * r % self.p != a:
+            return None
+        return r
+
+    def decode(self, n):
+        n = int(n)
+        if not n:
+            return self.infinity
+        prefix, x = n >> self.size, n & self.mask
+        if prefix not in (2, 3) or x >= self.p:
+            raise ValueError('Invalid point {}'.format(n))
+        x = self.backend.mpz(x)
+        y = self.sqrt(self.rhs(x))
+        if y is None:
+            raise ValueError('Invalid point {}'.format(n))
+        if (int(y) & 1) != (prefix & 1):
+            y = self.p - y
+        # pycryptodome checks again that the point is in the curve
+        return EccPoint(int(x), int(y), self.curve)
+
+    def embed(self, m):
+        '''
+        Point for the message m
+        '''
+
+        base = int(m) << EMBED_BITS
+        for i in range(1 << EMBED_BITS):
+            x = self.backend.mpz(base + i)
+            if x >= self.p:
+                break
+            y = self.sqrt(self.rhs(x))
+            if y is not None:
+                return self.encode_affine(x, y)
+        raise ValueError("Can't embed {} in the curve".format(m))
+
+    def extract(self, n):
+        '''
+        Message of a point made by embed
+        '''
+
+        return (int(n) & self.mask) >> EMBED_BITS
+
+    # group interface on the encoded points, like groups.ModGroup
+
+    def op(self, a, b):
+        return self.encode(self.decode(a) + self.decode(b))
+
+    def inverse(self, a):
+        return self.encode(-self.decode(a))
+
+    def power(self, a, e):
+        return self.encode(self.mul(self.decode(a), e))
+
+    def product(self, elements):
+        R = self.infinity
+        for a in elements:
+            R += self.decode(a)
+        return self.encode(R)
+
+    def random_exponent(self, rng):
+        return 1 + rng.randrange(self.n - 1)
+
+    def order(self, g):
+        # the curve has cofactor 1, every point has order n
+        return self.n
+
+    def contains(self, a, order=None):
+        try:
+            self.decode(a)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,149 @@
+'''
+ElGamal over an elliptic curve, with the same interface as MixCrypt.
+
+The key keeps the p, g, y, x names, p is the prime of the curve field, g
+the generator point and y = x * g the public point, so the keys are stored
+in base.models.Key like the multiplicative group ones, with the curve name.
+The ciphers are pairs of points (r * g, m + r * y), see ecgroup for their
+encoding as ints.
+
+>>> k = EcMixCrypt(curve='p256', backend='python')
+>>> clears = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+>>> cipher = [k.encrypt(k.encode(m)) for m in clears]
+>>> shuffled = k.shuffle(cipher)
+>>> sorted(k.decode(m) for m in k.multiple_decrypt(shuffled))
+[2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+
+>>> from mixnet.mixcrypt import gen_multiple_key, multiple_decrypt_shuffle
+>>> k1 = EcMixCrypt(backend='python')
+>>> k2 = EcMixCrypt(k=k1.k, backend='python')
+>>> k3 = gen_multiple_key(k1, k2)
+>>> cipher = [k3.encrypt(k3.encode(m)) for m in clears]
+>>> d = multiple_decrypt_shuffle(cipher, k1, k2)
+>>> sorted(k3.decode(m) for m in d)
+[2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+'''
+
+import time
+
+from .ecgroup import EcGroup
+from .mixcrypt import MixCrypt, count
+from . import randpool
+
+
+DEFAULT_CURVE = 'p256'
+
+
+class EcKey:
+    def __init__(self, p, g, y=None, x=None, curve=DEFAULT_CURVE):
+        self.p = p
+        self.g = g
+        self.y = y
+        self.x = x
+        self.curve = curve
+
+
+class EcMixCrypt(MixCrypt):
+    identity = 0
+
+    def __init__(self, k=None, bits=256, backend=None, curve=None):
+        self.curve = curve or getattr(k, 'curve', '') or DEFAULT_CURVE
+        self.ec = EcGroup(self.curve, backend)
+        super().__init__(k=k, bits=self.ec.size, backend=backend)
+
+    def rand(self):
+        return self.ec.random_exponent(randpool.pool)
+
+    def genk(self):
+        return self.getk(self.ec.p, self.ec.g)
+
+    def getk(self, p, g):
+        x = self.rand()
+        y = self.ec.power(g, x)
+        self.k = EcKey(int(p), int(g), y, x, self.curve)
+        return self.k
+
+    def setk(self, p, g, y, x):
+        self.k = EcKey(int(p), int(g), int(y), int(x), self.curve)
+        return self.k
+
+    @staticmethod
+    def construct(params, curve=DEFAULT_CURVE):
+        p, g, y = map(int, params)
+        return EcKey(p, g, y, curve=curve)
+
+    @property
+    def group(self):
+        return self.ec
+
+    def encode(self, m):
+        return self.ec.embed(m)
+
+    def decode(self, m):
+        return self.ec.extract(m)
+
+    def precompute(self, pubkey=None):
+        params = self.params(pubkey)
+        if params not in self.tables:
+            start = time.perf_counter()
+            p, g, y = params
+            # the points decoded once, the multiplication is pycryptodome's
+            self.tables[params] = (self.ec.decode(g), self.ec.decode(y))
+            count('precompute', 1, start)
+        return self.tables[params]
+
+    def encrypt_points(self, M, params, r=None):
+        '''
+        (r * g, M + r * y) for the point M
+        '''
+
+        ec = self.ec
+        if r is None:
+            r = self.rand()
+
+        points = self.tables.get(params)
+        if points:
+            G, Y = points
+        else:
+            p, g, y = params
+            G, Y = ec.decode(g), ec.decode(y)
+        return ec.mul(G, r), ec.add(M, ec.mul(Y, r))
+
+    def encrypt_params(self, m, params, r=None):
+        A, B = self.encrypt_points(self.ec.decode(m), params, r)
+        a, b = self.ec.encode_many([A, B])
+        return a, b
+
+    def decrypt(self, c):
+        return self.decrypt_batch([c])[0]
+
+    def decrypt_batch(self, msgs):
+        '''
+        b - x * a for each cipher
+
+        >>> k = EcMixCrypt(backend='python')
+        >>> cipher = [k.encrypt(k.encode(m)) for m in range(2, 6)]
+        >>> [k.decode(m) for m in k.decrypt_batch(cipher)]
+        [2, 3, 4, 5]
+        '''
+
+        ec = self.ec
+        x = int(self.k.x)
+        return ec.encode_many([ec.add(ec.decode(b), ec.neg(ec.mul(ec.decode(a), x)))
+                               for a, b in msgs])
+
+    def reencrypt(self, cipher, pubkey=None, factor=None):
+        ec = self.ec
+        params = self.params(pubkey)
+        A, B = map(ec.decode, cipher)
+        if factor:
+            F1, F2 = map(ec.decode, factor)
+        else:
+            F1, F2 = self.encrypt_points(ec.infinity, params)
+        a, b = ec.encode_many([ec.add(A, F1), ec.add(B, F2)])
+        return a, b
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
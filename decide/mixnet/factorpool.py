@@ -0,0 +1,114 @@
+'''
+Pool of precomputed reencryption factors.
+
+A reencryption multiplies the cipher by an encryption of 1, (g^r, y^r),
+that doesn't depend on the message, so they can be computed before the
+tally, when the auths are idle, and stored on disk. Then the shuffle only
+needs two modular multiplications per vote.
+
+Each factor must be used only once, so they are taken from the end of the
+file and the file is truncated in the same locked operation.
+
+>>> import tempfile
+>>> pool = FactorPool((167, 156, 89), tempfile.mkdtemp())
+>>> pool.add([(1, 2), (3, 4), (5, 6)])
+>>> pool.size()
+3
+>>> pool.take(2)
+[(3, 4), (5, 6)]
+>>> pool.take(2)
+[(1, 2)]
+>>> pool.take(2)
+[]
+'''
+
+import os
+import fcntl
+import hashlib
+
+from .batch import key_width
+from .parallel import map_chunks, num_workers
+from .mixcrypt import factors_chunk
+
+
+class FactorPool:
+    def __init__(self, pubkey, directory, curve=''):
+        self.params = tuple(map(int, pubkey))
+        self.directory = directory
+        self.curve = curve
+        self.width = key_width(self.params[0], curve)
+        self.record = self.width * 2
+
+    @property
+    def path(self):
+        key = ','.join(map(str, self.params))
+        if self.curve:
+            key += ',' + self.curve
+        name = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, '{}.pool'.format(name))
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path) // self.record
+        except FileNotFoundError:
+            return 0
+
+    def encode(self, factor):
+        return b''.join(int(n).to_bytes(self.width, 'big') for n in factor)
+
+    def decode(self, data):
+        w = self.width
+        factors = []
+        for i in range(0, len(data), self.record):
+            a = int.from_bytes(data[i:i + w], 'big')
+            b = int.from_bytes(data[i + w:i + self.record], 'big')
+            factors.append((a, b))
+        return factors
+
+    def add(self, factors):
+        os.makedirs(self.directory, exist_ok=True)
+        data = b''.join(self.encode(f) for f in factors)
+        with open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(data)
+
+    def take(self, n):
+        '''
+        Removes up to n factors from the pool and returns them
+        '''
+
+        if not n:
+            return []
+
+        try:
+            f = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return []
+
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            total = os.fstat(f.fileno()).st_size // self.record
+            n = min(n, total)
+            start = (total - n) * self.record
+            f.seek(start)
+            data = f.read(n * self.record)
+            f.truncate(start)
+
+        return self.decode(data)
+
+    def fill(self, n, bits=256, backend=None, workers=1, chunk_size=1000):
+        '''
+        Computes n new factors and adds them to the pool
+        '''
+
+        args = (self.params, bits, backend, self.curve)
+        step = chunk_size * num_workers(workers)
+        for i in range(0, n, step):
+            items = list(range(i, min(n, i + step)))
+            self.add(map_chunks(factors_chunk, items, workers, chunk_size, args))
+        return n
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,79 @@
+'''
+Fixed-base exponentiation with precomputed tables.
+
+The generator and the public key don't change during a voting, so every
+power of them can be computed as a product of precomputed values instead of
+a full modular exponentiation. With a window of w bits, the table keeps
+base^(d * 2^(w*i)) for every digit d and every window position i, and then
+base^e is just one multiplication per non zero digit of e.
+
+>>> t = FixedBase(156, 167, bits=8, window=2)
+>>> t.pow(130) == pow(156, 130, 167)
+True
+>>> [t.pow(e) for e in range(4)] == [pow(156, e, 167) for e in range(4)]
+True
+>>> t.pow(2**20) == pow(156, 2**20, 167)
+True
+'''
+
+from .backends import get_backend
+
+
+def default_window(bits):
+    '''
+    Window size in bits, bigger windows make the table grow exponentially
+    so we only use wide windows for big keys.
+    '''
+
+    if bits <= 256:
+        return 4
+    if bits <= 1024:
+        return 5
+    return 6
+
+
+class FixedBase:
+    def __init__(self, base, p, bits=None, window=None, backend=None):
+        if isinstance(backend, str) or backend is None:
+            backend = get_backend(backend)
+        self.backend = bk = backend
+
+        self.p = bk.mpz(p)
+        self.bits = bits or int(p).bit_length()
+        self.window = window or default_window(self.bits)
+        self.mask = (1 << self.window) - 1
+        self.base = bk.mpz(base) % self.p
+
+        rows = (self.bits + self.window - 1) // self.window
+        self.table = []
+        row_base = self.base
+        for i in range(rows):
+            row = [bk.mpz(1), row_base]
+            for d in range(2, 1 << self.window):
+                row.append(bk.mulmod(row[-1], row_base, self.p))
+            self.table.append(row)
+            row_base = bk.mulmod(row[-1], row_base, self.p)
+
+    def pow(self, e):
+        bk = self.backend
+        e = int(e)
+        if e < 0 or e.bit_length() > len(self.table) * self.window:
+            return bk.powmod(self.base, bk.mpz(e), self.p)
+
+        p = self.p
+        w = self.window
+        mask = self.mask
+        result = bk.mpz(1)
+        for row in self.table:
+            if not e:
+                break
+            d = e & mask
+            if d:
+                result = result * row[d] % p
+            e >>= w
+        return result
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,85 @@
+'''
+Fixed-exponent schedules for the decryption with the auth's secret key.
+
+Every decryption of an auth multiplies a different cipher by the same secret
+x, so the recoding of x is done only once. x is written in width-w NAF, with
+odd signed digits |d| < 2^(w-1) and at least w-1 zeros between two of them,
+and the schedule keeps, from the most significant digit, the doublings
+before each digit and the digit. Then k * A is one doubling per bit and
+one addition of a precomputed odd multiple of A per digit, about
+bits / (w + 1) additions.
+
+This only pays off when the group operations are python code. In the
+multiplicative group mod p, pow and gmpy2.powmod already use a sliding
+window in C and a python schedule is slower, and the elliptic curves use
+the scalar multiplication of pycryptodome, see the fixedexp bench in
+test-scripts/bench-mixnet.py.
+
+>>> e = FixedExponent(1234567, window=4)
+>>> e.value() == 1234567
+True
+>>> [d for dbl, d in e.steps]
+[1, 3, -5, -3, 7]
+>>> FixedExponent(0).steps
+[]
+'''
+
+
+def wnaf(e, window):
+    '''
+    Width-window NAF digits of e, the least significant first
+
+    >>> wnaf(7, 3)
+    [-1, 0, 0, 1]
+    '''
+
+    digits = []
+    half, full = 1 << (window - 1), 1 << window
+    while e:
+        d = 0
+        if e & 1:
+            d = e & (full - 1)
+            if d >= half:
+                d -= full
+            e -= d
+        digits.append(d)
+        e >>= 1
+    return digits
+
+
+def default_window(bits):
+    '''
+    Window of the recoding, each base needs a table of 2^(w-2) points
+    '''
+
+    if bits <= 256:
+        return 5
+    return 6
+
+
+class FixedExponent:
+    def __init__(self, e, window=None):
+        self.e = int(e)
+        self.window = window or default_window(self.e.bit_length())
+
+        # (doublings, digit) from the most significant digit, and the
+        # doublings after the last one
+        self.steps = []
+        last = None
+        digits = wnaf(self.e, self.window)
+        for i in range(len(digits) - 1, -1, -1):
+            if digits[i]:
+                self.steps.append((0 if last is None else last - i, digits[i]))
+                last = i
+        self.tail = last or 0
+
+    def value(self):
+        v = 0
+        for dbl, d in self.steps:
+            v = (v << dbl) + d
+        return v << self.tail
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
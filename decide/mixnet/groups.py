@@ -0,0 +1,223 @@
+'''
+Standardized ElGamal groups.
+
+Generating a safe prime for a new key is really slow with big key sizes,
+but the group parameters (p, g) can be shared, only the secret x has to be
+new for each mixnet. These are the MODP groups from RFC 3526 and the
+finite field groups from RFC 7919, all of them with safe primes and g = 2.
+
+>>> p, g = standard_group(2048)
+>>> p.bit_length(), g
+(2048, 2)
+>>> standard_group(2048, 'modp') != standard_group(2048, 'ffdhe')
+True
+>>> standard_group(256)
+'''
+
+from Crypto import Random
+from Crypto.PublicKey import ElGamal
+
+from .backends import get_backend
+from .ecgroup import EcGroup
+
+
+# RFC 3526
+MODP = {
+    1536: int(
+        'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+        '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+        '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+        'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+        '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+        '9ED529077096966D670C354E4ABC9804F1746C08CA237327FFFFFFFFFFFFFFFF', 16),
+    2048: int(
+        'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+        '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+        '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+        'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+        '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+        '9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+        'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718'
+        '3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF', 16),
+    3072: int(
+        'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+        '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+        '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+        'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+        '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+        '9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+        'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718'
+        '3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33'
+        'A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7'
+        'ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864'
+        'D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2'
+        '08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF', 16),
+    4096: int(
+        'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74'
+        '020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437'
+        '4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+        'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05'
+        '98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB'
+        '9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+        'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718'
+        '3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33'
+        'A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7'
+        'ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864'
+        'D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2'
+        '08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A92108011A723C12A787E6D7'
+        '88719A10BDBA5B2699C327186AF4E23C1A946834B6150BDA2583E9CA2AD44CE8'
+        'DBBBC2DB04DE8EF92E8EFC141FBECAA6287C59474E6BC05D99B2964FA090C3A2'
+        '233BA186515BE7ED1F612970CEE2D7AFB81BDD762170481CD0069127D5B05AA9'
+        '93B4EA988D8FDDC186FFB7DC90A6C08F4DF435C934063199FFFFFFFFFFFFFFFF', 16),
+}
+
+# RFC 7919
+FFDHE = {
+    2048: int(
+        'FFFFFFFFFFFFFFFFADF85458A2BB4A9AAFDC5620273D3CF1D8B9C583CE2D3695'
+        'A9E13641146433FBCC939DCE249B3EF97D2FE363630C75D8F681B202AEC4617A'
+        'D3DF1ED5D5FD65612433F51F5F066ED0856365553DED1AF3B557135E7F57C935'
+        '984F0C70E0E68B77E2A689DAF3EFE8721DF158A136ADE73530ACCA4F483A797A'
+        'BC0AB182B324FB61D108A94BB2C8E3FBB96ADAB760D7F4681D4F42A3DE394DF4'
+        'AE56EDE76372BB190B07A7C8EE0A6D709E02FCE1CDF7E2ECC03404CD28342F61'
+        '9172FE9CE98583FF8E4F1232EEF28183C3FE3B1B4C6FAD733BB5FCBC2EC22005'
+        'C58EF1837D1683B2C6F34A26C1B2EFFA886B423861285C97FFFFFFFFFFFFFFFF', 16),
+    3072: int(
+        'FFFFFFFFFFFFFFFFADF85458A2BB4A9AAFDC5620273D3CF1D8B9C583CE2D3695'
+        'A9E13641146433FBCC939DCE249B3EF97D2FE363630C75D8F681B202AEC4617A'
+        'D3DF1ED5D5FD65612433F51F5F066ED0856365553DED1AF3B557135E7F57C935'
+        '984F0C70E0E68B77E2A689DAF3EFE8721DF158A136ADE73530ACCA4F483A797A'
+        'BC0AB182B324FB61D108A94BB2C8E3FBB96ADAB760D7F4681D4F42A3DE394DF4'
+        'AE56EDE76372BB190B07A7C8EE0A6D709E02FCE1CDF7E2ECC03404CD28342F61'
+        '9172FE9CE98583FF8E4F1232EEF28183C3FE3B1B4C6FAD733BB5FCBC2EC22005'
+        'C58EF1837D1683B2C6F34A26C1B2EFFA886B4238611FCFDCDE355B3B6519035B'
+        'BC34F4DEF99C023861B46FC9D6E6C9077AD91D2691F7F7EE598CB0FAC186D91C'
+        'AEFE130985139270B4130C93BC437944F4FD4452E2D74DD364F2E21E71F54BFF'
+        '5CAE82AB9C9DF69EE86D2BC522363A0DABC521979B0DEADA1DBF9A42D5C4484E'
+        '0ABCD06BFA53DDEF3C1B20EE3FD59D7C25E41D2B66C62E37FFFFFFFFFFFFFFFF', 16),
+    4096: int(
+        'FFFFFFFFFFFFFFFFADF85458A2BB4A9AAFDC5620273D3CF1D8B9C583CE2D3695'
+        'A9E13641146433FBCC939DCE249B3EF97D2FE363630C75D8F681B202AEC4617A'
+        'D3DF1ED5D5FD65612433F51F5F066ED0856365553DED1AF3B557135E7F57C935'
+        '984F0C70E0E68B77E2A689DAF3EFE8721DF158A136ADE73530ACCA4F483A797A'
+        'BC0AB182B324FB61D108A94BB2C8E3FBB96ADAB760D7F4681D4F42A3DE394DF4'
+        'AE56EDE76372BB190B07A7C8EE0A6D709E02FCE1CDF7E2ECC03404CD28342F61'
+        '9172FE9CE98583FF8E4F1232EEF28183C3FE3B1B4C6FAD733BB5FCBC2EC22005'
+        'C58EF1837D1683B2C6F34A26C1B2EFFA886B4238611FCFDCDE355B3B6519035B'
+        'BC34F4DEF99C023861B46FC9D6E6C9077AD91D2691F7F7EE598CB0FAC186D91C'
+        'AEFE130985139270B4130C93BC437944F4FD4452E2D74DD364F2E21E71F54BFF'
+        '5CAE82AB9C9DF69EE86D2BC522363A0DABC521979B0DEADA1DBF9A42D5C4484E'
+        '0ABCD06BFA53DDEF3C1B20EE3FD59D7C25E41D2B669E1EF16E6F52C3164DF4FB'
+        '7930E9E4E58857B6AC7D5F42D69F6D187763CF1D5503400487F55BA57E31CC7A'
+        '7135C886EFB4318AED6A1E012D9E6832A907600A918130C46DC778F971AD0038'
+        '092999A333CB8B7A1A1DB93D7140003C2A4ECEA9F98D0ACC0A8291CDCEC97DCF'
+        '8EC9B55A7F88A46B4DB5A851F44182E1C68A007E5E655F6AFFFFFFFFFFFFFFFF', 16),
+}
+
+FAMILIES = {
+    'ffdhe': FFDHE,
+    'modp': MODP,
+}
+
+
+def standard_group(bits, family='ffdhe'):
+    '''
+    Returns the standard (p, g) for the key size or None if there isn't one
+    '''
+
+    p = FAMILIES.get(family, {}).get(bits)
+    if not p:
+        return None
+    return p, 2
+
+
+class ModGroup:
+    '''
+    Multiplicative group mod p, with the same interface as ecgroup.EcGroup,
+    for the code that works with both kinds of keys
+
+    >>> group = ModGroup(167)
+    >>> group.op(3, group.inverse(3))
+    1
+    >>> group.product([2, 3, 100])
+    99
+    '''
+
+    identity = 1
+
+    def __init__(self, p, backend=None):
+        self.backend = get_backend(backend)
+        self.p = int(p)
+
+    def op(self, a, b):
+        return (int(a) * int(b)) % self.p
+
+    def inverse(self, a):
+        return int(self.backend.invert(int(a), self.p))
+
+    def power(self, a, e):
+        return int(self.backend.powmod(int(a), int(e), self.p))
+
+    def product(self, elements):
+        x = 1
+        for a in elements:
+            x = (x * int(a)) % self.p
+        return x
+
+    def order(self, g):
+        '''
+        Order of the exponents of g, q for a square g mod a safe prime
+        p = 2q + 1 and p - 1 if not
+
+        >>> ModGroup(167).order(4), ModGroup(167).order(5)
+        (83, 166)
+        '''
+
+        q = (self.p - 1) // 2
+        return q if self.power(g, q) == 1 else self.p - 1
+
+    def contains(self, a, order=None):
+        '''
+        If a is in the subgroup of this order, or without order in the group
+
+        >>> ModGroup(167).contains(166), ModGroup(167).contains(166, 83)
+        (True, False)
+        >>> ModGroup(167).contains(-1), ModGroup(167).contains(167)
+        (False, False)
+        '''
+
+        try:
+            a = int(a)
+        except (TypeError, ValueError):
+            return False
+        if not 0 < a < self.p:
+            return False
+        return order in (None, self.p - 1) or self.power(a, order) == 1
+
+
+def get_group(p, curve='', backend=None):
+    '''
+    Group of a key, the elliptic curve if the key has one
+    '''
+
+    if curve:
+        return EcGroup(curve, backend)
+    return ModGroup(p, backend)
+
+
+def generate_group(bits):
+    key = ElGamal.generate(bits, Random.new().read)
+    return int(key.p), int(key.g)
+
+
+def groups_chunk(items, bits):
+    '''
+    Generates a new group for each item, for the process pool workers
+    '''
+
+    return [generate_group(bits) for i in items]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
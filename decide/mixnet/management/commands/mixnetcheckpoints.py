@@ -0,0 +1,43 @@
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mixnet.checkpoint import Checkpoint
+
+
+class Command(BaseCommand):
+    help = '''List the checkpoints of the output of this auth in the tallies,
+    see mixnet.checkpoint, or remove them with --purge once the tally is
+    done.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('voting_id', type=int, nargs='?',
+                            help='only the checkpoints of this voting')
+        parser.add_argument('--purge', action='store_true',
+                            help='remove the listed checkpoints')
+        parser.add_argument('--older-than', type=float, default=0,
+                            help='only the checkpoints older than these days')
+
+    def handle(self, *args, **options):
+        directory = settings.MIXNET_CHECKPOINT_DIR
+        if not directory:
+            raise CommandError('The checkpoints are disabled, MIXNET_CHECKPOINT_DIR is not set')
+
+        limit = time.time() - options['older_than'] * 86400
+        ckpts = [c for c in Checkpoint.all(directory, options['voting_id'])
+                 if not options['older_than'] or c.mtime() < limit]
+
+        total = 0
+        for ckpt in ckpts:
+            size = ckpt.size()
+            total += size
+            print("{:>8} {:>4} {:<8} {} {:>10.1f} MB  {:%Y-%m-%d %H:%M}".format(
+                ckpt.voting_id, ckpt.position, ckpt.op, ckpt.digest[:16],
+                size / 2**20, datetime.fromtimestamp(ckpt.mtime())))
+            if options['purge']:
+                ckpt.remove()
+
+        action = "Removed" if options['purge'] else "Found"
+        print("{} {} checkpoints, {:.1f} MB".format(action, len(ckpts), total / 2**20))
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mixnet.groups import groups_chunk
+from mixnet.models import Group
+from mixnet.parallel import map_chunks, num_workers
+
+
+class Command(BaseCommand):
+    help = '''Pregenerate group parameters for the new mixnets, so creating a
+    mixnet doesn't need to wait for a new safe prime. It can be run in
+    background to refill the pool.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10,
+                            help='groups wanted in the pool')
+        parser.add_argument('--bits', type=int, default=settings.KEYBITS)
+
+    def handle(self, *args, **options):
+        bits = options['bits']
+        workers = num_workers(settings.MIXNET_WORKERS)
+
+        missing = options['size'] - Group.objects.filter(bits=bits).count()
+        while missing > 0:
+            n = min(missing, workers)
+            groups = map_chunks(groups_chunk, list(range(n)), workers, 1, (bits,))
+            Group.objects.bulk_create(Group(bits=bits, p=p, g=g) for p, g in groups)
+            missing -= n
+            print("Generated {} groups of {} bits, {} left".format(n, bits, missing))
+
+        print("The pool has {} groups of {} bits".format(
+            Group.objects.filter(bits=bits).count(), bits))
@@ -0,0 +1,62 @@
+import math
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base import mods
+from mixnet.models import Mixnet
+
+
+class Command(BaseCommand):
+    help = '''Precompute the reencryption factors of a mixnet, so the shuffle
+    in the tally only needs two multiplications per vote. It can be run in
+    background between the end of the voting and the tally.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('voting_id', type=int)
+        parser.add_argument('--position', type=int, default=0,
+                            help='auth position of the mixnet')
+        parser.add_argument('--size', type=int, default=0,
+                            help='factors wanted in the pool, by default the census size')
+        parser.add_argument('--token', default='',
+                            help='staff token to get the census size')
+        parser.add_argument('--margin', type=float, default=0.0,
+                            help='extra factors over the census size, 0.1 is 10%%')
+
+    def census_size(self, voting_id, token):
+        if not token:
+            raise CommandError('A staff --token is needed to get the census size, or --size')
+        response = mods.get('census', params={'voting_id': voting_id},
+                            HTTP_AUTHORIZATION='Token ' + token, response=True)
+        if response.status_code != 200:
+            raise CommandError('Census of the voting {}: error {}'.format(
+                voting_id, response.status_code))
+        return len(response.json().get('voters', []))
+
+    def handle(self, *args, **options):
+        vid = options['voting_id']
+        try:
+            mn = Mixnet.objects.get(voting_id=vid, auth_position=options['position'])
+        except Mixnet.DoesNotExist:
+            raise CommandError('Mixnet not found for voting {}'.format(vid))
+
+        size = options['size']
+        if not size:
+            size = self.census_size(vid, options['token'])
+            size = math.ceil(size * (1 + options['margin']))
+
+        # the tally sends the key of the voting to all the auths
+        pk = mn.voting_pubkey()
+        if not pk:
+            raise CommandError('The voting {} has no public key'.format(vid))
+
+        pool = mn.factor_pool(pk)
+        missing = size - pool.size()
+        if missing <= 0:
+            print("The pool already has {} factors".format(pool.size()))
+            return
+
+        print("Computing {} factors in {}".format(missing, pool.path))
+        pool.fill(missing, bits=settings.KEYBITS, backend=settings.MIXNET_BACKEND,
+                  workers=settings.MIXNET_WORKERS, chunk_size=settings.MIXNET_CHUNK_SIZE)
+        print("The pool has {} factors".format(pool.size()))
@@ -0,0 +1,19 @@
+# Generated by Django 2.0 on 2026-10-18 16:05
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mixnet', '0005_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mixnet',
+            name='keygen_timing',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
 '''
+>>> from Crypto.Random import random
 >>> B = 256
 >>> k1 = MixCrypt(bits=B)
 >>> k2 = MixCrypt(k=k1.k, bits=B)
@@ -15,14 +16,14 @@ True
 >>> B = 256
 >>> k1 = MixCrypt(bits=B)
 >>> k1.setk(167,156,89,130) #doctest: +ELLIPSIS
-<Crypto.PublicKey.ElGamal.ElGamalobj object at 0x...>
+<Crypto.PublicKey.ElGamal.ElGamal... object at 0x...>
 >>> k2 = MixCrypt(bits=B)
 >>> k2.setk(167,156,53,161) #doctest: +ELLIPSIS
-<Crypto.PublicKey.ElGamal.ElGamalobj object at 0x...>
+<Crypto.PublicKey.ElGamal.ElGamal... object at 0x...>
 >>> k3 = MixCrypt(bits=B)
->>> k3.k = ElGamal.construct((167, 156, 4717))
->>> k3.k.p, k3.k.g, k3.k.y
-(167, 156, 4717)
+>>> k3.k = ElGamal.construct((167, 156, 89 * 53 % 167))
+>>> int(k3.k.p), int(k3.k.g), int(k3.k.y)
+(167, 156, 41)
 >>> N = 4
 >>> clears = [2,3,6,4]
 >>> cipher = [(161, 109), (17, 101), (148, 163), (71, 37)]
@@ -34,28 +35,46 @@ True
 '''
 
 
+import time
 from pprint import pprint
 
 from Crypto.PublicKey import ElGamal
-from Crypto.Random import random
 from Crypto import Random
-from Crypto.Util.number import GCD
+
+from base import metrics
+from .backends import get_backend
+from .batch import CiphertextBatch
+from .fixedbase import FixedBase
+from .groups import ModGroup
+from .parallel import map_chunks, use_pool
+from . import randpool
+
+
+# minimum number of messages to build the fixed-base tables in a shuffle
+FIXEDBASE_MIN = 16
+
+# MixCrypt instances of the process pool workers, by public key and backend
+_worker_crypts = {}
+
+
+def count(op, n, start):
+    '''
+    Messages and seconds of an operation, see base.metrics
+    '''
+
+    metrics.mixcrypt_msgs.inc(n, op=op)
+    metrics.mixcrypt_time.inc(time.perf_counter() - start, op=op)
 
 
 def rand(p):
-    while True:
-        k = random.StrongRandom().randint(1, int(p) - 1)
-        if GCD(k, int(p) - 1) == 1: break
-    return k
+    return randpool.pool.nonce(p)
 
 
 def gen_multiple_key(*crypts):
     k1 = crypts[0]
-    k = MixCrypt(k=k1.k, bits=k1.bits)
-    k.k.y = 1
-    for kx in crypts:
-        k.k.y *= kx.k.y
-    k.k.y = k.k.y % k.k.p
+    k = k1.__class__(k=k1.k, bits=k1.bits, backend=k1.backend.name)
+    y = k.group.product(kx.k.y for kx in crypts)
+    k.k = k.construct((int(k.k.p), int(k.k.g), y))
     return k
 
 
@@ -75,6 +94,7 @@ def multiple_decrypt_shuffle(ciphers, *crypts):
 
 def multiple_decrypt_shuffle2(ciphers, *crypts, pubkey=None):
     '''
+    >>> from Crypto.Random import random
     >>> B = 256
     >>> k1 = MixCrypt(bits=B)
     >>> k2 = MixCrypt(k=k1.k, bits=B)
@@ -103,9 +123,73 @@ def multiple_decrypt_shuffle2(ciphers, *crypts, pubkey=None):
     return b
 
 
+def worker_crypt(params, bits, backend, curve=''):
+    '''
+    MixCrypt for the process pool workers, params is the (p, g, y) public
+    key or the (p, g, y, x) private key, of the curve if there's one
+    '''
+
+    crypt = _worker_crypts.get((params, backend, curve))
+    if not crypt:
+        if curve:
+            from .ecmixcrypt import EcMixCrypt
+            cls = EcMixCrypt
+        else:
+            cls = MixCrypt
+        crypt = cls(k=cls.construct(params[:3], curve), bits=bits, backend=backend)
+        if len(params) == 4:
+            crypt.setk(*params)
+        _worker_crypts[(params, backend, curve)] = crypt
+    return crypt
+
+
+def reencrypt_chunk(msgs, params, bits, backend, curve=''):
+    '''
+    Reencrypts a chunk of messages with the public key params, this is the
+    work done by each process of the pool in MixCrypt.shuffle
+    '''
+
+    crypt = worker_crypt(params, bits, backend, curve)
+    crypt.precompute(params)
+    msgs2 = (crypt.reencrypt(m, params) for m in msgs)
+    if isinstance(msgs, CiphertextBatch):
+        return CiphertextBatch.from_list(msgs2, msgs.width)
+    return list(msgs2)
+
+
+def factors_chunk(items, params, bits, backend, curve=''):
+    '''
+    Computes a reencryption factor, an encryption of 1, for each item
+    '''
+
+    crypt = worker_crypt(params, bits, backend, curve)
+    crypt.precompute(params)
+    return [crypt.encrypt_params(crypt.identity, params) for i in items]
+
+
+def decrypt_chunk(msgs, params, bits, backend, curve='', blinding=True):
+    '''
+    Decrypts a chunk of messages with the private key params, this is the
+    work done by each process of the pool in MixCrypt.multiple_decrypt
+    '''
+
+    crypt = worker_crypt(params, bits, backend, curve)
+    crypt.blinding = blinding
+    return crypt.decrypt_batch(msgs)
+
+
 class MixCrypt:
-    def __init__(self, k=None, bits=256):
+    # ElGamal in the multiplicative group mod p, see EcMixCrypt for curves
+    curve = ''
+    identity = 1
+
+    def __init__(self, k=None, bits=256, backend=None, blinding=True):
         self.bits = bits
+        self.backend = get_backend(backend)
+        # the a of each cipher is blinded before the power to the secret x,
+        # see decrypt_batch, only disabled with MIXNET_DECRYPT_BLINDING
+        self.blinding = blinding
+        self.tables = {}
         if k:
             self.k = self.getk(k.p, k.g)
         else:
@@ -125,21 +209,129 @@ class MixCrypt:
         self.k = ElGamal.construct((p, g, y, x))
         return self.k
 
-    def encrypt(self, m, k=None):
-        r = rand(self.k.p)
+    @staticmethod
+    def construct(params, curve=''):
+        '''
+        Public key object for the (p, g, y) params
+        '''
+
+        return ElGamal.construct(tuple(map(int, params)))
+
+    @property
+    def group(self):
+        return ModGroup(self.k.p, self.backend.name)
+
+    def encode(self, m):
+        '''
+        Group element for the clear message m, the message itself in the
+        multiplicative group
+        '''
+
+        return m
+
+    def decode(self, m):
+        return m
+
+    def worker_args(self, params):
+        '''
+        Arguments for the process pool chunk functions
+        '''
+
+        return (params, self.bits, self.backend.name, self.curve)
+
+    def encrypt(self, m, k=None, r=None):
         if not k:
             k = self.k
-        a, b = k._encrypt(m, r)
-        return a, b
+        return self.encrypt_params(m, (int(k.p), int(k.g), int(k.y)), r)
+
+    def encrypt_params(self, m, params, r=None):
+        '''
+        Encrypts m with the public key given as a (p, g, y) tuple of ints
+        '''
+
+        if r is None:
+            r = rand(params[0])
+
+        bk = self.backend
+        tables = self.tables.get(params)
+        if tables:
+            gt, yt = tables
+            a = gt.pow(r)
+            yr = yt.pow(r)
+        else:
+            p, g, y = map(bk.mpz, params)
+            a = bk.powmod(g, r, p)
+            yr = bk.powmod(y, r, p)
+        b = bk.mulmod(bk.mpz(m), yr, params[0])
+        return int(a), int(b)
 
     def decrypt(self, c):
-        m = self.k._decrypt(c)
-        return m
+        return self.decrypt_batch([c])[0]
+
+    def decrypt_batch(self, msgs):
+        '''
+        Decrypts a list of ciphers, the inverses of all the a^x are computed
+        together with only one modular inversion.
+
+        With blinding, like the pycryptodome decryption, the power to the
+        secret x is of a * g^r with a random r for each cipher, so its time
+        doesn't depend on the ciphers an attacker sends, and the clear is
+        b * y^r / (a * g^r)^x. The (g^r, y^r) are an encryption of 1, with
+        the fixed-base tables of the key for a big batch.
+
+        >>> k = MixCrypt(bits=256)
+        >>> cipher = [k.encrypt(i) for i in range(2, 12)]
+        >>> k.decrypt_batch(cipher) == [k.decrypt(c) for c in cipher]
+        True
+        >>> k.blinding = False
+        >>> k.decrypt_batch(cipher)
+        [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+        '''
+
+        bk = self.backend
+        p, x = bk.mpz(self.k.p), bk.mpz(self.k.x)
+        if not self.blinding:
+            axs = [bk.powmod(bk.mpz(a), x, p) for a, b in msgs]
+            invs = bk.batch_invert(axs, p)
+            return [int(bk.mulmod(inv, bk.mpz(b), p)) for inv, (a, b) in zip(invs, msgs)]
+
+        params = self.params()
+        if len(msgs) >= FIXEDBASE_MIN:
+            self.precompute(params)
+        blinds = [self.encrypt_params(self.identity, params) for i in range(len(msgs))]
+        axs = [bk.powmod(bk.mulmod(bk.mpz(a), bk.mpz(gr), p), x, p)
+               for (a, b), (gr, yr) in zip(msgs, blinds)]
+        invs = bk.batch_invert(axs, p)
+        return [int(bk.mulmod(bk.mulmod(inv, bk.mpz(b), p), bk.mpz(yr), p))
+                for inv, (a, b), (gr, yr) in zip(invs, msgs, blinds)]
+
+    def multiple_decrypt(self, msgs, last=True, workers=1, chunk_size=1000):
+        '''
+        Decrypts a list of ciphers. With more than one worker (0 is one per
+        core) and more than chunk_size messages, the decryption is done in
+        chunks by a process pool.
+
+        The msgs can be a CiphertextBatch, then the partial decryptions of
+        an auth that isn't the last one are returned as a batch too.
+        '''
+
+        start = time.perf_counter()
+        if use_pool(len(msgs), workers, chunk_size):
+            k = self.k
+            params = (int(k.p), int(k.g), int(k.y), int(k.x))
+            args = self.worker_args(params) + (self.blinding,)
+            clears = map_chunks(decrypt_chunk, msgs, workers, chunk_size, args)
+        else:
+            clears = self.decrypt_batch(msgs)
+        count('decrypt', len(msgs), start)
+
+        if isinstance(msgs, CiphertextBatch):
+            if last:
+                return [int(m) for m in clears]
+            return msgs.replace_b(clears)
 
-    def multiple_decrypt(self, msgs, last=True):
         msgs2 = []
-        for a, b in msgs:
-            clear = self.decrypt((a, b))
+        for (a, b), clear in zip(msgs, clears):
             if last:
                 msg = clear
             else:
@@ -147,23 +339,55 @@ class MixCrypt:
             msgs2.append(msg)
         return msgs2
 
-    def shuffle_decrypt(self, msgs, last=True):
-        msgs2 = msgs.copy()
-        msgs3 = []
-        while msgs2:
-            n = random.StrongRandom().randint(0, len(msgs2) - 1)
-            a, b = msgs2.pop(n)
-            clear = self.decrypt((a, b))
-            if last:
-                msg = clear
-            else:
-                msg = (a, clear)
-            msgs3.append(msg)
+    def shuffle_decrypt(self, msgs, last=True, workers=1, chunk_size=1000):
+        '''
+        Decrypts the messages in a random order
+
+        >>> k = MixCrypt(bits=256)
+        >>> cipher = [k.encrypt(i) for i in range(2, 12)]
+        >>> sorted(k.shuffle_decrypt(cipher))
+        [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+        '''
+
+        perm = self.gen_perm(len(msgs))
+        if isinstance(msgs, CiphertextBatch):
+            msgs2 = msgs.permute(perm)
+        else:
+            msgs2 = [msgs[p] for p in perm]
+        return self.multiple_decrypt(msgs2, last, workers, chunk_size)
+
+    def params(self, pubkey=None):
+        if pubkey:
+            return tuple(map(int, pubkey))
+        return (int(self.k.p), int(self.k.g), int(self.k.y))
 
-        return msgs3
+    def precompute(self, pubkey=None):
+        '''
+        Builds the fixed-base tables for the g and y of the key, so the
+        following encrypt and reencrypt calls with this key are cheaper.
 
-    def reencrypt(self, cipher, pubkey=None):
+        >>> k = MixCrypt(bits=256)
+        >>> c = k.encrypt(7, r=1234)
+        >>> _ = k.precompute()
+        >>> c == k.encrypt(7, r=1234)
+        True
         '''
+
+        params = self.params(pubkey)
+        if params not in self.tables:
+            start = time.perf_counter()
+            p, g, y = params
+            bits = p.bit_length()
+            self.tables[params] = (
+                FixedBase(g, p, bits=bits, backend=self.backend),
+                FixedBase(y, p, bits=bits, backend=self.backend),
+            )
+            count('precompute', 1, start)
+        return self.tables[params]
+
+    def reencrypt(self, cipher, pubkey=None, factor=None):
+        '''
+        >>> from Crypto.Random import random
         >>> B = 256
         >>> k = MixCrypt(bits=B)
         >>> clears = [random.StrongRandom().randint(1, B) for i in range(5)]
@@ -177,41 +401,99 @@ class MixCrypt:
         True
         '''
 
-        if pubkey:
-            p, g, y = pubkey
-            k = ElGamal.construct((p, g, y))
-        else:
-            k = self.k
-
+        params = self.params(pubkey)
         a, b = map(int, cipher)
-        a1, b1 = map(int, self.encrypt(1, k=k))
-        p = int(k.p)
+        if factor:
+            a1, b1 = factor
+        else:
+            a1, b1 = self.encrypt_params(1, params)
+        p = params[0]
 
         return ((a * a1) % p, (b * b1) % p)
 
     def gen_perm(self, l):
+        '''
+        Random permutation of range(l), inside-out Fisher-Yates
+        '''
+
+        rng = randpool.pool
         x = list(range(l))
         for i in range(l):
-            d = random.StrongRandom().randint(0, i)
+            d = rng.randint(0, i)
             if i != d:
                 x[i] = x[d]
                 x[d] = i
         return x
 
-    def shuffle(self, msgs, pubkey=None):
+    def shuffle(self, msgs, pubkey=None, workers=1, chunk_size=1000, factors=None):
         '''
         Reencrypt and shuffle
+
+        With more than one worker (0 is one per core) and more than
+        chunk_size messages, the messages are reencrypted in chunks by a
+        process pool and then permuted.
+
+        The factors are precomputed encryptions of 1 (see factorpool), they
+        are used for the first messages and the rest are reencrypted as
+        usual.
+
+        The msgs can be a CiphertextBatch, then the chunks are views of it
+        and the result is a new batch.
+
+        >>> B = 256
+        >>> k = MixCrypt(bits=B)
+        >>> cipher = [k.encrypt(i) for i in range(2, 12)]
+        >>> shuffled = k.shuffle(cipher, workers=2, chunk_size=3)
+        >>> sorted(k.decrypt(c) for c in shuffled)
+        [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+        >>> factors = [k.encrypt(1) for i in range(4)]
+        >>> shuffled = k.shuffle(cipher, factors=factors)
+        >>> sorted(k.decrypt(c) for c in shuffled)
+        [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+        >>> batch = CiphertextBatch.from_list(cipher, 32)
+        >>> shuffled = k.shuffle(batch, workers=2, chunk_size=3)
+        >>> sorted(k.decrypt(c) for c in shuffled)
+        [2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
         '''
 
-        msgs2 = msgs.copy()
         perm = self.gen_perm(len(msgs))
-        for i, p in enumerate(perm):
-            m = msgs[p]
-            nm = self.reencrypt(m, pubkey)
-            msgs2[i] = nm
+        msgs2 = self.reencrypt_many(msgs, pubkey, workers, chunk_size, factors)
+        if isinstance(msgs2, CiphertextBatch):
+            return msgs2.permute(perm)
+        return [msgs2[p] for p in perm]
 
-        return msgs2
+    def reencrypt_many(self, msgs, pubkey=None, workers=1, chunk_size=1000, factors=None):
+        '''
+        Reencrypts the messages keeping their order, the shuffle without
+        the permutation. The arguments are the same as in shuffle.
+        '''
+
+        start = time.perf_counter()
+        factors = (factors or [])[:len(msgs)]
+        msgs2 = [self.reencrypt(m, pubkey, f) for m, f in zip(msgs, factors)]
+        rest = msgs[len(factors):]
 
+        batch = isinstance(msgs, CiphertextBatch)
+        if batch:
+            msgs2 = [CiphertextBatch.from_list(msgs2, msgs.width)]
+
+        if use_pool(len(rest), workers, chunk_size):
+            args = self.worker_args(self.params(pubkey))
+            join = CiphertextBatch.concat if batch else None
+            reenc = map_chunks(reencrypt_chunk, rest, workers, chunk_size, args, join)
+        else:
+            if len(rest) >= FIXEDBASE_MIN:
+                self.precompute(pubkey)
+            reenc = [self.reencrypt(m, pubkey) for m in rest]
+            if batch:
+                reenc = CiphertextBatch.from_list(reenc, msgs.width)
+
+        if batch:
+            reenc = CiphertextBatch.concat(msgs2 + [reenc])
+        else:
+            reenc = msgs2 + reenc
+        count('reencrypt', len(msgs), start)
+        return reenc
 
 if __name__ == "__main__":
     import doctest
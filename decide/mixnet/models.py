@@ -1,15 +1,59 @@
-from django.db import models
+import time
+
+from django.db import connections, models, transaction
+from django.contrib.postgres.fields import JSONField
 
 from .mixcrypt import MixCrypt
+from .batch import CiphertextBatch, key_width
+from . import wire
+from .stream import ChunkSender
+from .checkpoint import Checkpoint, digest
+from .ecmixcrypt import EcMixCrypt
+from .dlog import DlogTable
+from .factorpool import FactorPool
+from .groups import standard_group
+from .parallel import fanout
 
 from base import mods
-from base.models import Auth, Key
+from base import tracing
+from base.models import Auth, Key, BigBigField
 from base.serializers import AuthSerializer
 from django.conf import settings
 
 
 # number of bits for the key, all auths should use the same number of bits
 B = settings.KEYBITS
+# big integer backend used for the modular arithmetic
+BACKEND = settings.MIXNET_BACKEND
+
+
+class Group(models.Model):
+    '''
+    Pregenerated group parameters, each one is used by only one new mixnet.
+    See the mixnetgroups command.
+    '''
+
+    bits = models.PositiveIntegerField()
+    p = BigBigField()
+    g = BigBigField()
+
+    def __str__(self):
+        return "{} bits: {},{}".format(self.bits, self.p, self.g)
+
+    @classmethod
+    def take(cls, bits):
+        '''
+        Removes a group of this size from the pool and returns its (p, g),
+        or None if the pool is empty
+        '''
+
+        with transaction.atomic():
+            qs = cls.objects.select_for_update(skip_locked=True).filter(bits=bits)
+            group = qs.first()
+            if not group:
+                return None
+            group.delete()
+        return group.p, group.g
 
 
 class Mixnet(models.Model):
@@ -22,43 +66,202 @@ class Mixnet(models.Model):
     pubkey = models.ForeignKey(Key, blank=True, null=True,
                                related_name="mixnets_pub",
                                on_delete=models.SET_NULL)
+    # [ {"auth": str, "position": int, "keygen": s, "overhead": s, "request": s} ]
+    # of the key generation in the next auths, see keygen_fanout
+    keygen_timing = JSONField(blank=True, null=True)
 
     def __str__(self):
         auths = ", ".join(a.name for a in self.auths.all())
         return "Voting: {}, Auths: {}\nPubKey: {}".format(self.voting_id,
                                                           auths, self.pubkey)
 
+    def crypt(self, p=0, g=0, curve=''):
+        '''
+        MixCrypt with the mixnet key, or with a new key for the group (p, g).
+        Without key nor group a new group is generated, that is really slow
+        with big keys. With a curve, or a key of a curve, it's an EcMixCrypt.
+        '''
+
+        k = None
+        if self.key:
+            k, curve = self.key, self.key.curve
+        elif p and g:
+            k = Key(p=p, g=g, curve=curve)
+
+        if curve:
+            crypt = EcMixCrypt(k=k, backend=BACKEND, curve=curve)
+        else:
+            crypt = MixCrypt(k=k, bits=B, backend=BACKEND,
+                             blinding=settings.MIXNET_DECRYPT_BLINDING)
+
+        if self.key:
+            crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
+        return crypt
+
+    def batch(self, msgs, pk):
+        '''
+        The msgs as a CiphertextBatch, sized for the public key pk
+        '''
+
+        width = key_width(pk[0], self.key.curve)
+        if isinstance(msgs, CiphertextBatch) and msgs.width == width:
+            return msgs
+        return CiphertextBatch.from_list(msgs, width)
+
+    def checkpoint(self, op, pk, blocks, **options):
+        '''
+        Checkpoint of the output of this auth for the input, the op with
+        the public key pk, the options and the blocks of bytes of the msgs,
+        or None if MIXNET_CHECKPOINT_DIR is empty. See mixnet.checkpoint.
+        '''
+
+        if not settings.MIXNET_CHECKPOINT_DIR:
+            return None
+        k = self.key
+        key = digest(op, list(pk) + [k.p, k.g, k.y], blocks, **options)
+        return Checkpoint(settings.MIXNET_CHECKPOINT_DIR, self.voting_id,
+                          self.auth_position, op, key)
+
+    def checkpointed(self, ckpt, compute):
+        '''
+        The output saved in ckpt, or compute() that is saved
+        '''
+
+        msgs = ckpt.load() if ckpt else None
+        if msgs is None:
+            msgs = compute()
+            if ckpt:
+                ckpt.save(msgs)
+        return msgs
+
     def shuffle(self, msgs, pk):
-        crypt = MixCrypt(bits=B)
-        k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
+        crypt = self.crypt()
+        msgs = self.batch(msgs, pk)
+
+        def compute():
+            factors = self.factor_pool(pk).take(len(msgs))
+            return crypt.shuffle(msgs, pk, workers=settings.MIXNET_WORKERS,
+                                 chunk_size=settings.MIXNET_CHUNK_SIZE,
+                                 factors=factors)
+
+        ckpt = self.checkpoint('shuffle', pk, [msgs.a, msgs.b])
+        with tracing.span('shuffle', voting=self.voting_id, position=self.auth_position,
+                          msgs=len(msgs)):
+            return self.checkpointed(ckpt, compute)
+
+    def decrypt(self, msgs, pk, last=False, shuffle=True, bound=0):
+        '''
+        Decrypts the msgs in a random order, or in the same order without
+        shuffle, like the per option sums of the homomorphic tally. With a
+        bound, the last auth returns the exponents e of the clears g^e.
+        '''
+
+        crypt = self.crypt()
+        msgs = self.batch(msgs, pk)
+        opts = dict(workers=settings.MIXNET_WORKERS,
+                    chunk_size=settings.MIXNET_CHUNK_SIZE)
+
+        def compute():
+            if shuffle:
+                out = crypt.shuffle_decrypt(msgs, last, **opts)
+            else:
+                out = crypt.multiple_decrypt(msgs, last, **opts)
+            if last:
+                out = self.clears(out, pk, bound, crypt)
+            return out
+
+        ckpt = self.checkpoint('decrypt', pk, [msgs.a, msgs.b],
+                               last=bool(last), shuffle=bool(shuffle), bound=bound)
+        with tracing.span('decrypt', voting=self.voting_id, position=self.auth_position,
+                          msgs=len(msgs)):
+            return self.checkpointed(ckpt, compute)
+
+    def clears(self, msgs, pk, bound=0, crypt=None):
+        '''
+        Clear messages of the decryptions of the last auth, or with a bound
+        the exponents e of the clears g^e
+        '''
 
-        return crypt.shuffle(msgs, pk)
+        crypt = crypt or self.crypt()
+        if bound:
+            table = DlogTable.get(pk[0], pk[1], bound, settings.MIXNET_DLOG_DIR,
+                                  group=crypt.group)
+            return [table.log(m, bound) for m in msgs]
+        return [crypt.decode(m) for m in msgs]
 
-    def decrypt(self, msgs, pk, last=False):
-        crypt = MixCrypt(bits=B)
-        k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-        return crypt.shuffle_decrypt(msgs, last)
+    def dlog_bound(self, bound, token=''):
+        '''
+        The bound of the discrete logs of a decrypt, checked with the staff
+        token against the census of the voting, the counts can't be bigger.
+        The table of the logs has sqrt(bound) records, see mixnet.dlog.
+        Raises ValueError if the bound is wrong or over the census.
+        '''
 
-    def gen_key(self, p=0, g=0):
-        crypt = MixCrypt(bits=B)
+        if isinstance(bound, bool) or not isinstance(bound, int) or bound < 0:
+            raise ValueError('Wrong dlog bound {}'.format(bound))
+        if not bound:
+            return 0
+
+        census = mods.get('census', params={'voting_id': self.voting_id},
+                          HTTP_AUTHORIZATION='Token ' + token, response=True)
+        if census.status_code != 200:
+            raise ValueError('The census of the voting is not available')
+        voters = len(census.json().get('voters', []))
+        if bound > voters:
+            raise ValueError('The dlog bound {} is over the {} voters of the census'.format(
+                             bound, voters))
+        return bound
+
+    def voting_pubkey(self):
+        '''
+        The public key (p, g, y) of the voting, the pk that the tally sends
+        to every auth, or None if the voting doesn't have one yet. The
+        pubkey of this mixnet is only the product of the keys from this
+        auth on, with the chained and the parallel keygen.
+        '''
+
+        voting = mods.get('voting', params={'id': self.voting_id})
+        if not voting or not isinstance(voting, list) or not voting[0].get('pub_key'):
+            return None
+        pk = voting[0]['pub_key']
+        return pk['p'], pk['g'], pk['y']
+
+    def factor_pool(self, pk):
+        '''
+        Precomputed reencryption factors for the public key pk, the key of
+        the voting, see voting_pubkey
+        '''
+
+        return FactorPool(pk, settings.MIXNET_POOL_DIR, curve=self.key.curve)
+
+    def group(self, bits=B):
+        '''
+        Group parameters (p, g) for a new key, a standard group if there's
+        one for this size, a pregenerated one or None if there isn't any
+        '''
+
+        group = None
+        if settings.MIXNET_STANDARD_GROUPS:
+            group = standard_group(bits, settings.MIXNET_STANDARD_GROUPS)
+        if not group:
+            group = Group.take(bits)
+        return group
+
+    def gen_key(self, p=0, g=0, curve=''):
         if self.key:
-            k = crypt.setk(self.key.p, self.key.g, self.key.y, self.key.x)
-        elif (not g or not p):
-            k = crypt.genk()
-            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
-            key.save()
-
-            self.key = key
-            self.save()
-        else:
-            k = crypt.getk(p, g)
-            key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x))
-            key.save()
+            return
+
+        if not curve and (not g or not p):
+            p, g = self.group() or (0, 0)
+
+        k = self.crypt(p, g, curve).k
+        key = Key(p=int(k.p), g=int(k.g), y=int(k.y), x=int(k.x), curve=curve)
+        key.save()
 
-            self.key = key
-            self.save()
+        self.key = key
+        self.save()
 
-    def chain_call(self, path, data):
+    def chain_call(self, path, data, token=''):
         next_auths=self.next_auths()
 
         data.update({
@@ -68,15 +271,105 @@ class Mixnet(models.Model):
         })
 
         if next_auths:
-            auth = next_auths.first().url
-            r = mods.post('mixnet', entry_point=path,
-                           baseurl=auth, json=data)
+            auth = next_auths[0].url
+            headers = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+            r = wire.post(path, data, baseurl=auth, **headers)
             return r
 
         return None
 
+    def keygen_fanout(self, data, token=''):
+        '''
+        Key generation in all the next auths at once, instead of the chain
+        of calls of chain_call. Each auth gets its position and the auths
+        from it, like in the chain, and doesn't call the next one. Returns
+        the y of the key of each auth and saves the time of each call in
+        keygen_timing, the keygen time reported by the auth and the
+        overhead, the rest of the request: the connection, the transfer
+        and the view.
+
+        Then each auth gets the ys from its position on and keeps their
+        product as its pubkey, the same pubkey as in the chain, see the
+        PubKey view. The calls are sent with the staff token.
+        '''
+
+        next_auths = list(self.next_auths())
+        workers = settings.MIXNET_KEYGEN_WORKERS
+        threads = len(next_auths) > 1 and workers != 1
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+
+        def post(auth, entry_point, body):
+            try:
+                response = mods.post('mixnet', entry_point=entry_point, baseurl=auth.url,
+                                     json=body, response=True, **headers)
+            finally:
+                # the calls in other threads have their own db connection
+                if threads:
+                    connections.close_all()
+            if response.status_code >= 400:
+                raise wire.MixnetError('{} in {} {}: {}'.format(
+                    entry_point, auth.url, response.status_code, response.content[:200]))
+            return response.json()
+
+        def keygen(i):
+            auth = next_auths[i]
+            position = self.auth_position + 1 + i
+            body = dict(data, **{
+                "auths": AuthSerializer(next_auths[i:], many=True).data,
+                "voting": self.voting_id,
+                "position": position,
+                "chain": False,
+            })
+            start = time.perf_counter()
+            key = post(auth, '/', body)
+            total = time.perf_counter() - start
+
+            keygen = key.get("keygen", 0)
+            timing = {
+                "auth": auth.name,
+                "url": auth.url,
+                "position": position,
+                "keygen": keygen,
+                "overhead": max(total - keygen, 0),
+                "request": total,
+            }
+            return key["y"], timing
+
+        results = fanout(keygen, range(len(next_auths)), workers)
+        ys = [y for y, timing in results]
+
+        keys = [self.key.y] + ys
+        def pubkey(i):
+            body = {"position": self.auth_position + 1 + i, "keys": keys[i + 1:]}
+            post(next_auths[i], '/pubkey/{}/'.format(self.voting_id), body)
+
+        # the pubkey of the last auth is already its own key
+        fanout(pubkey, range(len(next_auths) - 1), workers)
+
+        self.keygen_timing = [timing for y, timing in results]
+        self.save()
+        return ys
+
+    def chain_stream(self, path, data, total, token=''):
+        '''
+        ChunkSender to stream total msgs to the next auth, with the data of
+        chain_call and the staff token, or None if this is the last auth.
+        See mixnet.stream.
+        '''
+
+        next_auths = self.next_auths()
+        if not next_auths:
+            return None
+
+        data = dict(data, **{
+            "auths": AuthSerializer(next_auths, many=True).data,
+            "voting": self.voting_id,
+            "position": self.auth_position + 1,
+        })
+        return ChunkSender(path, data, baseurl=next_auths[0].url, total=total, token=token)
+
     def next_auths(self):
-        next_auths = self.auths.filter(me=False)
+        next_auths = self.auths.filter(me=False).order_by('pk')
 
         if self.auths.count() == next_auths.count():
             next_auths = next_auths[1:]
@@ -0,0 +1,95 @@
+'''
+Process pool helpers to spread the mixnet crypto over all the cores.
+
+The work is split in chunks of consecutive items, each chunk is processed in
+a worker process and the results are joined back in the same order. The
+calls to other auths wait on the network, not on the cpu, so they are
+spread over threads with fanout.
+
+>>> chunks(list(range(7)), 3)
+[[0, 1, 2], [3, 4, 5], [6]]
+>>> map_chunks(sum_chunk, list(range(7)), workers=1, chunk_size=3)
+[3, 12, 6]
+>>> fanout(abs, [-1, 2, -3])
+[1, 2, 3]
+'''
+
+import contextvars
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def sum_chunk(chunk):
+    return [sum(chunk)]
+
+
+def num_workers(workers):
+    '''
+    0 or None means one worker per core
+    '''
+
+    if not workers:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def chunks(items, chunk_size):
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def use_pool(n, workers, chunk_size):
+    '''
+    It's only worth to start the pool if there are more than one worker and
+    more than one chunk of work
+    '''
+
+    return num_workers(workers) > 1 and n > chunk_size
+
+
+def map_chunks(f, items, workers=0, chunk_size=1000, args=(), join=None):
+    '''
+    Calls f(chunk, *args) for each chunk of items and returns the
+    concatenation of the results, a list or join(results) if given, like
+    CiphertextBatch.concat.
+
+    f should be a module level function so it can be pickled to the workers.
+    '''
+
+    parts = chunks(items, chunk_size)
+    workers = min(num_workers(workers), len(parts))
+
+    if workers <= 1:
+        results = [f(part, *args) for part in parts]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(f, parts, *[[a] * len(parts) for a in args]))
+
+    if join:
+        return join(results)
+    out = []
+    for r in results:
+        out.extend(r)
+    return out
+
+
+def fanout(f, items, workers=0):
+    '''
+    Calls f(item) for each item at once, each one in a thread, and returns
+    the results in the same order. workers limits the threads, 0 is one
+    per item and 1 calls f in this thread one after the other.
+    '''
+
+    items = list(items)
+    workers = min(workers or len(items), len(items))
+    if workers <= 1:
+        return [f(item) for item in items]
+    # each call continues the trace of the caller, see base.tracing
+    calls = [functools.partial(contextvars.copy_context().run, f, item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda call: call(), calls))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
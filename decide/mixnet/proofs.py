@@ -0,0 +1,176 @@
+'''
+Zero knowledge proofs of the homomorphic votes.
+
+A homomorphic vote is a cipher (a, b) = (g^r, g^m y^r) for each option and
+the store multiplies them, so a cipher of g^2 or g^-1 would count twice or
+take votes away, and a sum over the census bound would break the discrete
+log of the tally. So each option has a disjunctive Chaum-Pedersen proof
+that m is 0 or 1, and the vote a Chaum-Pedersen proof that the product of
+the options is a cipher of g, only one option is chosen.
+
+The proofs are non interactive, the challenge is the sha256 of the
+context, the key, the ciphers and the commitments, the decimal numbers
+joined by commas, mod the order of the exponents. The context is the
+voting and the voter, so a proof isn't valid for other voter. The booth
+makes the same proofs in crypto/proofs.js.
+
+The json of a vote:
+
+    {"options": [ {"a": int, "b": int, "proof": [[c0, z0], [c1, z1]]} ],
+     "proof": [c, z]}
+
+>>> from .groups import ModGroup
+>>> p, g = 4611686018427394499, 4
+>>> group, pk = ModGroup(p), (p, g, pow(g, 123456789, p))
+>>> vote = encrypt_vote(group, pk, 1, 3, context=('decide', 1, 2))
+>>> len(verify_vote(group, pk, vote, context=('decide', 1, 2)))
+3
+>>> verify_vote(group, pk, vote, context=('decide', 1, 3))
+Traceback (most recent call last):
+...
+ValueError: Invalid proof of the option 0
+'''
+
+import hashlib
+import secrets
+
+
+def challenge(order, *values):
+    text = ','.join(str(v) for v in values)
+    return int(hashlib.sha256(text.encode()).hexdigest(), 16) % order
+
+
+def random_exponent(order):
+    return 1 + secrets.randbelow(order - 1)
+
+
+def commitment(group, g, y, a, b, c, z):
+    '''
+    The commitments (g^z / a^c, y^z / b^c) of a proof with challenge c and
+    response z that (a, b) is (g^r, y^r)
+    '''
+
+    return (group.op(group.power(g, z), group.inverse(group.power(a, c))),
+            group.op(group.power(y, z), group.inverse(group.power(b, c))))
+
+
+def unexp(group, g, b, m):
+    # b / g^m, the b of a cipher of g^0 if the cipher is of g^m
+    return group.op(b, group.inverse(group.power(g, m)))
+
+
+def prove_bit(group, order, g, y, cipher, m, r, context=()):
+    '''
+    Proof that cipher = (g^r, g^m y^r) with m in 0, 1, the real one for m
+    and a simulated one for the other
+    '''
+
+    a, b = cipher
+    other = 1 - m
+    fake = [secrets.randbelow(order), secrets.randbelow(order)]
+    w = secrets.randbelow(order)
+
+    commits = [None, None]
+    commits[m] = (group.power(g, w), group.power(y, w))
+    commits[other] = commitment(group, g, y, a, unexp(group, g, b, other), *fake)
+
+    c = challenge(order, *context, g, y, a, b, *commits[0], *commits[1])
+    cm = (c - fake[0]) % order
+    proof = [None, None]
+    proof[m] = [cm, (w + cm * r) % order]
+    proof[other] = fake
+    return proof
+
+
+def verify_bit(group, order, g, y, cipher, proof, context=()):
+    a, b = cipher
+    commits = []
+    total = 0
+    for m, (c, z) in enumerate(proof):
+        if not (0 <= c < order and 0 <= z < order):
+            return False
+        commits += commitment(group, g, y, a, unexp(group, g, b, m), c, z)
+        total += c
+    return challenge(order, *context, g, y, a, b, *commits) == total % order
+
+
+def prove_sum(group, order, g, y, ciphers, r, context=()):
+    '''
+    Proof that the product of the ciphers is (g^r, g y^r), r is the sum of
+    the r of the ciphers
+    '''
+
+    a = group.product(cipher[0] for cipher in ciphers)
+    b = group.product(cipher[1] for cipher in ciphers)
+    w = secrets.randbelow(order)
+    commit = (group.power(g, w), group.power(y, w))
+    c = challenge(order, *context, g, y, a, b, *commit)
+    return [c, (w + c * r) % order]
+
+
+def verify_sum(group, order, g, y, ciphers, proof, context=()):
+    c, z = proof
+    if not (0 <= c < order and 0 <= z < order):
+        return False
+    a = group.product(cipher[0] for cipher in ciphers)
+    b = group.product(cipher[1] for cipher in ciphers)
+    commit = commitment(group, g, y, a, unexp(group, g, b, 1), c, z)
+    return challenge(order, *context, g, y, a, b, *commit) == c
+
+
+def encrypt_vote(group, pk, choice, options, context=()):
+    '''
+    Vote with proofs for the option in the position choice of the options,
+    what the booth does
+    '''
+
+    p, g, y = pk
+    order = group.order(g)
+    ciphers, proofs = [], []
+    total = 0
+    for i in range(options):
+        m = int(i == choice)
+        r = random_exponent(order)
+        cipher = (group.power(g, r), group.op(group.power(g, m), group.power(y, r)))
+        ciphers.append(cipher)
+        proofs.append(prove_bit(group, order, g, y, cipher, m, r, context))
+        total += r
+
+    return {
+        'options': [{'a': a, 'b': b, 'proof': proof}
+                    for (a, b), proof in zip(ciphers, proofs)],
+        'proof': prove_sum(group, order, g, y, ciphers, total % order, context),
+    }
+
+
+def verify_vote(group, pk, vote, context=()):
+    '''
+    The ciphers [[a, b]] of the options of the vote, raises ValueError if
+    the vote or any of its proofs isn't valid
+    '''
+
+    p, g, y = map(int, pk)
+    try:
+        ciphers = [[int(o['a']), int(o['b'])] for o in vote['options']]
+        bits = [[[int(n) for n in pair] for pair in o['proof']] for o in vote['options']]
+        total = [int(n) for n in vote['proof']]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Malformed vote')
+    if (not ciphers or any(len(proof) != 2 or any(len(pair) != 2 for pair in proof)
+                           for proof in bits) or len(total) != 2):
+        raise ValueError('Malformed vote')
+
+    order = group.order(g)
+    if not all(group.contains(n, order) for cipher in ciphers for n in cipher):
+        raise ValueError('The ciphers are not in the group of the key')
+    for i, (cipher, proof) in enumerate(zip(ciphers, bits)):
+        if not verify_bit(group, order, g, y, cipher, proof, context):
+            raise ValueError('Invalid proof of the option {}'.format(i))
+    if not verify_sum(group, order, g, y, ciphers, total, context):
+        raise ValueError('Invalid proof of the sum of the options')
+    return ciphers
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
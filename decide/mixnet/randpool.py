@@ -0,0 +1,115 @@
+'''
+Buffered randomness for the mixnet nonces and permutations.
+
+Random bytes are read from the OS CSPRNG in big blocks and the nonces and
+permutation indices are taken from that buffer, instead of creating a new
+random generator for each number.
+
+>>> pool = RandPool(block_size=64)
+>>> all(0 <= pool.randint(0, 9) <= 9 for i in range(1000))
+True
+>>> k = pool.nonce(167)
+>>> 1 <= k < 166 and gcd(k, 166) == 1
+True
+>>> pool.stats()['nonces']
+1
+'''
+
+import os
+import time
+import threading
+from math import gcd
+
+
+# bytes read from the OS on each refill
+BLOCK_SIZE = 64 * 1024
+
+
+class RandPool:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.buf = b''
+        self.pos = 0
+        self.pid = os.getpid()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.started = time.time()
+        self.nonces = 0
+        self.indices = 0
+        self.refills = 0
+
+    def read(self, n):
+        with self.lock:
+            # a forked process, like the mixnet pool workers, can't reuse the
+            # parent buffer or both would get the same numbers
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.buf = b''
+                self.pos = 0
+
+            if self.pos + n > len(self.buf):
+                self.buf = self.buf[self.pos:] + os.urandom(max(n, self.block_size))
+                self.pos = 0
+                self.refills += 1
+
+            data = self.buf[self.pos:self.pos + n]
+            self.pos += n
+            return data
+
+    def getrandbits(self, k):
+        nbytes = (k + 7) // 8
+        n = int.from_bytes(self.read(nbytes), 'big')
+        return n >> (nbytes * 8 - k)
+
+    def randrange(self, size):
+        '''
+        Random integer 0 <= N < size, without modulo bias
+        '''
+
+        k = (size - 1).bit_length()
+        while True:
+            n = self.getrandbits(k)
+            if n < size:
+                return n
+
+    def randint(self, a, b):
+        '''
+        Random integer a <= N <= b, used for the permutation indices
+        '''
+
+        self.indices += 1
+        return a + self.randrange(b - a + 1)
+
+    def nonce(self, p):
+        '''
+        Random exponent for the ElGamal group of modulus p, coprime with p-1
+        '''
+
+        p = int(p)
+        while True:
+            k = 1 + self.randrange(p - 2)
+            if gcd(k, p - 1) == 1:
+                break
+        self.nonces += 1
+        return k
+
+    def stats(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            'nonces': self.nonces,
+            'indices': self.indices,
+            'refills': self.refills,
+            'nonces_per_second': self.nonces / elapsed,
+            'indices_per_second': self.indices / elapsed,
+        }
+
+
+# shared by all the MixCrypt instances of the process
+pool = RandPool()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
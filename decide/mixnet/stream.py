@@ -0,0 +1,383 @@
+'''
+Chunked streaming variant of the shuffle and decrypt chain calls.
+
+In the chain calls every auth receives all the ballots, processes them and
+only then calls the next auth, keeping the whole list in memory several
+times. In a stream the ballots are sent in chunks of
+MIXNET_STREAM_CHUNK_SIZE:
+
+ * the receiving auth writes each chunk to a file of fixed-width records,
+   so it doesn't keep them in memory,
+ * with the last chunk it draws one permutation of all the ballots, the
+   cross-chunk permutation that keeps the shuffle sound, a shuffle inside
+   each chunk would keep every ballot in its chunk,
+ * and then it reencrypts, or decrypts, the ballots chunk by chunk in the
+   permuted order, while a thread sends the previous chunk to the next
+   auth, that stores it.
+
+Every auth needs all the ballots of its input before sending the first one
+of its output, any of them can be the first after the permutation. So the
+pipeline overlaps the crypto of each auth with the transfer and storage of
+its output in the next one, and the memory is a few chunks and the
+permutation.
+
+The last auth answers the last chunk with the result, the shuffled ciphers
+or the clears, and that answer goes back through the chain. With "chain":
+false each auth answers with its output. The output of every auth is
+checkpointed like in the whole calls, see mixnet.checkpoint, an auth in
+the middle of the chain saves it before sending its last chunk, and sends
+it again from the checkpoint when the tally is resumed.
+
+The data of each chunk is the data of the shuffle or decrypt call and:
+
+ * stream: id of the stream, made by the sender
+ * offset: position of the first msg of the chunk in the stream
+ * total: number of msgs of the stream
+
+The chunks come in order, from a thread of the sender, and the stream
+views only accept the staff token of the tally, that each auth forwards to
+the next one. The files of the streams that never got their last chunk are
+removed after MIXNET_STREAM_EXPIRY seconds.
+'''
+
+import contextvars
+import os
+import re
+import mmap
+import uuid
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .batch import CiphertextBatch
+from . import wire
+
+
+# chunk size of the output when this auth doesn't set one
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def new_stream():
+    return uuid.uuid4().hex
+
+
+class StreamStore:
+    '''
+    Msgs of a stream in a file of fixed-width records, a and then b
+
+    >>> import tempfile
+    >>> store = StreamStore(tempfile.mkdtemp(), new_stream(), width=2)
+    >>> store.write(0, CiphertextBatch.from_list([[1, 2], [3, 4]], 2))
+    >>> store.write(2, CiphertextBatch.from_list([[5, 6]], 2))
+    >>> store.size()
+    3
+    >>> store.write(4, CiphertextBatch.from_list([[7, 8]], 2))
+    Traceback (most recent call last):
+    ...
+    ValueError: Chunk at 4 after a gap, the stream has 3 msgs
+    >>> store.take([2, 0]).to_list()
+    [[5, 6], [1, 2]]
+    >>> store.remove()
+    '''
+
+    def __init__(self, directory, stream, width):
+        if not re.fullmatch('[0-9a-f]{1,64}', str(stream)):
+            raise ValueError('Invalid stream id {}'.format(stream))
+        self.directory = directory
+        self.path = os.path.join(directory, '{}.stream'.format(stream))
+        self.width = width
+        self.record = 2 * width
+
+    def write(self, offset, batch):
+        '''
+        Writes the batch from the position offset. A chunk after a gap is
+        rejected, so size() is the number of msgs received, and a retried
+        one is written again in place, the file is never truncated.
+        '''
+
+        size = self.size()
+        if offset > size:
+            raise ValueError('Chunk at {} after a gap, the stream has {} msgs'.format(offset, size))
+
+        w, r = self.width, self.record
+        data = bytearray(len(batch) * r)
+        for i in range(len(batch)):
+            data[i * r:i * r + w] = batch.a[i * w:(i + 1) * w]
+            data[i * r + w:(i + 1) * r] = batch.b[i * w:(i + 1) * w]
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with open(fd, 'r+b') as f:
+            f.seek(offset * r)
+            f.write(data)
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path) // self.record
+        except FileNotFoundError:
+            return 0
+
+    def take(self, indices):
+        '''
+        Batch with the msgs in these positions
+        '''
+
+        w, r = self.width, self.record
+        out = CiphertextBatch.empty(len(indices), w)
+        if not len(indices):
+            return out
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for i, j in enumerate(indices):
+                    out.a[i * w:(i + 1) * w] = data[j * r:j * r + w]
+                    out.b[i * w:(i + 1) * w] = data[j * r + w:(j + 1) * r]
+        return out
+
+    def blocks(self, size=1 << 20):
+        '''
+        The bytes of the file, in blocks of size
+        '''
+
+        with open(self.path, 'rb') as f:
+            block = f.read(size)
+            while block:
+                yield block
+                block = f.read(size)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def expire(directory, age):
+    '''
+    Removes the files of the streams not written for age seconds
+    '''
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    limit = time.time() - age
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.endswith('.stream') and os.path.getmtime(path) < limit:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ChunkSender:
+    '''
+    Sends the chunks of a stream to an auth from a thread, so the caller
+    prepares the next chunk while one is sent and stored. close() waits for
+    the last one and returns its answer, the result of the stream.
+
+    With MIXNET_STREAM_PIPELINE = False the chunks are sent right away by
+    the caller.
+    '''
+
+    def __init__(self, entry_point, data, baseurl=None, total=0, depth=2, token=''):
+        self.entry_point = entry_point
+        self.baseurl = baseurl
+        self.headers = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+        self.data = dict(data, stream=new_stream(), total=total)
+        self.data.pop('msgs', None)
+        self.result = None
+        self.error = None
+        self.thread = None
+        if settings.MIXNET_STREAM_PIPELINE:
+            self.queue = queue.Queue(depth)
+            # the thread continues the trace of the caller, see base.tracing
+            context = contextvars.copy_context()
+            self.thread = threading.Thread(target=context.run, args=(self.run,), daemon=True)
+            self.thread.start()
+
+    def post(self, data):
+        self.result = wire.post(self.entry_point, data, baseurl=self.baseurl, **self.headers)
+
+    def run(self):
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                if not self.error:
+                    try:
+                        self.post(data)
+                    except Exception as e:
+                        self.error = e
+        finally:
+            connections.close_all()
+
+    def send(self, chunk, offset):
+        if self.error:
+            raise self.error
+        data = dict(self.data, msgs=chunk, offset=offset)
+        if self.thread:
+            self.queue.put(data)
+        else:
+            self.post(data)
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def send(entry_point, msgs, data, baseurl=None, chunk_size=DEFAULT_CHUNK_SIZE, token=''):
+    '''
+    Streams the msgs, a CiphertextBatch, to the entry point and returns the
+    result. The token is the staff token of the stream views.
+    '''
+
+    sender = ChunkSender(entry_point, data, baseurl, total=len(msgs), token=token)
+    for start in range(0, len(msgs), chunk_size) or [0]:
+        sender.send(msgs[start:start + chunk_size], start)
+    return sender.close()
+
+
+def receive(mn, op, data, token=''):
+    '''
+    Stores a chunk of a stream to the mixnet mn, op is 'shuffle' or
+    'decrypt'. With the last chunk the output of this auth is sent to the
+    next one, with the token, and the result is returned, None before the
+    last chunk.
+    '''
+
+    pk = data.get('pk', None)
+    if pk:
+        pk = (pk['p'], pk['g'], pk['y'])
+    else:
+        pk = (mn.key.p, mn.key.g, mn.key.y)
+
+    try:
+        offset, total = int(data['offset']), int(data['total'])
+        stream = data['stream']
+    except (KeyError, TypeError):
+        raise ValueError('Missing stream fields')
+
+    msgs = mn.batch(data.get('msgs', []), pk)
+    if offset < 0 or offset + len(msgs) > total:
+        raise ValueError('The chunk at {} of {} msgs is out of the {} msgs of the stream'.format(
+                         offset, len(msgs), total))
+
+    store = StreamStore(settings.MIXNET_STREAM_DIR, stream, msgs.width)
+    if not offset:
+        expire(settings.MIXNET_STREAM_DIR, settings.MIXNET_STREAM_EXPIRY)
+    store.write(offset, msgs)
+    if store.size() != total:
+        return None
+
+    try:
+        return emit(mn, op, store, total, pk, data, token)
+    finally:
+        store.remove()
+
+
+def emit(mn, op, store, total, pk, data, token=''):
+    last = data.get('force-last', mn.next_auths().count() == 0)
+    bound = mn.dlog_bound(data.get('dlog', 0), token)
+    # the decrypt only shuffles if asked
+    shuffle = op == 'shuffle' or data.get('shuffle', True)
+
+    sender = None
+    if data.get('chain', True):
+        out = {'pk': {'p': pk[0], 'g': pk[1], 'y': pk[2]}}
+        if op == 'decrypt':
+            out.update({'shuffle': shuffle, 'dlog': bound})
+        sender = mn.chain_stream('/stream/{}/{}/'.format(op, mn.voting_id), out, total,
+                                 token=token)
+
+    options = {}
+    if op == 'decrypt':
+        options = dict(last=bool(last), shuffle=bool(shuffle), bound=bound)
+    ckpt = mn.checkpoint(op, pk, store.blocks(), **options)
+
+    if sender:
+        return forward(sender, ckpt, process(mn, op, store, total, pk, last, shuffle))
+
+    def compute():
+        results = [chunk for start, chunk in process(mn, op, store, total, pk, last, shuffle)]
+        if op == 'decrypt' and last:
+            return mn.clears([m for chunk in results for m in chunk], pk, bound, mn.crypt())
+        return CiphertextBatch.concat(results)
+
+    return mn.checkpointed(ckpt, compute)
+
+
+def forward(sender, ckpt, chunks):
+    '''
+    Sends the offsets and chunks of the output of this auth to the next
+    one and returns the result. The chunks are appended to the checkpoint
+    ckpt as they are sent, and it's committed before the last chunk, that
+    starts the work of the next auth, so a failure from there on resumes
+    here. A checkpointed output is sent again in chunks without computing
+    it.
+    '''
+
+    saved = ckpt.load() if ckpt else None
+    if saved is not None:
+        size = settings.MIXNET_STREAM_CHUNK_SIZE or DEFAULT_CHUNK_SIZE
+        chunks = ((start, saved[start:start + size])
+                  for start in range(0, len(saved), size) or [0])
+        ckpt = None
+
+    writer = ckpt.writer() if ckpt else None
+    try:
+        pending = None
+        for start, chunk in chunks:
+            if pending:
+                sender.send(*pending)
+            if writer:
+                writer.append(chunk)
+            pending = chunk, start
+
+        if writer:
+            writer.commit()
+    finally:
+        if writer:
+            writer.discard()
+
+    sender.send(*pending)
+    return sender.close()
+
+
+def process(mn, op, store, total, pk, last, shuffle):
+    '''
+    Offsets and chunks of the output of this auth, in the order of the
+    cross-chunk permutation
+    '''
+
+    crypt = mn.crypt()
+    size = settings.MIXNET_STREAM_CHUNK_SIZE or DEFAULT_CHUNK_SIZE
+    opts = dict(workers=settings.MIXNET_WORKERS,
+                chunk_size=settings.MIXNET_CHUNK_SIZE)
+
+    if shuffle:
+        perm = crypt.gen_perm(total)
+    else:
+        perm = list(range(total))
+
+    for start in range(0, total, size) or [0]:
+        chunk = store.take(perm[start:start + size])
+        if op == 'shuffle':
+            factors = mn.factor_pool(pk).take(len(chunk))
+            chunk = crypt.reencrypt_many(chunk, pk, factors=factors, **opts)
+        else:
+            chunk = crypt.multiple_decrypt(chunk, last, **opts)
+        yield start, chunk
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
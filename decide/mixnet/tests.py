@@ -1,12 +1,45 @@
+import os
+import json
+import zlib
+import pickle
+import tempfile
+from unittest import mock
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.test import override_settings
 from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
+from rest_framework.test import APITransactionTestCase
 
+from mixnet import mixcrypt
 from mixnet.mixcrypt import MixCrypt
 from mixnet.mixcrypt import ElGamal
+from mixnet.mixcrypt import rand
+from mixnet.ecmixcrypt import EcMixCrypt
+from mixnet.fixedexp import FixedExponent
+from mixnet.batch import CiphertextBatch, key_width
+from mixnet import wire
+from mixnet import stream
+from mixnet.checkpoint import Checkpoint
+from mixnet import backends
+from mixnet.randpool import RandPool
+from mixnet.factorpool import FactorPool
+from mixnet import dlog
+from mixnet import proofs
+from mixnet.dlog import DlogTable
+from mixnet.groups import FFDHE, MODP
+from mixnet.models import Mixnet, Group
 
 from base import mods
+from base.models import Key
+from census.models import Census
+from voting.models import Question, Voting
 
 
 class MixnetCase(APITestCase):
@@ -102,6 +135,83 @@ class MixnetCase(APITestCase):
 
         self.assertEqual(sorted(clear), sorted(clear2))
 
+    def login_staff(self, voters=0):
+        '''
+        The client sends the token of an admin, and the census of the
+        voting 1 has these voters
+        '''
+
+        admin, _ = User.objects.get_or_create(username='admin', defaults={'is_staff': True})
+        self.token = Token.objects.get_or_create(user=admin)[0].key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+        for voter in range(voters):
+            Census(voting_id=1, voter_id=voter + 1).save()
+
+    @override_settings(MIXNET_DLOG_DIR=tempfile.mkdtemp())
+    def test_decrypt_homomorphic(self):
+        self.test_create()
+
+        p, g = self.key["p"], self.key["g"]
+        pk = p, g, self.key["y"]
+        counts = [3, 0, 5, 1]
+        encrypt = self.encrypt_msgs([pow(g, c, p) for c in counts], pk)
+
+        # only for staff
+        data = { "msgs": encrypt, "shuffle": False, "dlog": 10 }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertIn(response.status_code, (401, 403))
+        response = self.client.post('/mixnet/decrypt/1/', dict(data, dlog=0), format='json')
+        self.assertIn(response.status_code, (401, 403))
+
+        self.login_staff(voters=10)
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), counts)
+
+        # the table of the logs is bounded by the census
+        for bound in (11, 10**30, -1, "10", 2.5):
+            with self.subTest(bound=bound):
+                response = self.client.post('/mixnet/decrypt/1/', dict(data, dlog=bound),
+                                            format='json')
+                self.assertEqual(response.status_code, 400)
+
+    @override_settings(MIXNET_DLOG_DIR=tempfile.mkdtemp())
+    def test_decrypt_curve(self):
+        data = {
+            "voting": 1,
+            "curve": "p256",
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" }
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        key = response.json()
+        self.assertEqual(key["curve"], "p256")
+
+        k = EcMixCrypt(curve="p256")
+        k.k = k.construct((key["p"], key["g"], key["y"]))
+        clear = [2, 3, 4, 5, 6, 7, 8]
+        encrypt = [k.encrypt(k.encode(m)) for m in clear]
+
+        response = self.client.post('/mixnet/shuffle/1/', { "msgs": encrypt }, format='json')
+        self.assertEqual(response.status_code, 200)
+        shuffled = response.json()
+        self.assertNotEqual(shuffled, encrypt)
+
+        response = self.client.post('/mixnet/decrypt/1/', { "msgs": shuffled }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()), clear)
+
+        # homomorphic, the counts are multiples of the generator
+        self.login_staff(voters=10)
+        counts = [3, 0, 5]
+        encrypt = [k.encrypt(k.group.power(key["g"], c)) for c in counts]
+        data = { "msgs": encrypt, "shuffle": False, "dlog": 10 }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), counts)
+
     def test_multiple_auths(self):
         '''
         This test emulates a two authorities shuffle and decryption.
@@ -188,3 +298,648 @@ class MixnetCase(APITestCase):
 
         self.assertNotEqual(clear, clear1)
         self.assertEqual(sorted(clear), sorted(clear1))
+
+    def keygen_auths(self, voting=1):
+        # the first auth sets the pubkeys of the others with the staff token
+        self.login_staff()
+        data = {
+            "voting": voting,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+                { "name": "auth3", "url": "http://0.0.0.0:8000" },
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        key = response.json()
+
+        mns = Mixnet.objects.filter(voting_id=voting).order_by('auth_position')
+        self.assertEqual([mn.auth_position for mn in mns], [0, 1, 2])
+        self.assertEqual([[a.name for a in mn.next_auths()] for mn in mns],
+                         [['auth2', 'auth3'], ['auth3'], []])
+        y = 1
+        for mn in mns:
+            y = y * mn.key.y % key["p"]
+        self.assertEqual(key["y"], y)
+
+        # the pubkey of each auth is the product of the keys from it on
+        for i, mn in enumerate(mns):
+            y = 1
+            for other in mns[i:]:
+                y = y * other.key.y % key["p"]
+            self.assertEqual(mn.pubkey.y, y)
+        return key, mns[0]
+
+    @override_settings(MIXNET_KEYGEN_WORKERS=1)
+    def test_keygen_fanout(self):
+        key, mn = self.keygen_auths()
+        self.assertEqual([t["position"] for t in mn.keygen_timing], [1, 2])
+        for t in mn.keygen_timing:
+            self.assertGreaterEqual(t["request"], t["keygen"])
+            self.assertAlmostEqual(t["request"], t["keygen"] + t["overhead"])
+
+        # the pubkey is only the product of the keys of the auth and the next ones
+        second = Mixnet.objects.get(voting_id=1, auth_position=1)
+        third = Mixnet.objects.get(voting_id=1, auth_position=2)
+        keys = [second.key.y, third.key.y]
+
+        # only for staff
+        self.client.credentials()
+        response = self.client.post('/mixnet/pubkey/1/', {"position": 1, "keys": keys},
+                                    format='json')
+        self.assertIn(response.status_code, (401, 403))
+        self.login_staff()
+
+        for body, status in (({"position": 1, "keys": keys[::-1]}, 400),
+                             ({"position": 1, "keys": [second.key.y, "x"]}, 400),
+                             ({"position": 1, "keys": [second.key.y]}, 409),
+                             ({"position": 1, "keys": keys}, 200)):
+            response = self.client.post('/mixnet/pubkey/1/', body, format='json')
+            self.assertEqual(response.status_code, status)
+        self.assertEqual(response.json()["y"], second.pubkey.y)
+
+        # the same mixnets as the chain of calls
+        with override_settings(MIXNET_KEYGEN='chain'):
+            self.keygen_auths(voting=2)
+
+        # the shuffle and decrypt chains through the three auths
+        clear = [2, 3, 4, 5, 6, 7, 8]
+        pk = key["p"], key["g"], key["y"]
+        data = { "msgs": self.encrypt_msgs(clear, pk), "pk": key }
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        data = { "msgs": response.json(), "pk": key }
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(sorted(response.json()), clear)
+
+    def stream_auths(self):
+        '''
+        Two auths mixnet, the encrypted clears and its pk. The stream views
+        are for staff, the client sends the token of an admin.
+        '''
+
+        self.login_staff()
+
+        data = {
+            "voting": 1,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+            ]
+        }
+        response = self.client.post('/mixnet/', data, format='json')
+        key = response.json()
+        pk = key["p"], key["g"], key["y"]
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        encrypt = CiphertextBatch.from_list(self.encrypt_msgs(clear, pk),
+                                            key_width(key["p"]))
+        return clear, encrypt, key
+
+    @override_settings(MIXNET_STREAM_DIR=tempfile.mkdtemp(),
+                       MIXNET_STREAM_CHUNK_SIZE=4,
+                       MIXNET_STREAM_PIPELINE=False)
+    def test_stream(self):
+        clear, encrypt, key = self.stream_auths()
+
+        shuffled = stream.send('/stream/shuffle/1/', encrypt, {"pk": key}, chunk_size=5,
+                               token=self.token)
+        self.assertEqual(len(shuffled), len(clear))
+        self.assertNotEqual(shuffled, encrypt)
+
+        clear2 = stream.send('/stream/decrypt/1/', shuffled, {"pk": key}, chunk_size=5,
+                             token=self.token)
+        self.assertEqual(sorted(clear), sorted(clear2))
+
+        # the same order without shuffle
+        clear2 = stream.send('/stream/decrypt/1/', encrypt,
+                             {"pk": key, "shuffle": False}, chunk_size=3, token=self.token)
+        self.assertEqual(clear, clear2)
+
+        # the chunks before the last one are only stored
+        data = {"msgs": encrypt[:5].to_list(), "pk": key,
+                "stream": stream.new_stream(), "offset": 0, "total": 13}
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertEqual(response.json(), {})
+
+        # a retried first chunk doesn't truncate the stream, and the last
+        # one is only taken when all the msgs are stored
+        data.update(msgs=encrypt[5:10].to_list(), offset=5)
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        data.update(msgs=encrypt[:5].to_list(), offset=0)
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertEqual(response.json(), {})
+        path = os.path.join(settings.MIXNET_STREAM_DIR, data["stream"] + '.stream')
+        self.assertEqual(os.path.getsize(path), 10 * 2 * encrypt.width)
+        data.update(msgs=encrypt[10:].to_list(), offset=10)
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 13)
+        self.assertFalse(os.path.exists(path))
+
+        # chunks out of the stream or after a gap
+        data.update(stream=stream.new_stream(), msgs=encrypt[10:].to_list(), offset=11)
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        data.update(offset=-1)
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        data.update(offset=5)
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        data["stream"] = "../nope"
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # the streams without their last chunk expire
+        data.update(stream=stream.new_stream(), msgs=encrypt[:5].to_list(), offset=0)
+        self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        path = os.path.join(settings.MIXNET_STREAM_DIR, data["stream"] + '.stream')
+        os.utime(path, (0, 0))
+        data["stream"] = stream.new_stream()
+        self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertFalse(os.path.exists(path))
+
+        # only for staff
+        User.objects.filter(username='admin').update(is_staff=False)
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertIn(response.status_code, (401, 403))
+        self.client.credentials()
+        response = self.client.post('/mixnet/stream/shuffle/1/', data, format='json')
+        self.assertIn(response.status_code, (401, 403))
+
+    @override_settings(MIXNET_STREAM_DIR=tempfile.mkdtemp(),
+                       MIXNET_STREAM_CHUNK_SIZE=4,
+                       MIXNET_STREAM_PIPELINE=False,
+                       MIXNET_CHECKPOINT_DIR=tempfile.mkdtemp())
+    def test_stream_resume(self):
+        clear, encrypt, key = self.stream_auths()
+
+        process = stream.process
+        positions = []
+        def second_auth_down(mn, *args):
+            positions.append(mn.auth_position)
+            if mn.auth_position == 1:
+                raise RuntimeError('auth2 down')
+            return process(mn, *args)
+
+        with mock.patch.object(stream, 'process', second_auth_down):
+            with self.assertRaises(Exception):
+                stream.send('/stream/shuffle/1/', encrypt, {"pk": key}, chunk_size=5,
+                            token=self.token)
+        self.assertEqual(positions, [0, 1])
+
+        # the first auth saved its output before the second one failed
+        ckpts = list(Checkpoint.all(settings.MIXNET_CHECKPOINT_DIR, 1))
+        self.assertEqual([(c.position, c.op) for c in ckpts], [(0, 'shuffle')])
+        self.assertEqual(len(ckpts[0].load()), len(clear))
+
+        # and sends it again, only the second one shuffles
+        def count(mn, *args):
+            positions.append(mn.auth_position)
+            return process(mn, *args)
+
+        positions.clear()
+        with mock.patch.object(stream, 'process', count):
+            shuffled = stream.send('/stream/shuffle/1/', encrypt, {"pk": key}, chunk_size=5,
+                                   token=self.token)
+        self.assertEqual(positions, [1])
+        self.assertEqual(len(list(Checkpoint.all(settings.MIXNET_CHECKPOINT_DIR, 1))), 2)
+
+        clear2 = stream.send('/stream/decrypt/1/', shuffled, {"pk": key}, chunk_size=5,
+                             token=self.token)
+        self.assertEqual(sorted(clear), sorted(clear2))
+
+    def test_binary_wire(self):
+        self.test_create()
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9]
+        pk = self.key["p"], self.key["g"], self.key["y"]
+        encrypt = self.encrypt_msgs(clear, pk)
+        batch = CiphertextBatch.from_list(encrypt, key_width(self.key["p"]))
+        opts = dict(content_type=wire.CONTENT_TYPE, HTTP_ACCEPT=wire.ACCEPT)
+
+        body = wire.encode({}, batch)
+        response = self.client.post('/mixnet/shuffle/1/', body, **opts)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], wire.CONTENT_TYPE)
+        shuffled = wire.decode(response.content)['msgs']
+        self.assertEqual(len(shuffled), len(clear))
+
+        # json answer if the binary format isn't accepted
+        response = self.client.post('/mixnet/shuffle/1/', body,
+                                    content_type=wire.CONTENT_TYPE)
+        self.assertEqual(len(response.json()), len(clear))
+
+        body = wire.encode({ "force-last": False }, shuffled, compress=True)
+        response = self.client.post('/mixnet/decrypt/1/', body, **opts)
+        self.assertEqual(response['Content-Type'], wire.CONTENT_TYPE)
+        partial = wire.decode(response.content)['msgs']
+
+        # the clears of the last auth are json
+        response = self.client.post('/mixnet/decrypt/1/', wire.encode({}, shuffled), **opts)
+        self.assertEqual(sorted(response.json()), clear)
+        self.assertNotEqual(partial.column('b'), response.json())
+
+        response = self.client.post('/mixnet/shuffle/1/', b'DMX1 garbage', **opts)
+        self.assertEqual(response.status_code, 400)
+
+        def raw(meta, columns=b''):
+            meta = json.dumps(meta).encode()
+            return wire.HEADER.pack(wire.MAGIC, len(meta)) + meta + columns
+
+        # 10 MB of zeros in a few KB, only the declared size is inflated
+        bomb = zlib.compress(bytes(10 << 20), 9)
+        bad = [
+            raw([1, 2]),
+            raw({"width": 0, "count": 0}),
+            raw({"width": 32, "count": -1}),
+            raw({"width": "32", "count": 1}, bytes(64)),
+            raw({"width": 32, "count": 1 << 40}),
+            raw({"width": 32, "count": 1, "compression": "zlib"}, bomb),
+            raw({"width": 32, "count": 0, "compression": "zlib"}, bomb),
+            raw({"width": 32, "count": 1, "compression": "zlib"}, zlib.compress(bytes(64)) + b'x'),
+        ]
+        for body in bad:
+            response = self.client.post('/mixnet/shuffle/1/', body, **opts)
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(MIXNET_CHECKPOINT_DIR=tempfile.mkdtemp())
+    def test_checkpoint(self):
+        self.test_create()
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        pk = self.key["p"], self.key["g"], self.key["y"]
+        encrypt = self.encrypt_msgs(clear, pk)
+        data = { "msgs": encrypt }
+
+        # the same input has the same output, saved in the checkpoint
+        shuffled = self.client.post('/mixnet/shuffle/1/', data, format='json').json()
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        self.assertEqual(response.json(), shuffled)
+
+        data = { "msgs": shuffled }
+        clear1 = self.client.post('/mixnet/decrypt/1/', data, format='json').json()
+        response = self.client.post('/mixnet/decrypt/1/', data, format='json')
+        self.assertEqual(response.json(), clear1)
+        self.assertEqual(sorted(clear1), clear)
+
+        ckpts = list(Checkpoint.all(settings.MIXNET_CHECKPOINT_DIR, 1))
+        self.assertEqual([c.op for c in ckpts], ['decrypt', 'shuffle'])
+        self.assertEqual(ckpts[0].load(), clear1)
+
+        call_command('mixnetcheckpoints', 2, purge=True)
+        self.assertEqual(len(list(Checkpoint.all(settings.MIXNET_CHECKPOINT_DIR))), 2)
+        call_command('mixnetcheckpoints', 1, purge=True)
+        self.assertEqual(list(Checkpoint.all(settings.MIXNET_CHECKPOINT_DIR)), [])
+
+        # a new shuffle without the checkpoint
+        data = { "msgs": encrypt }
+        response = self.client.post('/mixnet/shuffle/1/', data, format='json')
+        self.assertNotEqual(response.json(), shuffled)
+
+    @override_settings(MIXNET_POOL_DIR=tempfile.mkdtemp())
+    def test_shuffle_factor_pool(self):
+        q = Question.objects.create(desc='factor pool')
+        v = Voting.objects.create(name='factor pool', question=q)
+        data = {
+            "voting": v.id,
+            "auths": [
+                { "name": "auth1", "url": "http://localhost:8000" },
+                { "name": "auth2", "url": "http://127.0.0.1:8000" },
+            ]
+        }
+        key = self.client.post('/mixnet/', data, format='json').json()
+        pk = key["p"], key["g"], key["y"]
+
+        # without the key of the voting there's nothing to precompute
+        with self.assertRaises(CommandError):
+            call_command('mixnetpool', str(v.id), position=1, size=10)
+        v.pub_key = Key.objects.create(p=key["p"], g=key["g"], y=key["y"])
+        v.save()
+        with self.assertRaises(CommandError):
+            call_command('mixnetpool', str(v.id), position=1)
+
+        # the second auth precomputes for the key of the voting, not its own
+        call_command('mixnetpool', str(v.id), position=1, size=10)
+        mn = Mixnet.objects.get(voting_id=v.id, auth_position=1)
+        self.assertNotEqual(mn.pubkey.y, key["y"])
+        pool = mn.factor_pool(pk)
+        self.assertEqual(pool.size(), 10)
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        encrypt = self.encrypt_msgs(clear, pk)
+
+        data = { "msgs": encrypt, "pk": key }
+        response = self.client.post('/mixnet/shuffle/{}/'.format(v.id), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        shuffled = response.json()
+        self.assertEqual(pool.size(), 0)
+
+        data = { "msgs": shuffled, "pk": key }
+        response = self.client.post('/mixnet/decrypt/{}/'.format(v.id), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(clear), sorted(response.json()))
+
+    def test_create_group_pool(self):
+        call_command('mixnetgroups', size=2, bits=settings.KEYBITS)
+        self.assertEqual(Group.objects.filter(bits=settings.KEYBITS).count(), 2)
+        group = Group.objects.first()
+
+        with override_settings(MIXNET_STANDARD_GROUPS=''):
+            self.test_create()
+
+        self.assertEqual((self.key["p"], self.key["g"]), (group.p, group.g))
+        self.assertEqual(Group.objects.count(), 1)
+
+    def test_standard_group(self):
+        mn = Mixnet(voting_id=1)
+        self.assertEqual(mn.group(bits=2048), (FFDHE[2048], 2))
+        with override_settings(MIXNET_STANDARD_GROUPS='modp'):
+            self.assertEqual(mn.group(bits=2048), (MODP[2048], 2))
+        with override_settings(MIXNET_STANDARD_GROUPS=''):
+            self.assertIsNone(mn.group(bits=2048))
+
+
+class MixnetThreadsCase(APITransactionTestCase):
+    '''
+    The stream chunks and the keygen calls are sent from other threads, that
+    only see committed data
+    '''
+
+    setUp = MixnetCase.setUp
+    tearDown = MixnetCase.tearDown
+    encrypt_msgs = MixnetCase.encrypt_msgs
+    login_staff = MixnetCase.login_staff
+    stream_auths = MixnetCase.stream_auths
+    keygen_auths = MixnetCase.keygen_auths
+
+    def test_keygen_fanout_threads(self):
+        key, mn = self.keygen_auths()
+        self.assertEqual(len(mn.keygen_timing), 2)
+
+    @override_settings(MIXNET_STREAM_DIR=tempfile.mkdtemp(),
+                       MIXNET_STREAM_CHUNK_SIZE=4)
+    def test_stream_pipeline(self):
+        clear, encrypt, key = self.stream_auths()
+
+        shuffled = stream.send('/stream/shuffle/1/', encrypt, {"pk": key}, chunk_size=5,
+                               token=self.token)
+        clear2 = stream.send('/stream/decrypt/1/', shuffled, {"pk": key}, chunk_size=5,
+                             token=self.token)
+        self.assertEqual(sorted(clear), sorted(clear2))
+        self.assertEqual(os.listdir(settings.MIXNET_STREAM_DIR), [])
+
+
+class MixCryptCase(TestCase):
+
+    def crypts(self):
+        base = MixCrypt(bits=settings.KEYBITS, backend='python')
+        k = base.k
+        crypts = []
+        for name in backends.available():
+            crypt = MixCrypt(bits=settings.KEYBITS, backend=name)
+            crypt.setk(k.p, k.g, k.y, k.x)
+            crypts.append(crypt)
+        return crypts
+
+    def test_python_backend(self):
+        py = backends.get_backend('python')
+        self.assertEqual(py.powmod(156, 130, 167), 89)
+        self.assertEqual(py.mulmod(py.invert(130, 167), 130, 167), 1)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            backends.get_backend('unknown')
+
+    @skipUnless(backends.gmpy2, 'gmpy2 is not installed')
+    def test_backends_same_results(self):
+        py, gmp = self.crypts()
+        self.assertEqual(gmp.backend.name, 'gmpy2')
+
+        clear = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
+        nonces = [rand(py.k.p) for i in clear]
+        cipher = [py.encrypt(m, r=r) for m, r in zip(clear, nonces)]
+        cipher2 = [gmp.encrypt(m, r=r) for m, r in zip(clear, nonces)]
+        self.assertEqual(cipher, cipher2)
+
+        for c in cipher2:
+            self.assertEqual(type(c[0]), int)
+            self.assertEqual(type(c[1]), int)
+
+        self.assertEqual(py.multiple_decrypt(cipher), clear)
+        self.assertEqual(gmp.multiple_decrypt(cipher), clear)
+
+        shuffled = gmp.shuffle(cipher)
+        self.assertEqual(sorted(py.multiple_decrypt(shuffled)), clear)
+
+    def test_precompute(self):
+        for crypt in self.crypts():
+            clear = list(range(2, 40))
+            nonces = [rand(crypt.k.p) for i in clear]
+            cipher = [crypt.encrypt(m, r=r) for m, r in zip(clear, nonces)]
+
+            gt, yt = crypt.precompute()
+            self.assertEqual(gt.pow(12345), pow(int(crypt.k.g), 12345, int(crypt.k.p)))
+            cipher2 = [crypt.encrypt(m, r=r) for m, r in zip(clear, nonces)]
+            self.assertEqual(cipher, cipher2)
+
+            shuffled = crypt.shuffle(cipher)
+            self.assertEqual(sorted(crypt.multiple_decrypt(shuffled)), clear)
+
+    def test_parallel_shuffle(self):
+        crypt = self.crypts()[0]
+        clear = list(range(2, 40))
+        cipher = [crypt.encrypt(m) for m in clear]
+
+        shuffled = crypt.shuffle(cipher, workers=2, chunk_size=10)
+        self.assertEqual(len(shuffled), len(cipher))
+        self.assertFalse(set(map(tuple, shuffled)) & set(map(tuple, cipher)))
+        self.assertEqual(sorted(crypt.multiple_decrypt(shuffled)), clear)
+
+    def test_decrypt_batch(self):
+        for crypt in self.crypts():
+            clear = list(range(2, 40))
+            cipher = [crypt.encrypt(m) for m in clear]
+
+            self.assertEqual(crypt.decrypt_batch(cipher), clear)
+            self.assertEqual(crypt.multiple_decrypt(cipher, workers=2, chunk_size=10), clear)
+
+            partial = crypt.multiple_decrypt(cipher, last=False, workers=2, chunk_size=10)
+            self.assertEqual([a for a, b in partial], [a for a, b in cipher])
+
+            clear2 = crypt.shuffle_decrypt(cipher, workers=2, chunk_size=10)
+            self.assertEqual(sorted(clear2), clear)
+
+    def test_decrypt_blinding(self):
+        for crypt in self.crypts():
+            clear = list(range(2, 40))
+            cipher = [crypt.encrypt(m) for m in clear]
+
+            # a random power of g for each cipher, 0 if it isn't blinded
+            for blinding, nonces in ((True, len(cipher)), (False, 0)):
+                crypt.blinding = blinding
+                with mock.patch('mixnet.mixcrypt.rand', wraps=mixcrypt.rand) as nonce:
+                    self.assertEqual(crypt.decrypt_batch(cipher), clear)
+                self.assertEqual(nonce.call_count, nonces)
+                self.assertEqual(crypt.multiple_decrypt(cipher, workers=2, chunk_size=10), clear)
+
+        mn = Mixnet(voting_id=1)
+        with override_settings(MIXNET_DECRYPT_BLINDING=False):
+            mn.gen_key()
+            self.assertFalse(mn.crypt().blinding)
+        self.assertTrue(mn.crypt().blinding)
+
+    def test_randpool(self):
+        pool = RandPool(block_size=128)
+        p = int(self.crypts()[0].k.p)
+
+        nonces = [pool.nonce(p) for i in range(20)]
+        self.assertEqual(len(set(nonces)), 20)
+        for k in nonces:
+            self.assertTrue(1 <= k < p - 1)
+
+        indices = [pool.randint(0, 3) for i in range(200)]
+        self.assertEqual(set(indices), {0, 1, 2, 3})
+
+        stats = pool.stats()
+        self.assertEqual(stats['nonces'], 20)
+        self.assertEqual(stats['indices'], 200)
+        self.assertTrue(stats['refills'] > 1)
+        self.assertTrue(stats['nonces_per_second'] > 0)
+
+    def test_factor_pool(self):
+        crypt = self.crypts()[0]
+        pk = crypt.params()
+        pool = FactorPool(pk, tempfile.mkdtemp())
+        self.assertEqual(pool.take(5), [])
+
+        pool.fill(30, workers=2, chunk_size=10)
+        self.assertEqual(pool.size(), 30)
+
+        factors = pool.take(20)
+        self.assertEqual(len(factors), 20)
+        self.assertEqual(pool.size(), 10)
+        self.assertEqual(len(set(factors)), 20)
+        for a, b in factors:
+            self.assertEqual(crypt.decrypt((a, b)), 1)
+
+        clear = list(range(2, 40))
+        cipher = [crypt.encrypt(m) for m in clear]
+        shuffled = crypt.shuffle(cipher, factors=factors)
+        self.assertEqual(sorted(crypt.multiple_decrypt(shuffled)), clear)
+        self.assertEqual(len(pool.take(20)), 10)
+
+    def test_curve(self):
+        crypt = EcMixCrypt(curve='p256', backend='python')
+        self.assertEqual(crypt.bits, 256)
+        with self.assertRaises(ValueError):
+            EcMixCrypt(curve='unknown')
+
+        clear = list(range(2, 20))
+        cipher = [crypt.encrypt(crypt.encode(m)) for m in clear]
+        # the ciphers are compressed points, 33 bytes
+        self.assertTrue(all(a.bit_length() <= 258 for a, b in cipher))
+        shuffled = crypt.shuffle(cipher)
+        self.assertNotEqual(shuffled, cipher)
+        d = crypt.multiple_decrypt(shuffled)
+        self.assertEqual(sorted(crypt.decode(m) for m in d), clear)
+
+        pool = FactorPool(crypt.params(), tempfile.mkdtemp(), curve='p256')
+        pool.fill(len(clear), workers=1)
+        shuffled = crypt.shuffle(cipher, factors=pool.take(len(clear)))
+        d = crypt.multiple_decrypt(shuffled)
+        self.assertEqual(sorted(crypt.decode(m) for m in d), clear)
+
+        g = crypt.k.g
+        table = DlogTable.get(crypt.k.p, g, 100, tempfile.mkdtemp(), crypt.group)
+        for e in [0, 1, 57, 100]:
+            self.assertEqual(table.log(crypt.group.power(g, e), 100), e)
+
+    def test_fixed_exponent(self):
+        for e in [1, 2, 3, 31, 32, 2**255 + 1, rand(2**256)]:
+            for window in [2, 4, 5, 6]:
+                self.assertEqual(FixedExponent(e, window).value(), e)
+
+        crypt = EcMixCrypt(curve='p256', backend='python')
+        ec = crypt.ec
+        cipher = [crypt.encrypt(crypt.encode(m)) for m in range(2, 12)]
+        x = int(crypt.k.x)
+        expected = ec.encode_many([ec.add(ec.decode(b), ec.neg(ec.mul(ec.decode(a), x)))
+                                   for a, b in cipher])
+        self.assertEqual(crypt.decrypt_batch(cipher), expected)
+
+    def test_ciphertext_batch(self):
+        crypt = self.crypts()[0]
+        width = key_width(crypt.k.p)
+        cipher = [list(crypt.encrypt(m)) for m in range(2, 12)]
+        batch = CiphertextBatch.from_list(cipher, width)
+        self.assertEqual(batch.to_list(), cipher)
+        self.assertEqual(batch.nbytes, 2 * width * len(cipher))
+        self.assertEqual(pickle.loads(pickle.dumps(batch[3:6])).to_list(), cipher[3:6])
+        with self.assertRaises(ValueError):
+            CiphertextBatch.from_list([[crypt.k.p << 8, 1]], width)
+
+        # the chunks are views of the same buffer
+        chunks = batch.chunks(4)
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        self.assertIs(chunks[1].a.obj, batch.a.obj)
+
+        shuffled = crypt.shuffle(batch, workers=2, chunk_size=3)
+        self.assertIsInstance(shuffled, CiphertextBatch)
+        partial = crypt.multiple_decrypt(shuffled, last=False)
+        self.assertIsInstance(partial, CiphertextBatch)
+        self.assertEqual(partial.column('a'), shuffled.column('a'))
+        self.assertEqual(sorted(crypt.shuffle_decrypt(shuffled)), list(range(2, 12)))
+
+        crypt = EcMixCrypt(curve='p256', backend='python')
+        cipher = [crypt.encrypt(crypt.encode(m)) for m in range(2, 6)]
+        batch = CiphertextBatch.from_list(cipher, key_width(crypt.k.p, 'p256'))
+        d = crypt.shuffle_decrypt(crypt.shuffle(batch))
+        self.assertEqual(sorted(crypt.decode(m) for m in d), [2, 3, 4, 5])
+
+    def test_dlog_table(self):
+        k = self.crypts()[0].k
+        p, g = int(k.p), int(k.g)
+        directory = tempfile.mkdtemp()
+
+        table = DlogTable.get(p, g, 1000, directory)
+        self.assertEqual(table.m, 32)
+        for e in [0, 1, 31, 32, 500, 1000]:
+            self.assertEqual(table.log(pow(g, e, p), 1000), e)
+        with self.assertRaises(ValueError):
+            table.log(pow(g, 1001, p), 1000)
+
+        # mapped again from disk by a new process, and rebuilt when it's small
+        dlog._tables.clear()
+        self.assertEqual(DlogTable.get(p, g, 100, directory).m, 32)
+        table = DlogTable.get(p, g, 10000, directory)
+        self.assertEqual(table.m, 101)
+        self.assertEqual(table.log(pow(g, 9999, p), 10000), 9999)
+
+    def test_vote_proofs(self):
+        crypt = MixCrypt(bits=settings.KEYBITS)
+        ec = EcMixCrypt(curve='p256')
+        for crypt in (crypt, ec):
+            group = crypt.group
+            pk = crypt.params()
+            context = ('decide', 1, 2)
+            vote = proofs.encrypt_vote(group, pk, 2, 4, context)
+            ciphers = proofs.verify_vote(group, pk, vote, context)
+            clears = [crypt.decrypt(c) for c in ciphers]
+            g = pk[1]
+            self.assertEqual(clears, [group.identity] * 2 + [g, group.identity])
+
+            # a cipher of g^2, or the proofs of other voter
+            forged = dict(vote, options=[dict(o) for o in vote['options']])
+            forged['options'][2]['b'] = group.op(forged['options'][2]['b'], g)
+            for bad, context2 in ((forged, context), (vote, ('decide', 1, 3))):
+                with self.assertRaises(ValueError):
+                    proofs.verify_vote(group, pk, bad, context2)
+
+            # two options with g^1, each proof is right but not the sum
+            two = proofs.encrypt_vote(group, pk, 1, 4, context)
+            two['options'][2] = vote['options'][2]
+            with self.assertRaisesRegex(ValueError, 'sum'):
+                proofs.verify_vote(group, pk, two, context)
@@ -7,6 +7,9 @@ router.register(r'', views.MixnetViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('pubkey/<int:voting_id>/', views.PubKey.as_view(), name='pubkey'),
     path('shuffle/<int:voting_id>/', views.Shuffle.as_view(), name='shuffle'),
     path('decrypt/<int:voting_id>/', views.Decrypt.as_view(), name='decrypt'),
+    path('stream/shuffle/<int:voting_id>/', views.StreamShuffle.as_view(), name='stream-shuffle'),
+    path('stream/decrypt/<int:voting_id>/', views.StreamDecrypt.as_view(), name='stream-decrypt'),
 ]
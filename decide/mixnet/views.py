@@ -1,11 +1,17 @@
+import time
+
 from django.conf import settings
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from .serializers import MixnetSerializer
 from .models import Auth, Mixnet, Key
+from .groups import get_group
+from . import wire, stream
+from base.perms import UserIsStaff
 from base.serializers import KeySerializer, AuthSerializer
 
 
@@ -24,12 +30,21 @@ class MixnetViewSet(viewsets.ModelViewSet):
          * voting: id
          * position: int / nullable
          * key: { "p": int, "g": int } / nullable
+         * curve: str / nullable, elliptic curve of the key, like "p256"
+         * chain: bool / nullable, false to only gen the key of this auth,
+           the first one calls all the others at once, see
+           MIXNET_KEYGEN. The answer has the seconds of the keygen.
+
+        With the parallel keygen of more than two auths the request needs
+        a staff token, the first auth sends it to set the pubkeys of the
+        others.
         """
 
         auths = request.data.get("auths")
         voting = request.data.get("voting")
         key = request.data.get("key", {"p": 0, "g": 0})
         position = request.data.get("position", 0)
+        curve = request.data.get("curve", "")
         p, g = int(key["p"]), int(key["g"])
 
         dbauths = []
@@ -46,32 +61,89 @@ class MixnetViewSet(viewsets.ModelViewSet):
         for a in dbauths:
             mn.auths.add(a)
 
-        mn.gen_key(p, g)
+        start = time.perf_counter()
+        mn.gen_key(p, g, curve)
+        keygen = time.perf_counter() - start
 
-        data = { "key": { "p": mn.key.p, "g": mn.key.g } }
-        # chained call to the next auth to gen the key
-        resp = mn.chain_call("/", data)
-        if resp:
-            y = (resp["y"] * mn.key.y) % mn.key.p
-        else:
+        data = { "key": { "p": mn.key.p, "g": mn.key.g }, "curve": curve }
+        group = mn.crypt().group
+        chain = request.data.get("chain", True)
+        if not chain:
+            # the first auth calls this one and the others at once
             y = mn.key.y
+        elif settings.MIXNET_KEYGEN == 'parallel':
+            # the keys of all the next auths at once
+            token = request.auth.key if request.auth else ''
+            y = group.product([mn.key.y] + mn.keygen_fanout(data, token))
+        else:
+            # chained call to the next auth to gen the key
+            resp = mn.chain_call("/", data)
+            if resp:
+                y = group.op(resp["y"], mn.key.y)
+            else:
+                y = mn.key.y
 
-        pubkey = Key(p=mn.key.p, g=mn.key.g, y=y)
+        pubkey = Key(p=mn.key.p, g=mn.key.g, y=y, curve=curve)
         pubkey.save()
         mn.pubkey = pubkey
         mn.save()
 
-        return  Response(KeySerializer(pubkey, many=False).data)
+        data = KeySerializer(pubkey, many=False).data
+        if not chain:
+            data = dict(data, keygen=keygen)
+        return  Response(data)
+
+
+class PubKey(APIView):
+    permission_classes = (UserIsStaff,)
+
+    def post(self, request, voting_id):
+        """
+        The pubkey of this auth after a parallel keygen, the product of the
+        keys from this auth on, like in the chained one. It's sent by the
+        first auth, see Mixnet.keygen_fanout.
+
+         * position: int
+         * keys: [int], the y of this auth and the next ones
+
+        The pubkey is only set once, then the same keys are accepted again.
+        Only for staff, the first auth sends the token of the keygen.
+        """
+
+        position = request.data.get("position", 0)
+        mn = get_object_or_404(Mixnet, voting_id=voting_id, auth_position=position)
+
+        keys = request.data.get("keys")
+        group = get_group(mn.key.p, mn.key.curve)
+        if not isinstance(keys, list) or not keys or \
+                any(isinstance(y, bool) or not isinstance(y, int) or not group.contains(y)
+                    for y in keys):
+            return Response({"detail": "Wrong keys"}, status=400)
+        if keys[0] != mn.key.y:
+            return Response({"detail": "The first key isn't the key of this auth"}, status=400)
+
+        y = group.product(keys)
+        pubkey = mn.pubkey
+        if pubkey.y != y:
+            if pubkey.y != mn.key.y:
+                return Response({"detail": "The pubkey is already set"}, status=409)
+            pubkey.y = y
+            pubkey.save()
+
+        return Response(KeySerializer(pubkey, many=False).data)
 
 
 class Shuffle(APIView):
+    parser_classes = tuple(api_settings.DEFAULT_PARSER_CLASSES) + (wire.MixnetParser,)
 
     def post(self, request, voting_id):
         """
          * voting_id: id
-         * msgs: [ [int, int] ]
+         * msgs: [ [int, int] ], or a binary body, see mixnet.wire
          * pk: { "p": int, "g": int, "y": int } / nullable
          * position: int / nullable
+         * chain: bool / nullable, false to answer without calling the
+           next auth, the voting calls each auth itself
         """
 
         position = request.data.get("position", 0)
@@ -85,6 +157,8 @@ class Shuffle(APIView):
             p, g, y = mn.key.p, mn.key.g, mn.key.y
 
         msgs = mn.shuffle(msgs, (p, g, y))
+        if not request.data.get("chain", True):
+            return wire.response(request, msgs)
 
         data = {
             "msgs": msgs,
@@ -95,17 +169,28 @@ class Shuffle(APIView):
         if resp:
             msgs = resp
 
-        return  Response(msgs)
+        return wire.response(request, msgs)
 
 
 class Decrypt(APIView):
+    parser_classes = tuple(api_settings.DEFAULT_PARSER_CLASSES) + (wire.MixnetParser,)
 
     def post(self, request, voting_id):
         """
          * voting_id: id
-         * msgs: [ [int, int] ]
+         * msgs: [ [int, int] ], or a binary body, see mixnet.wire
          * pk: { "p": int, "g": int, "y": int } / nullable
          * position: int / nullable
+         * shuffle: bool / nullable, false to keep the msgs order
+         * dlog: int / nullable, max exponent of the clears g^e, the last
+           auth returns the exponents, at most the census size
+         * chain: bool / nullable, false to answer without calling the
+           next auth, the voting calls each auth itself
+         * force-last: bool / nullable, if this auth is the last one, set
+           by the voting when it calls each auth
+
+        The shuffle and dlog options are only for staff, the token is sent
+        to the next auth.
         """
 
         position = request.data.get("position", 0)
@@ -117,22 +202,77 @@ class Decrypt(APIView):
             p, g, y = pk["p"], pk["g"], pk["y"]
         else:
             p, g, y = mn.key.p, mn.key.g, mn.key.y
+        shuffle = request.data.get("shuffle", True)
+        bound = request.data.get("dlog", 0)
+        token = ''
+        if bound or not shuffle:
+            # only the tally of the voting keeps the order of the msgs or
+            # builds a table of discrete logs, as big as the bound
+            self.permission_classes = (UserIsStaff,)
+            self.check_permissions(request)
+            token = request.auth.key
+            try:
+                bound = mn.dlog_bound(bound, token)
+            except ValueError as e:
+                return Response({"detail": str(e)}, status=400)
 
         next_auths = mn.next_auths()
         last = next_auths.count() == 0
 
-        # useful for tests only, to override the last value
+        # to override the last value, when the voting calls each auth
         last = request.data.get("force-last", last)
 
-        msgs = mn.decrypt(msgs, (p, g, y), last=last)
+        msgs = mn.decrypt(msgs, (p, g, y), last=last, shuffle=shuffle, bound=bound)
+        if not request.data.get("chain", True):
+            return wire.response(request, msgs)
 
         data = {
             "msgs": msgs,
             "pk": { "p": p, "g": g, "y": y },
+            "shuffle": shuffle,
+            "dlog": bound,
         }
         # chained call to the next auth to gen the key
-        resp = mn.chain_call("/decrypt/{}/".format(voting_id), data)
+        resp = mn.chain_call("/decrypt/{}/".format(voting_id), data, token=token)
         if resp:
             msgs = resp
 
-        return  Response(msgs)
+        return wire.response(request, msgs)
+
+
+class StreamShuffle(APIView):
+    parser_classes = tuple(api_settings.DEFAULT_PARSER_CLASSES) + (wire.MixnetParser,)
+    permission_classes = (UserIsStaff,)
+    op = 'shuffle'
+
+    def post(self, request, voting_id):
+        """
+        A chunk of a stream, see mixnet.stream. The data of the shuffle and:
+
+         * stream: str, id of the stream
+         * offset: int, position of the first msg of the chunk
+         * total: int, number of msgs of the stream
+
+        Answers {} to the chunks before the last one. Only for staff, the
+        token is sent to the next auth.
+        """
+
+        position = request.data.get("position", 0)
+        mn = get_object_or_404(Mixnet, voting_id=voting_id, auth_position=position)
+
+        try:
+            msgs = stream.receive(mn, self.op, request.data, token=request.auth.key)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+
+        if msgs is None:
+            return Response({})
+        return wire.response(request, msgs)
+
+
+class StreamDecrypt(StreamShuffle):
+    """
+    A chunk of a stream, with the data of the decrypt
+    """
+
+    op = 'decrypt'
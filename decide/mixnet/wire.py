@@ -0,0 +1,209 @@
+'''
+Binary format for the msgs of the mixnet chain calls.
+
+The shuffle and decrypt calls between auths, and the tally of the voting,
+send all the ballots. As json every cipher is two huge decimal numbers that
+are printed and parsed again at every hop, so these calls can also send
+the msgs as the buffer of a CiphertextBatch:
+
+    magic b'DMX1' | length of the meta (4 bytes) | meta json | columns
+
+The meta has the rest of the data of the call, the width and count of the
+fixed-width ints and the compression of the columns, '' or 'zlib'. The
+views accept both formats, and answer in this one when the request
+accepts it and the answer are ciphers, the clears of the last decrypt are
+always json. With MIXNET_WIRE = 'json' the old format is used.
+
+>>> batch = CiphertextBatch.from_list([[1, 2], [3, 4]], width=2)
+>>> body = encode({'pk': {'p': 7}}, batch)
+>>> len(body)
+75
+>>> data = decode(body)
+>>> data['pk'], data['msgs'].to_list()
+({'p': 7}, [[1, 2], [3, 4]])
+>>> decode(encode({}, batch, compress=True))['msgs'].to_list()
+[[1, 2], [3, 4]]
+'''
+
+import json
+import struct
+import zlib
+
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.response import Response
+
+from base import mods
+from base import tracing
+from .batch import CiphertextBatch
+
+
+CONTENT_TYPE = 'application/x-decide-mixnet'
+# the binary format first, json if the other side doesn't know it
+ACCEPT = '{}, application/json'.format(CONTENT_TYPE)
+
+MAGIC = b'DMX1'
+HEADER = struct.Struct('>4sI')
+
+
+class MixnetError(Exception):
+    '''
+    Error answer of an auth to a mixnet call
+    '''
+
+
+def encode(data, batch, compress=False):
+    '''
+    Body with the data and the batch as its msgs
+    '''
+
+    with tracing.span('serialize', msgs=len(batch)):
+        columns = batch.tobytes()
+        meta = dict(data, width=batch.width, count=len(batch),
+                    compression='zlib' if compress else '')
+        meta.pop('msgs', None)
+        if compress:
+            columns = zlib.compress(columns, 1)
+        meta = json.dumps(meta).encode()
+        return HEADER.pack(MAGIC, len(meta)) + meta + columns
+
+
+def decode(body):
+    '''
+    Data of a body made by encode, with the msgs as a CiphertextBatch
+    '''
+
+    with tracing.span('deserialize', bytes=len(body)):
+        body = memoryview(body)
+        if len(body) < HEADER.size:
+            raise ValueError('Truncated mixnet body')
+        magic, size = HEADER.unpack_from(body)
+        if magic != MAGIC:
+            raise ValueError('Not a mixnet body')
+        start = HEADER.size + size
+        data = json.loads(body[HEADER.size:start].tobytes().decode())
+        if not isinstance(data, dict):
+            raise ValueError('The mixnet meta is not an object')
+
+        width, count = data.pop('width'), data.pop('count')
+        if not isinstance(width, int) or not isinstance(count, int) or width <= 0 or count < 0:
+            raise ValueError('Wrong mixnet width or count')
+        expected = 2 * width * count
+        if expected > settings.MIXNET_WIRE_MAX_SIZE:
+            raise ValueError('Mixnet body too big')
+
+        columns = body[start:]
+        if data.pop('compression', ''):
+            # never more than the expected size, a small body can inflate a
+            # lot, and one byte more to see the excess, a max_length of 0,
+            # the expected size of an empty batch, has no limit
+            d = zlib.decompressobj()
+            columns = d.decompress(columns, expected + 1)
+            if d.unconsumed_tail or d.unused_data or not d.eof:
+                raise ValueError('Wrong mixnet body size')
+        if len(columns) != expected:
+            raise ValueError('Wrong mixnet body size')
+        data['msgs'] = CiphertextBatch.frombuffer(columns, width)
+        return data
+
+
+def split(data):
+    '''
+    The bodies of a concatenation of uncompressed bodies made by encode
+
+    >>> batch = CiphertextBatch.from_list([[1, 2], [3, 4]], width=2)
+    >>> data = encode({}, batch[:1]) + encode({}, batch[1:])
+    >>> [decode(body)['msgs'].to_list() for body in split(data)]
+    [[[1, 2]], [[3, 4]]]
+    '''
+
+    data = memoryview(data)
+    while data:
+        if len(data) < HEADER.size:
+            raise ValueError('Truncated mixnet body')
+        magic, size = HEADER.unpack_from(data)
+        start = HEADER.size + size
+        meta = json.loads(data[HEADER.size:start].tobytes().decode())
+        if not isinstance(meta, dict) or meta.get('compression'):
+            raise ValueError('Not an uncompressed mixnet body')
+        end = start + 2 * int(meta.get('width', 0)) * int(meta.get('count', 0))
+        if end > len(data):
+            raise ValueError('Truncated mixnet body')
+        yield data[:end]
+        data = data[end:]
+
+
+class MixnetParser(BaseParser):
+    media_type = CONTENT_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return decode(stream.read())
+        except (ValueError, KeyError, zlib.error) as e:
+            raise ParseError('Mixnet parse error - {}'.format(e))
+
+
+def accepts(request):
+    return CONTENT_TYPE in request.META.get('HTTP_ACCEPT', '')
+
+
+def binary():
+    return settings.MIXNET_WIRE == 'binary'
+
+
+def response(request, msgs):
+    '''
+    Response with the msgs, binary if they are a batch and the request
+    accepts it
+    '''
+
+    if isinstance(msgs, CiphertextBatch):
+        if accepts(request) and binary():
+            body = encode({}, msgs, settings.MIXNET_WIRE_COMPRESS)
+            return HttpResponse(body, content_type=CONTENT_TYPE)
+        msgs = msgs.to_list()
+    return Response(msgs)
+
+
+def content_type(response):
+    # requests responses have headers, django ones are dict like
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        headers = response
+    return headers.get('Content-Type', '')
+
+
+def post(entry_point, data, baseurl=None, **kwargs):
+    '''
+    mods.post to the mixnet entry point, with the msgs of data in the
+    binary format if they are a batch, and json if not or if MIXNET_WIRE
+    is 'json'. Returns the data of the response, with the msgs as a batch
+    if the response is binary, and raises MixnetError if the auth answers
+    with an error.
+    '''
+
+    msgs = data.get('msgs')
+    if not isinstance(msgs, CiphertextBatch) or not binary():
+        if isinstance(msgs, CiphertextBatch):
+            data = dict(data, msgs=msgs.to_list())
+        response = mods.post('mixnet', entry_point=entry_point, baseurl=baseurl,
+                             json=data, response=True, **kwargs)
+    else:
+        body = encode(data, msgs, settings.MIXNET_WIRE_COMPRESS)
+        response = mods.post('mixnet', entry_point=entry_point, baseurl=baseurl,
+                             data=body, content_type=CONTENT_TYPE, accept=ACCEPT,
+                             response=True, **kwargs)
+
+    if response.status_code >= 400:
+        raise MixnetError('{} {}: {}'.format(entry_point, response.status_code,
+                                             response.content[:200]))
+    if content_type(response).startswith(CONTENT_TYPE):
+        return decode(response.content)['msgs']
+    return response.json()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
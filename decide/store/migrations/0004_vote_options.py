@@ -0,0 +1,19 @@
+# Generated by Django 2.0 on 2026-10-18 14:32
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_auto_20180921_1522'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='options',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+    ]
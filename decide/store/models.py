@@ -1,4 +1,5 @@
 from django.db import models
+from django.contrib.postgres.fields import JSONField
 from base.models import BigBigField
 
 
@@ -8,6 +9,8 @@ class Vote(models.Model):
 
     a = BigBigField()
     b = BigBigField()
+    # homomorphic tally votes, a cipher [a, b] for each option
+    options = JSONField(blank=True, null=True)
 
     voted = models.DateTimeField(auto_now=True)
 
@@ -1,8 +1,11 @@
 import datetime
 import random
+from unittest import mock
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.test import TestCase
+from django.test import override_settings
+from rest_framework.response import Response
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
@@ -12,9 +15,15 @@ from base import mods
 from base.models import Auth
 from base.tests import BaseTestCase
 from census.models import Census
+from census.views import CensusDetail
+from mixnet import proofs
+from mixnet.ecgroup import EcGroup
+from mixnet.groups import ModGroup
 from mixnet.models import Key
 from voting.models import Question
+from voting.models import QuestionOption
 from voting.models import Voting
+from voting.views import VoteValidationView
 
 
 class StoreTextCase(BaseTestCase):
@@ -100,6 +109,114 @@ class StoreTextCase(BaseTestCase):
         self.assertEqual(Vote.objects.first().a, CTE_A)
         self.assertEqual(Vote.objects.first().b, CTE_B)
 
+    @override_settings(MODS_LOCAL=False)
+    def test_store_vote_validation(self):
+        # the voting module in other host, one query to voting/validate
+        Census(voting_id=5001, voter_id=1).save()
+        self.get_or_create_user(2)
+        data = {
+            "voting": 5001,
+            "voter": 1,
+            "vote": { "a": 96, "b": 184 }
+        }
+        user = self.get_or_create_user(1)
+        self.login(user=user.username)
+        response = self.client.post('/store/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Vote.objects.get(voting_id=5001, voter_id=1).a, 96)
+
+        # other voter, not in the census, and a voting that doesn't exist
+        for voter, voting in ((2, 5001), (1, 5003)):
+            data.update(voter=voter, voting=voting)
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 401)
+
+        self.login(user='user2')
+        data.update(voter=2, voting=5001)
+        response = self.client.post('/store/', data, format='json')
+        self.assertEqual(response.status_code, 401)
+
+        response = mods.post('voting', entry_point='/validate/', json={'voting': 'x'})
+        self.assertEqual(response, {'voting': [], 'voter': None, 'census': False})
+
+    @override_settings(MODS_LOCAL=False)
+    def test_store_vote_validation_error(self):
+        # the error answers of voting/validate aren't a 500 of the store
+        Census(voting_id=5001, voter_id=1).save()
+        user = self.get_or_create_user(1)
+        self.login(user=user.username)
+        data = {"voting": 5001, "voter": 1, "vote": { "a": 96, "b": 184 }}
+        answers = (
+            (Response({'detail': 'Invalid token'}, status=401), 401),
+            (Response({'detail': 'Error'}, status=500), 502),
+            (Response({'detail': 'Unexpected'}), 502),
+        )
+        for answer, expected in answers:
+            with mock.patch.object(VoteValidationView, 'post', return_value=answer):
+                response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, expected)
+        self.assertEqual(Vote.objects.count(), 0)
+
+    def test_store_vote_lookups(self):
+        # concurrent only if some of the modules are in other host
+        Census(voting_id=5001, voter_id=1).save()
+        user = self.get_or_create_user(1)
+        self.login(user=user.username)
+        data = {"voting": 5001, "voter": 1, "vote": { "a": 96, "b": 184 }}
+        other = 'http://10.0.0.1:8000'
+        for apis, concurrent in (({}, False), ({'census': other}, True)):
+            with override_settings(APIS=apis), \
+                    mock.patch.object(mods, 'run', wraps=mods.run) as run:
+                response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(run.called, concurrent)
+
+    @override_settings(MODS_CACHE_TTL={'voting': 60})
+    def test_store_vote_dates_changed(self):
+        # the voting cached by other worker, that doesn't see the signal
+        # that invalidates it when it's saved here
+        Census(voting_id=5001, voter_id=1).save()
+        user = self.get_or_create_user(1)
+        self.login(user=user.username)
+        data = {"voting": 5001, "voter": 1, "vote": { "a": 96, "b": 184 }}
+        mods.cache().clear()
+
+        for other in ({}, {'census': 'http://10.0.0.1:8000'}):
+            with override_settings(APIS=other), mock.patch.object(mods, 'invalidate'):
+                self.voting.start_date = timezone.now()
+                self.voting.end_date = None
+                self.voting.save()
+                mods.get('voting', params={'id': 5001})
+
+                self.voting.end_date = timezone.now()
+                self.voting.save()
+                response = self.client.post('/store/', data, format='json')
+                self.assertEqual(response.status_code, 401)
+
+                self.voting.start_date = None
+                self.voting.end_date = None
+                self.voting.save()
+                mods.get('voting', params={'id': 5001})
+
+                self.voting.start_date = timezone.now()
+                self.voting.save()
+                response = self.client.post('/store/', data, format='json')
+                self.assertEqual(response.status_code, 200)
+
+    def test_store_vote_census_error(self):
+        # only a 200 of the census is a voter in it, with the voting here or not
+        Census(voting_id=5001, voter_id=1).save()
+        user = self.get_or_create_user(1)
+        self.login(user=user.username)
+        data = {"voting": 5001, "voter": 1, "vote": { "a": 96, "b": 184 }}
+        error = mock.patch.object(CensusDetail, 'retrieve',
+                                  return_value=Response('Error', status=500))
+        for local in (True, False):
+            with override_settings(MODS_LOCAL=local), error:
+                response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 401)
+        self.assertEqual(Vote.objects.count(), 0)
+
     def test_vote(self):
         self.gen_votes()
         response = self.client.get('/store/', format='json')
@@ -193,3 +310,126 @@ class StoreTextCase(BaseTestCase):
         self.voting.save()
         response = self.client.post('/store/', data, format='json')
         self.assertEqual(response.status_code, 401)
+
+    def test_vote_out_of_group(self):
+        p, g = 4611686018427394499, 4
+        key = Key(p=p, g=g, y=pow(g, 123456789, p))
+        key.save()
+        self.voting.pub_key = key
+        self.voting.save()
+        Census(voting_id=5001, voter_id=1).save()
+        user = self.get_or_create_user(1)
+        self.login(user=user.username)
+
+        data = { "voting": 5001, "voter": 1 }
+        for a, b in ((-1, 3), (2, 2**300), (0, 3), (2, p), ('x', 3), (2, None)):
+            data["vote"] = { "a": a, "b": b }
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+        data["vote"] = "x"
+        response = self.client.post('/store/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Vote.objects.count(), 0)
+
+        data["vote"] = { "a": 2, "b": p - 1 }
+        response = self.client.post('/store/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_vote_out_of_curve(self):
+        group = EcGroup('p256')
+        y = int(group.power(group.g, 123456789))
+        key = Key(p=int(group.p), g=int(group.g), y=y, curve='p256')
+        key.save()
+        self.voting.pub_key = key
+        self.voting.save()
+        Census(voting_id=5001, voter_id=1).save()
+        user = self.get_or_create_user(1)
+        self.login(user=user.username)
+
+        # a wrong prefix, an x without a point and an x out of the field
+        point = int(group.power(group.g, 5))
+        prefix = 2 << group.size
+        x = next(x for x in range(1, 100) if group.sqrt(group.rhs(x)) is None)
+        bad = (1 << group.size | 1, prefix | x, prefix | int(group.p), -point)
+        data = { "voting": 5001, "voter": 1 }
+        for n in bad:
+            data["vote"] = { "a": point, "b": n }
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Vote.objects.count(), 0)
+
+        data["vote"] = { "a": point, "b": y }
+        response = self.client.post('/store/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_homomorphic_vote(self):
+        question = Question(desc='homomorphic')
+        question.save()
+        for i in range(2):
+            QuestionOption(question=question, option='option {}'.format(i)).save()
+        # a safe prime big enough to not guess a challenge
+        p, g = 4611686018427394499, 4
+        key = Key(p=p, g=g, y=pow(g, 123456789, p))
+        key.save()
+        pk = (key.p, key.g, key.y)
+        voting = Voting(pk=5002, name='homomorphic', question=question,
+                        start_date=timezone.now(), pub_key=key,
+                        tally_mode=Voting.HOMOMORPHIC)
+        voting.save()
+        group = ModGroup(p)
+
+        ciphers = {}
+        for voter, choice in ((5101, 0), (5102, 1)):
+            Census(voting_id=5002, voter_id=voter).save()
+            user = self.get_or_create_user(voter)
+            self.login(user=user.username)
+            vote = proofs.encrypt_vote(group, pk, choice, 2, context=('decide', 5002, voter))
+            ciphers[voter] = [[o['a'], o['b']] for o in vote['options']]
+
+            data = { "voting": 5002, "voter": voter, "vote": { "a": 2, "b": 3 } }
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+            # the ciphers without proofs
+            data["vote"] = [{ "a": a, "b": b } for a, b in ciphers[voter]]
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+            data["vote"] = dict(vote, options=vote['options'][:1])
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+            # the proofs of other voter
+            other = proofs.encrypt_vote(group, pk, choice, 2, context=('decide', 5002, 1))
+            data["vote"] = other
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+            # g^2 in the chosen option, two votes
+            forged = dict(vote, options=[dict(o) for o in vote['options']])
+            forged['options'][choice]['b'] = group.op(forged['options'][choice]['b'], g)
+            data["vote"] = forged
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+            data["vote"] = vote
+            response = self.client.post('/store/', data, format='json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(Vote.objects.get(voting_id=5002, voter_id=5101).options, ciphers[5101])
+
+        response = self.client.get('/store/aggregate/5002/', format='json')
+        self.assertEqual(response.status_code, 403)
+
+        self.login()
+        response = self.client.get('/store/aggregate/5002/', format='json')
+        self.assertEqual(response.status_code, 200)
+        msgs = [[group.op(c1[0], c2[0]), group.op(c1[1], c2[1])]
+                for c1, c2 in zip(ciphers[5101], ciphers[5102])]
+        self.assertEqual(response.json(), { 'votes': 2, 'msgs': msgs })
+
+        # a voting without key yet, and one that doesn't exist
+        response = self.client.get('/store/aggregate/5001/', format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/store/aggregate/5999/', format='json')
+        self.assertEqual(response.status_code, 404)
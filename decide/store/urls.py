@@ -4,4 +4,5 @@ from . import views
 
 urlpatterns = [
     path('', views.StoreView.as_view(), name='store'),
+    path('aggregate/<int:voting_id>/', views.AggregateView.as_view(), name='aggregate'),
 ]
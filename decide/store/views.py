@@ -1,18 +1,23 @@
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 import django_filters.rest_framework
+import requests
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework import generics
+from rest_framework.views import APIView
 
 from .models import Vote
 from .serializers import VoteSerializer
 from base import mods
 from base.perms import UserIsStaff
+from mixnet import proofs
+from mixnet.groups import get_group
 
 
 class StoreView(generics.ListAPIView):
-    queryset = Vote.objects.all()
+    # always the same order, the tally checkpoints are keyed by the input
+    queryset = Vote.objects.order_by('id')
     serializer_class = VoteSerializer
     filter_backends = (django_filters.rest_framework.DjangoFilterBackend,)
     filter_fields = ('voting_id', 'voter_id')
@@ -26,11 +31,58 @@ class StoreView(generics.ListAPIView):
         """
          * voting: id
          * voter: id
-         * vote: { "a": int, "b": int }
+         * vote: { "a": int, "b": int }, or if the voting is homomorphic
+           { "options": [ { "a": int, "b": int, "proof": [[int, int], [int, int]] } ],
+             "proof": [int, int] } with a cipher of g^0 or g^1 for each
+           option and the proofs of mixnet.proofs
         """
 
         vid = request.data.get('voting')
-        voting = mods.get('voting', params={'id': vid})
+        uid = request.data.get('voter')
+        vote = request.data.get('vote')
+
+        if not request.auth:
+            return Response({}, status=status.HTTP_401_UNAUTHORIZED)
+
+        token = request.auth.key
+        # the voting isn't taken from the cache of mods.get, other worker
+        # may have just started or stopped it
+        remote = [not mods.is_local(m, mods.module_url(m))
+                  for m in ('voting', 'authentication', 'census')]
+        if remote[0]:
+            # in other host, the voting module does the three in one query,
+            # the user and the census concurrently if they aren't there
+            try:
+                response = mods.post('voting', entry_point='/validate/', response=True,
+                                     json={'voting': vid, 'voter': uid, 'token': token})
+                valid = response.json()
+            except (requests.RequestException, ValueError):
+                return Response({}, status=status.HTTP_502_BAD_GATEWAY)
+            if response.status_code in (401, 403):
+                return Response({}, status=status.HTTP_401_UNAUTHORIZED)
+            if response.status_code != 200 or not isinstance(valid, dict) or \
+                    any(k not in valid for k in ('voting', 'voter', 'census')):
+                return Response({}, status=status.HTTP_502_BAD_GATEWAY)
+            voting = valid['voting']
+            voter = {'id': valid['voter']}
+            in_census = valid['census']
+        else:
+            census = 'census/{}'.format(vid)
+            if any(remote):
+                # the queries to the other hosts at once
+                voting, voter, perms = mods.run(
+                    mods.aget('voting', params={'id': vid}, cached=False),
+                    mods.apost('authentication', entry_point='/getuser/', json={'token': token}),
+                    mods.aget(census, params={'voter_id': uid}, response=True),
+                )
+            else:
+                # the views of this process run one after the other even
+                # with mods.run, see mods.aquery, so without its event loop
+                voting = mods.get('voting', params={'id': vid}, cached=False)
+                voter = mods.post('authentication', entry_point='/getuser/', json={'token': token})
+                perms = mods.get(census, params={'voter_id': uid}, response=True)
+            in_census = perms.status_code == 200
+
         if not voting or not isinstance(voting, list):
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
         start_date = voting[0].get('start_date', None)
@@ -40,33 +92,90 @@ class StoreView(generics.ListAPIView):
         if not_started or is_closed:
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
-        uid = request.data.get('voter')
-        vote = request.data.get('vote')
-
         if not vid or not uid or not vote:
             return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
+        homomorphic = voting[0].get('tally_mode') == 'homomorphic'
+        if homomorphic:
+            nopts = len(voting[0]['question']['options'])
+            if not isinstance(vote, dict) or len(vote.get('options') or []) != nopts:
+                return Response({}, status=status.HTTP_400_BAD_REQUEST)
+            if not voting[0].get('pub_key'):
+                return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        elif not isinstance(vote, dict):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+
         # validating voter
-        token = request.auth.key
-        voter = mods.post('authentication', entry_point='/getuser/', json={'token': token})
         voter_id = voter.get('id', None)
         if not voter_id or voter_id != uid:
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
         # the user is in the census
-        perms = mods.get('census/{}'.format(vid), params={'voter_id': uid}, response=True)
-        if perms.status_code == 401:
+        if not in_census:
             return Response({}, status=status.HTTP_401_UNAUTHORIZED)
 
-        a = vote.get("a")
-        b = vote.get("b")
+        options = None
+        if homomorphic:
+            # each option is g^0 or g^1 and only one is g^1, see mixnet.proofs
+            pub_key = voting[0]['pub_key']
+            group = get_group(pub_key['p'], pub_key.get('curve', ''))
+            pk = (pub_key['p'], pub_key['g'], pub_key['y'])
+            try:
+                options = proofs.verify_vote(group, pk, vote, context=('decide', vid, uid))
+            except ValueError:
+                return Response({}, status=status.HTTP_400_BAD_REQUEST)
+            a = b = None
+        else:
+            a = vote.get("a")
+            b = vote.get("b")
+            # 0 < a, b < p, or points of the curve, a vote out of the
+            # group of the key would stop the tally
+            pub_key = voting[0].get('pub_key')
+            if pub_key:
+                group = get_group(pub_key['p'], pub_key.get('curve', ''))
+                if not (group.contains(a) and group.contains(b)):
+                    return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
-        defs = { "a": a, "b": b }
+        defs = { "a": a, "b": b, "options": options }
         v, _ = Vote.objects.get_or_create(voting_id=vid, voter_id=uid,
                                           defaults=defs)
         v.a = a
         v.b = b
+        v.options = options
 
         v.save()
 
         return  Response({})
+
+
+class AggregateView(APIView):
+    permission_classes = (UserIsStaff,)
+
+    def get(self, request, voting_id):
+        """
+        Homomorphic sum of the votes, the product of the ciphers of each
+        option, so the auths only need to decrypt one cipher per option
+
+         * votes: int
+         * msgs: [ [int, int] ]
+        """
+
+        voting = mods.get('voting', params={'id': voting_id})
+        if not voting or not isinstance(voting, list):
+            return Response({}, status=status.HTTP_404_NOT_FOUND)
+        pub_key = voting[0].get('pub_key')
+        if not pub_key:
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        group = get_group(pub_key['p'], pub_key.get('curve', ''))
+        nopts = len(voting[0]['question']['options'])
+
+        msgs = [[group.identity, group.identity] for i in range(nopts)]
+        votes = Vote.objects.filter(voting_id=voting_id).exclude(options=None)
+        count = 0
+        for options in votes.values_list('options', flat=True).iterator():
+            for msg, (a, b) in zip(msgs, options):
+                msg[0] = group.op(msg[0], a)
+                msg[1] = group.op(msg[1], b)
+            count += 1
+
+        return Response({'votes': count, 'msgs': msgs})
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+
+'''
+Mixnet crypto benchmarks.
+
+Usage:
+
+    python bench-mixnet.py fixedbase --bits 256 1024 2048 -n 200
+    python bench-mixnet.py shuffle --bits 2048 -n 5000 --workers 1 4 0
+    python bench-mixnet.py decrypt --bits 2048 -n 5000 --workers 1 4 0
+    python bench-mixnet.py shuffle_decrypt --bits 256 --sizes 10000 100000 1000000
+    python bench-mixnet.py rand --bits 256 2048 -n 100000
+    python bench-mixnet.py dlog --bits 2048 -n 10 --sizes 10000 1000000 100000000
+    python bench-mixnet.py curve --bits 2048 3072 -n 1000
+    python bench-mixnet.py fixedexp --bits 256 2048 -n 500
+    python bench-mixnet.py batch --bits 2048 --sizes 10000 100000 1000000
+    python bench-mixnet.py wire --bits 2048 --sizes 10000 100000
+    python bench-mixnet.py stream --bits 2048 --sizes 10000 100000 --chunk-size 1000
+'''
+
+import argparse
+import io
+import json
+import os
+import sys
+import random as pyrandom
+import tempfile
+import time
+import tracemalloc
+
+from Crypto.PublicKey import ElGamal
+from Crypto.Random import random
+from Crypto.Util.number import getPrime
+from Crypto.Util.number import getRandomNBitInteger
+from Crypto.Util.number import GCD
+
+from mixnet.backends import gmpy2
+from mixnet.mixcrypt import MixCrypt
+from mixnet.mixcrypt import rand
+from mixnet.ecmixcrypt import EcMixCrypt
+from mixnet.fixedexp import FixedExponent
+from mixnet.batch import CiphertextBatch, key_width
+from mixnet import randpool
+from mixnet.randpool import RandPool
+from mixnet import dlog
+from mixnet.dlog import DlogTable
+
+
+def gen_crypt(bits, backend):
+    '''
+    A prime is enough to measure the arithmetic, we don't need to wait for
+    a safe prime like ElGamal.generate does.
+    '''
+
+    if gmpy2:
+        p = int(gmpy2.next_prime(getRandomNBitInteger(bits)))
+    else:
+        p = getPrime(bits)
+    g = 2
+    k = ElGamal.construct((p, g, pow(g, rand(p), p)))
+    return MixCrypt(k=k, bits=bits, backend=backend)
+
+
+def timeit(f, *args):
+    t = time.perf_counter()
+    r = f(*args)
+    return time.perf_counter() - t, r
+
+
+def bench_fixedbase(args):
+    print('{:>6} {:>12} {:>12} {:>12} {:>8}'.format(
+        'bits', 'pow ms/op', 'table ms', 'table ms/op', 'speedup'))
+    for bits in args.bits:
+        crypt = gen_crypt(bits, args.backend)
+        nonces = [rand(crypt.k.p) for i in range(args.n)]
+
+        def encrypt_all():
+            return [crypt.encrypt(1, r=r) for r in nonces]
+
+        t1, c1 = timeit(encrypt_all)
+        tb, _ = timeit(crypt.precompute)
+        t2, c2 = timeit(encrypt_all)
+        assert c1 == c2
+
+        print('{:>6} {:>12.3f} {:>12.1f} {:>12.3f} {:>7.1f}x'.format(
+            bits, t1 * 1000 / args.n, tb * 1000, t2 * 1000 / args.n, t1 / t2))
+
+
+def bench_shuffle(args):
+    print('{:>6} {:>8} {:>12} {:>12}'.format('bits', 'workers', 'total s', 'ms/msg'))
+    for bits in args.bits:
+        crypt = gen_crypt(bits, args.backend)
+        msgs = [crypt.encrypt(i) for i in range(args.n)]
+        for workers in args.workers:
+            t, _ = timeit(crypt.shuffle, msgs, None, workers, args.chunk_size)
+            print('{:>6} {:>8} {:>12.2f} {:>12.3f}'.format(
+                bits, workers, t, t * 1000 / args.n))
+
+
+def bench_decrypt(args):
+    print('{:>6} {:>8} {:>12} {:>12} {:>8}'.format(
+        'bits', 'workers', 'single ms', 'batch ms', 'speedup'))
+    for bits in args.bits:
+        crypt = gen_crypt(bits, args.backend)
+        msgs = [crypt.encrypt(i) for i in range(2, args.n + 2)]
+        t1, c1 = timeit(lambda: [crypt.decrypt(m) for m in msgs])
+        for workers in args.workers:
+            t2, c2 = timeit(crypt.multiple_decrypt, msgs, True, workers, args.chunk_size)
+            assert c1 == c2
+            print('{:>6} {:>8} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(
+                bits, workers, t1 * 1000, t2 * 1000, t1 / t2))
+
+
+def pop_shuffle_decrypt(crypt, msgs):
+    '''
+    The old shuffle_decrypt, picking a random message with list.pop
+    '''
+
+    msgs2 = msgs.copy()
+    msgs3 = []
+    while msgs2:
+        n = random.StrongRandom().randint(0, len(msgs2) - 1)
+        msgs3.append(crypt.decrypt(msgs2.pop(n)))
+    return msgs3
+
+
+def bench_shuffle_decrypt(args):
+    print('{:>10} {:>12} {:>12} {:>12} {:>12}'.format(
+        'ballots', 'pop s', 'pop us/msg', 'perm s', 'perm us/msg'))
+    crypt = gen_crypt(args.bits[0], args.backend)
+    cipher = [crypt.encrypt(i) for i in range(2, 12)]
+    for n in args.sizes:
+        msgs = [cipher[i % len(cipher)] for i in range(n)]
+        if n <= args.pop_max:
+            t1, _ = timeit(pop_shuffle_decrypt, crypt, msgs)
+            pop = '{:>12.2f} {:>12.1f}'.format(t1, t1 * 1e6 / n)
+        else:
+            pop = '{:>12} {:>12}'.format('-', '-')
+        t2, _ = timeit(crypt.shuffle_decrypt, msgs, True, args.workers[0], args.chunk_size)
+        print('{:>10} {} {:>12.2f} {:>12.1f}'.format(n, pop, t2, t2 * 1e6 / n))
+
+
+def strong_rand(p):
+    '''
+    The old mixcrypt.rand, a new StrongRandom for each nonce
+    '''
+
+    while True:
+        k = random.StrongRandom().randint(1, int(p) - 1)
+        if GCD(k, int(p) - 1) == 1: break
+    return k
+
+
+def bench_rand(args):
+    print('{:>6} {:>16} {:>16} {:>8}'.format(
+        'bits', 'old nonces/s', 'pool nonces/s', 'speedup'))
+    for bits in args.bits:
+        crypt = gen_crypt(bits, args.backend)
+        p = crypt.k.p
+        t1, _ = timeit(lambda: [strong_rand(p) for i in range(args.n)])
+        pool = RandPool()
+        for i in range(args.n):
+            pool.nonce(p)
+        rate = pool.stats()['nonces_per_second']
+        print('{:>6} {:>16.0f} {:>16.0f} {:>7.1f}x'.format(
+            bits, args.n / t1, rate, rate * t1 / args.n))
+
+    randpool.pool.reset_stats()
+    t, _ = timeit(crypt.gen_perm, args.n)
+    print('gen_perm({}): {:.2f} s, {:.0f} indices/s'.format(
+        args.n, t, randpool.pool.stats()['indices_per_second']))
+
+
+def bench_dlog(args):
+    print('{:>12} {:>8} {:>12} {:>12} {:>12}'.format(
+        'census', 'm', 'build ms', 'mmap ms', 'log ms/op'))
+    crypt = gen_crypt(args.bits[0], args.backend)
+    p, g = int(crypt.k.p), int(crypt.k.g)
+    directory = tempfile.mkdtemp()
+    for n in args.sizes:
+        tb, table = timeit(DlogTable.get, p, g, n, directory)
+        dlog._tables.clear()
+        tm, table = timeit(DlogTable.get, p, g, n, directory)
+
+        counts = [pyrandom.randint(0, n) for i in range(args.n)]
+        msgs = [pow(g, c, p) for c in counts]
+        tl, logs = timeit(lambda: [table.log(m, n) for m in msgs])
+        assert logs == counts
+
+        print('{:>12} {:>8} {:>12.1f} {:>12.2f} {:>12.2f}'.format(
+            n, table.m, tb * 1000, tm * 1000, tl * 1000 / args.n))
+
+
+def bench_curve(args):
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'group', 'cipher B', 'encrypt ms', 'shuffle ms', 'decrypt ms'))
+    crypts = [(str(bits), gen_crypt(bits, args.backend)) for bits in args.bits]
+    crypts.append(('p256', EcMixCrypt(curve='p256', backend=args.backend)))
+    for name, crypt in crypts:
+        crypt.precompute()
+        clear = [crypt.encode(i) for i in range(2, args.n + 2)]
+        te, msgs = timeit(lambda: [crypt.encrypt(m) for m in clear])
+        ts, shuffled = timeit(crypt.shuffle, msgs, None, args.workers[0], args.chunk_size)
+        td, d = timeit(crypt.multiple_decrypt, shuffled, True, args.workers[0], args.chunk_size)
+        assert sorted(d) == sorted(clear)
+
+        size = sum((a.bit_length() + 7) // 8 + (b.bit_length() + 7) // 8 for a, b in msgs)
+        print('{:>8} {:>12.0f} {:>12.3f} {:>12.3f} {:>12.3f}'.format(
+            name, size / args.n, te * 1000 / args.n, ts * 1000 / args.n, td * 1000 / args.n))
+
+
+def modp_chain(crypt, bases, exp):
+    '''
+    bases^x mod p with the python schedule of x, the inverses for the
+    negative digits with one batch inversion
+    '''
+
+    bk = crypt.backend
+    p = bk.mpz(crypt.k.p)
+    size = 1 << (exp.window - 2)
+    bases = [bk.mpz(a) for a in bases]
+    invs = bk.batch_invert(bases, p)
+    result = []
+    for a, ai in zip(bases, invs):
+        a2, ai2 = a * a % p, ai * ai % p
+        pos, neg = [a], [ai]
+        for i in range(1, size):
+            pos.append(pos[-1] * a2 % p)
+            neg.append(neg[-1] * ai2 % p)
+        r = bk.mpz(1)
+        for dbl, d in exp.steps:
+            for j in range(dbl):
+                r = r * r % p
+            r = r * (pos[d >> 1] if d > 0 else neg[-d >> 1]) % p
+        for j in range(exp.tail):
+            r = r * r % p
+        result.append(r)
+    return result
+
+
+def bench_fixedexp(args):
+    print('{:>8} {:>14} {:>14} {:>8}'.format(
+        'group', 'mul ms/op', 'schedule ms/op', 'speedup'))
+    for bits in args.bits:
+        crypt = gen_crypt(bits, args.backend)
+        exp = FixedExponent(int(crypt.k.x))
+        msgs = [crypt.encrypt(i) for i in range(2, args.n + 2)]
+        bases = [a for a, b in msgs]
+        bk = crypt.backend
+        x, p = bk.mpz(crypt.k.x), bk.mpz(crypt.k.p)
+        t1, r1 = timeit(lambda: [int(bk.powmod(bk.mpz(a), x, p)) for a in bases])
+        t2, r2 = timeit(modp_chain, crypt, bases, exp)
+        assert r1 == [int(r) for r in r2]
+        print('{:>8} {:>14.3f} {:>14.3f} {:>7.2f}x'.format(
+            bits, t1 * 1000 / args.n, t2 * 1000 / args.n, t1 / t2))
+
+
+def bench_batch(args):
+    print('{:>10} {:>12} {:>12} {:>12} {:>12} {:>12}'.format(
+        'ballots', 'list MB', 'batch MB', 'to batch s', 'to list s', 'chunks ms'))
+    crypt = gen_crypt(args.bits[0], args.backend)
+    width = key_width(crypt.k.p)
+    cipher = [crypt.encrypt(i) for i in range(2, 12)]
+    for n in args.sizes:
+        # new ints for every ballot, like the ones parsed from the json
+        tracemalloc.start()
+        msgs = [[a + 0, b + 0] for a, b in (cipher[i % len(cipher)] for i in range(n))]
+        list_mb = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        tb, batch = timeit(CiphertextBatch.from_list, msgs, width)
+        batch_mb = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+
+        tl, msgs2 = timeit(batch.to_list)
+        assert len(msgs2) == n
+        tc, chunks = timeit(batch.chunks, args.chunk_size)
+        print('{:>10} {:>12.1f} {:>12.1f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+            n, list_mb, batch_mb, tb, tl, tc * 1000))
+
+
+def setup_django():
+    # mixnet.wire and mixnet.stream need the django settings and the base app
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'decide.settings')
+    import django
+    django.setup()
+
+
+def hop(name, n, body, encode_time, decode_time):
+    print('{:>10} {:>14} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+        n, name, len(body) / 2**20, encode_time * 1000, decode_time * 1000))
+
+
+def bench_wire(args):
+    '''
+    One hop of the shuffle chain, the body sent by an auth and parsed by the
+    next one to a batch, like Mixnet.batch does, in json and in the binary
+    format of mixnet.wire
+    '''
+
+    setup_django()
+    from rest_framework.parsers import JSONParser
+    from mixnet import wire
+
+    print('{:>10} {:>14} {:>12} {:>12} {:>12}'.format(
+        'ballots', 'format', 'body MB', 'encode ms', 'decode ms'))
+    crypt = gen_crypt(args.bits[0], args.backend)
+    width = key_width(crypt.k.p)
+    k = crypt.k
+    p = int(k.p)
+    pk = {'p': p, 'g': int(k.g), 'y': int(k.y)}
+    for n in args.sizes:
+        # random ints mod p look like real ciphers, repeated ones would
+        # compress too well
+        msgs = [[pyrandom.randrange(p), pyrandom.randrange(p)] for i in range(n)]
+        batch = CiphertextBatch.from_list(msgs, width)
+
+        def json_decode(body):
+            data = JSONParser().parse(io.BytesIO(body))
+            return CiphertextBatch.from_list(data['msgs'], width)
+
+        te, body = timeit(lambda: json.dumps({'msgs': batch.to_list(), 'pk': pk}).encode())
+        td, _ = timeit(json_decode, body)
+        hop('json', n, body, te, td)
+
+        for compress in (False, True):
+            te, body = timeit(wire.encode, {'pk': pk}, batch, compress)
+            td, data = timeit(wire.decode, body)
+            assert data['msgs'].tobytes() == batch.tobytes()
+            hop('binary+zlib' if compress else 'binary', n, body, te, td)
+
+
+def bench_stream(args):
+    '''
+    The output of one auth of the shuffle chain received by the next one,
+    all the ballots in one call or streamed in chunks of --chunk-size, with
+    and without sending each chunk from a thread. The transfer is encoding
+    and decoding the body, and the next auth stores the stream in its file.
+    Peak memory of the python objects, without the stream files.
+    '''
+
+    setup_django()
+    from django.test import override_settings
+    from mixnet import stream, wire
+
+    print('{:>10} {:>14} {:>10} {:>12}'.format('ballots', 'mode', 'total s', 'peak MB'))
+    crypt = gen_crypt(args.bits[0], args.backend)
+    width = key_width(crypt.k.p)
+    p = int(crypt.k.p)
+    directory = tempfile.mkdtemp()
+
+    class Sender(stream.ChunkSender):
+        def post(self, data):
+            data = wire.decode(wire.encode(data, data['msgs']))
+            self.store.write(data['offset'], data['msgs'])
+
+    def whole(batch):
+        msgs = crypt.shuffle(batch, chunk_size=args.chunk_size)
+        data = wire.decode(wire.encode({}, msgs))
+        store = stream.StreamStore(directory, stream.new_stream(), width)
+        store.write(0, data['msgs'])
+        return store
+
+    def streamed(store, n):
+        perm = crypt.gen_perm(n)
+        sender = Sender('', {}, total=n)
+        sender.store = stream.StreamStore(directory, stream.new_stream(), width)
+        for start in range(0, n, args.chunk_size):
+            chunk = store.take(perm[start:start + args.chunk_size])
+            sender.send(crypt.reencrypt_many(chunk, chunk_size=args.chunk_size), start)
+        sender.close()
+        return sender.store
+
+    for n in args.sizes:
+        msgs = [[pyrandom.randrange(p), pyrandom.randrange(p)] for i in range(n)]
+        batch = CiphertextBatch.from_list(msgs, width)
+        del msgs
+        store = stream.StreamStore(directory, stream.new_stream(), width)
+        store.write(0, batch)
+
+        tracemalloc.start()
+        t, out = timeit(whole, batch)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+        out.remove()
+        print('{:>10} {:>14} {:>10.2f} {:>12.1f}'.format(n, 'whole', t, peak))
+
+        for pipeline in (False, True):
+            with override_settings(MIXNET_STREAM_PIPELINE=pipeline):
+                tracemalloc.start()
+                t, out = timeit(streamed, store, n)
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+                tracemalloc.stop()
+            assert out.size() == n
+            out.remove()
+            print('{:>10} {:>14} {:>10.2f} {:>12.1f}'.format(
+                n, 'pipeline' if pipeline else 'stream', t, peak))
+        store.remove()
+
+
+BENCHS = {
+    'fixedbase': bench_fixedbase,
+    'shuffle': bench_shuffle,
+    'decrypt': bench_decrypt,
+    'shuffle_decrypt': bench_shuffle_decrypt,
+    'rand': bench_rand,
+    'dlog': bench_dlog,
+    'curve': bench_curve,
+    'fixedexp': bench_fixedexp,
+    'batch': bench_batch,
+    'wire': bench_wire,
+    'stream': bench_stream,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mixnet crypto benchmarks')
+    parser.add_argument('bench', choices=BENCHS.keys())
+    parser.add_argument('--bits', type=int, nargs='+', default=[256, 1024, 2048])
+    parser.add_argument('-n', type=int, default=200, help='number of messages')
+    parser.add_argument('--backend', default='auto', help='python, gmpy2 or auto')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 0],
+                        help='process pool sizes, 0 is one per core')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='number of ballots for shuffle_decrypt, census size for dlog')
+    parser.add_argument('--pop-max', type=int, default=100000,
+                        help='biggest size to run the old list.pop shuffle_decrypt')
+    args = parser.parse_args()
+
+    BENCHS[args.bench](args)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+'''
+Store vote validation benchmark.
+
+The store checks the voting, the user of the token and the census before
+saving each vote. With the voting, authentication and census modules in
+other host it can do three queries, one after the other or concurrently
+with mods.run, or only one to voting/validate. The other host is a
+process serving decide with --latency ms added to each request to
+simulate the network, on a test database.
+
+Usage:
+
+    python bench-store.py -n 200 --latency 0 2 10
+'''
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+
+def setup_django():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'decide.settings')
+    import django
+    django.setup()
+
+
+class Server(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(args):
+    '''
+    The other host, decide on the test database, each request waits
+    --latency ms before the view
+    '''
+
+    setup_django()
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+
+    settings.DATABASES['default']['NAME'] = args.db
+    # all the modules are in this host
+    settings.BASEURL = 'http://127.0.0.1:{}'.format(args.serve)
+    settings.APIS = {}
+    application = get_wsgi_application()
+    latency = args.latency[0] / 1000
+
+    def app(environ, start_response):
+        time.sleep(latency)
+        return application(environ, start_response)
+
+    server = make_server('127.0.0.1', args.serve, app, server_class=Server,
+                         handler_class=QuietHandler)
+    server.serve_forever()
+
+
+def start_host(db, latency):
+    '''
+    Runs serve in other process, returns it and its url
+    '''
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    host = subprocess.Popen([sys.executable, os.path.realpath(__file__), '--serve', str(port),
+                             '--db', db, '--latency', str(latency)])
+    for i in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return host, 'http://127.0.0.1:{}'.format(port)
+
+
+def create_voters(n):
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+    from rest_framework.authtoken.models import Token
+    from census.models import Census
+    from voting.models import Question, Voting
+
+    q = Question.objects.create(desc='bench question')
+    v = Voting.objects.create(name='bench voting', question=q, start_date=timezone.now())
+    voters = []
+    for i in range(n):
+        user = User.objects.create(username='benchvoter{}'.format(i))
+        token, _ = Token.objects.get_or_create(user=user)
+        Census.objects.create(voting_id=v.id, voter_id=user.id)
+        voters.append((user.id, token.key))
+    return v.id, voters
+
+
+def three(mods, vid, uid, token):
+    voting = mods.get('voting', params={'id': vid})
+    voter = mods.post('authentication', entry_point='/getuser/', json={'token': token})
+    perms = mods.get('census/{}'.format(vid), params={'voter_id': uid}, response=True)
+    return voting[0]['id'], voter['id'], perms.status_code == 200
+
+
+def concurrent(mods, vid, uid, token):
+    voting, voter, perms = mods.run(
+        mods.aget('voting', params={'id': vid}),
+        mods.apost('authentication', entry_point='/getuser/', json={'token': token}),
+        mods.aget('census/{}'.format(vid), params={'voter_id': uid}, response=True),
+    )
+    return voting[0]['id'], voter['id'], perms.status_code == 200
+
+
+def validate(mods, vid, uid, token):
+    valid = mods.post('voting', entry_point='/validate/',
+                      json={'voting': vid, 'voter': uid, 'token': token})
+    return valid['voting'][0]['id'], valid['voter'], valid['census']
+
+
+MODES = {
+    'three': three,
+    'concurrent': concurrent,
+    'validate': validate,
+}
+
+
+def bench(args):
+    setup_django()
+    from django.db import connection
+    from django.test import override_settings
+    from django.test.utils import setup_databases, teardown_databases
+    from base import mods
+
+    dbs = setup_databases(verbosity=0, interactive=False)
+    try:
+        vid, voters = create_voters(args.n)
+
+        print('{:>10} {:>12} {:>12} {:>10}'.format('latency ms', 'mode', 'ms / vote', 'queries'))
+        for latency in args.latency:
+            host, url = start_host(connection.settings_dict['NAME'], latency)
+            apis = {m: url for m in ('voting', 'authentication', 'census')}
+            # every lookup goes to the other host, without the mods.get cache
+            with override_settings(APIS=apis, MODS_CACHE_TTL={}):
+                for name, f in MODES.items():
+                    mods.reset_stats()
+                    t = time.perf_counter()
+                    for uid, token in voters:
+                        assert f(mods, vid, uid, token) == (vid, uid, True)
+                    t = time.perf_counter() - t
+                    stats = mods.stats()
+                    print('{:>10} {:>12} {:>12.2f} {:>10.1f}'.format(
+                        latency, name, t * 1000 / args.n,
+                        (stats['opened'] + stats['reused']) / args.n))
+            host.terminate()
+            host.wait()
+    finally:
+        teardown_databases(dbs, verbosity=0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Store vote validation benchmark')
+    parser.add_argument('-n', type=int, default=200, help='number of votes')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0, 2, 10],
+                        help='ms added to each request of the other host')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+    else:
+        bench(args)
@@ -1,16 +1,19 @@
 from django.contrib import admin
+from django.contrib import messages
 from django.utils import timezone
 
 from .models import QuestionOption
 from .models import Question
 from .models import Voting
+from .models import TallyJob
 
 from .filters import StartedFilter
 
 
 def start(modeladmin, request, queryset):
+    token = request.session.get('auth-token', '')
     for v in queryset.all():
-        v.create_pubkey()
+        v.create_pubkey(token)
         v.start_date = timezone.now()
         v.save()
 
@@ -22,9 +25,11 @@ def stop(ModelAdmin, request, queryset):
 
 
 def tally(ModelAdmin, request, queryset):
-    for v in queryset.filter(end_date__lt=timezone.now()):
-        token = request.session.get('auth-token', '')
-        v.tally_votes(token)
+    token = request.session.get('auth-token', '')
+    jobs = [TallyJob.enqueue(v, token)
+            for v in queryset.filter(end_date__lt=timezone.now())]
+    msg = '{} tally jobs queued, see the tallyworker command'.format(len(jobs))
+    ModelAdmin.message_user(request, msg, messages.INFO)
 
 
 class QuestionOptionInline(admin.TabularInline):
@@ -38,7 +43,7 @@ class QuestionAdmin(admin.ModelAdmin):
 class VotingAdmin(admin.ModelAdmin):
     list_display = ('name', 'start_date', 'end_date')
     readonly_fields = ('start_date', 'end_date', 'pub_key',
-                       'tally', 'postproc')
+                       'tally', 'postproc', 'excluded_votes')
     date_hierarchy = 'start_date'
     list_filter = (StartedFilter,)
     search_fields = ('name', )
@@ -46,5 +51,14 @@ class VotingAdmin(admin.ModelAdmin):
     actions = [ start, stop, tally ]
 
 
+class TallyJobAdmin(admin.ModelAdmin):
+    list_display = ('voting', 'status', 'phase', 'created', 'finished')
+    list_filter = ('status', )
+    readonly_fields = ('voting', 'status', 'phases', 'error', 'worker',
+                       'started', 'finished', 'updated')
+    exclude = ('token', )
+
+
 admin.site.register(Voting, VotingAdmin)
+admin.site.register(TallyJob, TallyJobAdmin)
 admin.site.register(Question, QuestionAdmin)
@@ -0,0 +1,55 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base import tracing
+
+
+class Command(BaseCommand):
+    help = '''Waterfall of the spans of the last tally of a voting, read from
+    the TRACE_FILE of this host and the files of the auths given with
+    --file, see base.tracing.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('voting_id', type=int)
+        parser.add_argument('--file', nargs='+', default=[],
+                            help='span files, TRACE_FILE if none')
+        parser.add_argument('--trace', help='this trace instead of the last tally')
+        parser.add_argument('--width', type=int, default=50, help='chars of the bars')
+
+    def handle(self, *args, **options):
+        paths = options['file'] or [settings.TRACE_FILE]
+        paths = [p for p in paths if p and os.path.exists(p)]
+        if not paths:
+            raise CommandError('No span files, set TRACE_FILE or use --file')
+        spans = tracing.load(paths)
+
+        trace = options['trace']
+        if not trace:
+            tallies = tracing.find(spans, 'tally', voting=options['voting_id'])
+            if not tallies:
+                raise CommandError('No traced tally of the voting {}'.format(options['voting_id']))
+            trace = tallies[0]['trace']
+
+        rows = tracing.tree(spans, trace)
+        if not rows:
+            raise CommandError('No spans of the trace {}'.format(trace))
+        start = min(s['start'] for d, s in rows)
+        end = max(s['start'] + s['duration'] for d, s in rows)
+        total = (end - start) or 1e-9
+        width = options['width']
+
+        print("Trace {}  voting {}  {:.3f} s".format(trace, options['voting_id'], end - start))
+        for depth, s in rows:
+            offset = int((s['start'] - start) / total * width)
+            size = max(1, int(s['duration'] / total * width))
+            bar = (' ' * offset + '#' * size)[:width].ljust(width)
+            name = '  ' * depth + s['name']
+            attrs = s['attrs']
+            detail = attrs.get('view') or attrs.get('auth') or ''
+            if s['error']:
+                detail = '{} {}'.format(detail, s['error']).strip()
+            line = "{:>10.3f} {:>10.3f}  |{}|  {:<32} {:<28} {}".format(
+                s['start'] - start, s['duration'], bar, name, s['service'], detail)
+            print(line.rstrip())
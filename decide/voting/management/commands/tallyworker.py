@@ -0,0 +1,34 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from voting.models import TallyJob
+
+
+class Command(BaseCommand):
+    help = '''Run the tally jobs queued by the tally action of the votings,
+    one after the other. Several workers can run at once, each job is taken
+    by only one of them.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='exit when there are no pending jobs')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='seconds between two polls of the queue')
+        parser.add_argument('--name', default='{}:{}'.format(socket.gethostname(), os.getpid()),
+                            help='name of this worker in the jobs')
+
+    def handle(self, *args, **options):
+        while True:
+            job = TallyJob.take(options['name'])
+            if not job:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            print("Tally job {} of voting {}".format(job.id, job.voting_id))
+            job.run()
+            print("Tally job {} {}".format(job.id, job.status))
@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0003_auto_20180605_0842'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='tally_mode',
+            field=models.CharField(choices=[('mixnet', 'Mixnet shuffle and decrypt'), ('homomorphic', 'Homomorphic sum, single choice only')], default='mixnet', max_length=20),
+        ),
+    ]
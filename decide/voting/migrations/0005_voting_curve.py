@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0004_voting_tally_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='curve',
+            field=models.CharField(blank=True, choices=[('', 'ElGamal mod p'), ('p256', 'ElGamal on the NIST P-256 curve')], default='', max_length=20),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.0 on 2026-10-18 15:45
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0005_voting_curve'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TallyJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(blank=True, default='', max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('phases', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=list)),
+                ('error', models.TextField(blank=True, default='')),
+                ('worker', models.CharField(blank=True, default='', max_length=200)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('voting', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tally_jobs', to='voting.Voting')),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.0 on 2026-10-18 19:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0006_tallyjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tallyjob',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
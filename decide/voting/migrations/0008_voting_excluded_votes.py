@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-18 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voting', '0007_tallyjob_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voting',
+            name='excluded_votes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,11 +1,24 @@
-from django.db import models
+import logging
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, models, transaction
 from django.contrib.postgres.fields import JSONField
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from base import mods
+from base import tracing
 from base.models import Auth, Key
+from mixnet import wire, stream
+from mixnet.batch import CiphertextBatch, key_width
+from mixnet.groups import get_group
+
 
+logger = logging.getLogger(__name__)
 
 class Question(models.Model):
     desc = models.TextField()
@@ -29,6 +42,17 @@ class QuestionOption(models.Model):
 
 
 class Voting(models.Model):
+    MIXNET = 'mixnet'
+    HOMOMORPHIC = 'homomorphic'
+    TALLY_MODES = (
+        (MIXNET, 'Mixnet shuffle and decrypt'),
+        (HOMOMORPHIC, 'Homomorphic sum, single choice only'),
+    )
+    CURVES = (
+        ('', 'ElGamal mod p'),
+        ('p256', 'ElGamal on the NIST P-256 curve'),
+    )
+
     name = models.CharField(max_length=200)
     desc = models.TextField(blank=True, null=True)
     question = models.ForeignKey(Question, related_name='voting', on_delete=models.CASCADE)
@@ -39,20 +63,34 @@ class Voting(models.Model):
     pub_key = models.OneToOneField(Key, related_name='voting', blank=True, null=True, on_delete=models.SET_NULL)
     auths = models.ManyToManyField(Auth, related_name='votings')
 
+    tally_mode = models.CharField(max_length=20, choices=TALLY_MODES, default=MIXNET)
+    curve = models.CharField(max_length=20, choices=CURVES, blank=True, default='')
     tally = JSONField(blank=True, null=True)
     postproc = JSONField(blank=True, null=True)
+    # stored votes left out of the tally, they aren't ciphers of the key
+    excluded_votes = models.PositiveIntegerField(default=0)
+
+    def create_pubkey(self, token=''):
+        '''
+        The key of the voting, generated by its auths. The staff token is
+        needed by the parallel keygen of more than two auths, see
+        Mixnet.keygen_fanout.
+        '''
 
-    def create_pubkey(self):
         if self.pub_key or not self.auths.count():
             return
 
-        auth = self.auths.first()
+        # the positions of the auths in the mixnet, see mixnet_call
+        auths = self.auths.order_by('pk')
+        auth = auths.first()
         data = {
             "voting": self.id,
-            "auths": [ {"name": a.name, "url": a.url} for a in self.auths.all() ],
+            "auths": [ {"name": a.name, "url": a.url} for a in auths ],
+            "curve": self.curve,
         }
-        key = mods.post('mixnet', baseurl=auth.url, json=data)
-        pk = Key(p=key["p"], g=key["g"], y=key["y"])
+        headers = {'HTTP_AUTHORIZATION': 'Token ' + token} if token else {}
+        key = mods.post('mixnet', baseurl=auth.url, json=data, **headers)
+        pk = Key(p=key["p"], g=key["g"], y=key["y"], curve=self.curve)
         pk.save()
         self.pub_key = pk
         self.save()
@@ -63,38 +101,110 @@ class Voting(models.Model):
         # anon votes
         return [[i['a'], i['b']] for i in votes]
 
-    def tally_votes(self, token=''):
+    def tally_votes(self, token='', progress=None):
         '''
-        The tally is a shuffle and then a decrypt
+        The tally is a shuffle and then a decrypt. progress(phase, auth)
+        is called at the start of each phase, see TallyJob.
         '''
 
-        votes = self.get_votes(token)
+        # the root span of the trace of the tally, see the tallytrace command
+        with tracing.span('tally', voting=self.id, mode=self.tally_mode):
+            progress = progress or (lambda phase, auth=None: None)
+            if self.tally_mode == self.HOMOMORPHIC:
+                return self.tally_homomorphic(token, progress)
+
+            progress(TallyJob.FETCH)
+            votes = self.get_votes(token)
+            chunk_size = 0
+            if self.pub_key:
+                # a vote out of the group of the key can't be decrypted, it
+                # was stored before the store checked them, so it's left out
+                # instead of failing the tally of all the others, and counted
+                group = get_group(self.pub_key.p, self.pub_key.curve)
+                valid = [v for v in votes if all(group.contains(n) for n in v)]
+                self.excluded_votes = len(votes) - len(valid)
+                if self.excluded_votes:
+                    logger.warning('Voting %s: %s of %s votes left out of the tally, '
+                                   'out of the group of the key', self.id,
+                                   self.excluded_votes, len(votes))
+                votes = valid
+                # sent to the auths in the binary format of mixnet.wire
+                width = key_width(self.pub_key.p, self.pub_key.curve)
+                votes = CiphertextBatch.from_list(votes, width)
+                # big tallies are streamed in chunks, see mixnet.stream
+                chunk_size = settings.MIXNET_STREAM_CHUNK_SIZE
 
-        auth = self.auths.first()
-        shuffle_url = "/shuffle/{}/".format(self.id)
-        decrypt_url = "/decrypt/{}/".format(self.id)
-        auths = [{"name": a.name, "url": a.url} for a in self.auths.all()]
+            # first, we do the shuffle
+            shuffled = self.mixnet_call('shuffle', votes, progress, chunk_size, token)
 
-        # first, we do the shuffle
-        data = { "msgs": votes }
-        response = mods.post('mixnet', entry_point=shuffle_url, baseurl=auth.url, json=data,
-                response=True)
-        if response.status_code != 200:
-            # TODO: manage error
-            pass
+            # then, we can decrypt that
+            self.tally = self.mixnet_call('decrypt', shuffled, progress, chunk_size, token)
+            self.save()
 
-        # then, we can decrypt that
-        data = {"msgs": response.json()}
-        response = mods.post('mixnet', entry_point=decrypt_url, baseurl=auth.url, json=data,
-                response=True)
+            progress(TallyJob.POSTPROC)
+            self.do_postproc()
 
-        if response.status_code != 200:
-            # TODO: manage error
-            pass
+    def mixnet_call(self, op, msgs, progress, chunk_size=0, token='', **data):
+        '''
+        The shuffle or decrypt op of the msgs in the auths, in the order of
+        create_pubkey. The voting calls each auth, one after the other, and
+        the auths don't call the next one, so the progress of each one is
+        known. A stream goes to the first auth and each auth streams its
+        output to the next one, chunk by chunk, see mixnet.stream, so the
+        progress is only known for all the auths. The last decrypt returns
+        the clears. The calls are sent with the staff token.
+        '''
+
+        auths = list(self.auths.order_by('pk'))
+        url = "/{}/{}/".format(op, self.id)
+        if self.pub_key:
+            pk = self.pub_key
+            data["pk"] = { "p": pk.p, "g": pk.g, "y": pk.y }
+
+        if chunk_size:
+            auth = auths[0]
+            data.update({"position": 0, "chain": True})
+            progress(op)
+            with tracing.span(op, auth=auth.url, auths=len(auths), msgs=len(msgs)):
+                return stream.send("/stream" + url, msgs, data, baseurl=auth.url,
+                                   chunk_size=chunk_size, token=token)
+
+        for position, auth in enumerate(auths):
+            progress(op, auth)
+            data.update({
+                "position": position,
+                "chain": False,
+                "force-last": position == len(auths) - 1,
+            })
+            with tracing.span('{} {}'.format(op, position), auth=auth.url, msgs=len(msgs)):
+                msgs = wire.post(url, dict(data, msgs=msgs), baseurl=auth.url,
+                                 HTTP_AUTHORIZATION='Token ' + token)
+        return msgs
 
-        self.tally = response.json()
+    def tally_homomorphic(self, token='', progress=None):
+        '''
+        The store multiplies the ciphers of each option, g^0 or g^1 in each
+        vote, and the auths decrypt only one cipher per option, in order.
+        The last auth returns the number of votes of each option.
+        '''
+
+        progress = progress or (lambda phase, auth=None: None)
+        progress(TallyJob.FETCH)
+        agg = mods.get('store', entry_point='/aggregate/{}/'.format(self.id),
+                       HTTP_AUTHORIZATION='Token ' + token)
+        # the census size bounds the counts and sizes the discrete log table
+        census = mods.get('census', params={'voting_id': self.id},
+                          HTTP_AUTHORIZATION='Token ' + token)
+        bound = max(len(census.get('voters', [])), agg["votes"])
+
+        counts = self.mixnet_call('decrypt', agg["msgs"], progress, token=token,
+                                  shuffle=False, dlog=bound)
+
+        options = self.question.options.order_by('number')
+        self.tally = {str(opt.number): votes for opt, votes in zip(options, counts)}
         self.save()
 
+        progress(TallyJob.POSTPROC)
         self.do_postproc()
 
     def do_postproc(self):
@@ -105,6 +215,8 @@ class Voting(models.Model):
         for opt in options:
             if isinstance(tally, list):
                 votes = tally.count(opt.number)
+            elif isinstance(tally, dict):
+                votes = tally.get(str(opt.number), 0)
             else:
                 votes = 0
             opts.append({
@@ -127,3 +239,165 @@ class Voting(models.Model):
     
     def end_date_null(self):
         return self.end_date is None
+
+
+@receiver(post_save, sender=Voting)
+@receiver(post_delete, sender=Voting)
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=QuestionOption)
+@receiver(m2m_changed, sender=Voting.auths.through)
+def invalidate_votings(sender, **kwargs):
+    # the votings cached by mods.get, started, stopped, tallied or changed
+    mods.invalidate('voting')
+
+
+class TallyJob(models.Model):
+    '''
+    A tally run in background by the tallyworker command. The database is
+    the queue, each worker takes the oldest pending job. The worker of a
+    running job refreshes updated, a job not updated for TALLY_JOB_TIMEOUT
+    seconds lost its worker and is taken again by other one, the only way a
+    job is recovered. The worker that lost the job can't update it anymore.
+    '''
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    # phases of the tally, shuffle and decrypt are reported for each auth,
+    # or once for all of them when the tally is streamed
+    FETCH = 'fetch votes'
+    SHUFFLE = 'shuffle'
+    DECRYPT = 'decrypt'
+    POSTPROC = 'postproc'
+
+    voting = models.ForeignKey(Voting, related_name='tally_jobs', on_delete=models.CASCADE)
+    # staff token to get the votes from the store, removed when finished,
+    # never shown in the admin nor the api
+    token = models.CharField(max_length=100, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    # [ {"phase": str, "auth": str / null, "started": date, "finished": date / null} ]
+    phases = JSONField(default=list, blank=True)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=200, blank=True, default='')
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    # heartbeat of the worker
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return 'Tally of {}: {}'.format(self.voting, self.status)
+
+    @classmethod
+    def stale(cls):
+        return timezone.now() - timedelta(seconds=settings.TALLY_JOB_TIMEOUT)
+
+    @classmethod
+    def enqueue(cls, voting, token=''):
+        '''
+        New pending job for the voting, or its pending or running one. A
+        running job without heartbeat is taken again by other worker, see
+        take.
+        '''
+
+        with transaction.atomic():
+            # one tally per voting, the lock serializes the concurrent calls
+            Voting.objects.select_for_update().get(pk=voting.pk)
+            jobs = voting.tally_jobs
+            job = jobs.filter(status__in=[cls.PENDING, cls.RUNNING]).first()
+            if not job:
+                job = cls.objects.create(voting=voting, token=token)
+        return job
+
+    @classmethod
+    def take(cls, worker=''):
+        '''
+        Marks the oldest pending job, or running without heartbeat, as
+        running for this worker and returns it, or None if there isn't any
+        '''
+
+        with transaction.atomic():
+            qs = cls.objects.select_for_update(skip_locked=True)
+            qs = qs.filter(models.Q(status=cls.PENDING) |
+                           models.Q(status=cls.RUNNING, updated__lt=cls.stale()))
+            job = qs.order_by('created', 'id').first()
+            if not job:
+                return None
+            job.status = cls.RUNNING
+            job.worker = worker
+            job.started = timezone.now()
+            job.save()
+        return job
+
+    @property
+    def phase(self):
+        if not self.phases:
+            return ''
+        current = self.phases[-1]
+        if current['auth']:
+            return '{} {}'.format(current['phase'], current['auth'])
+        return current['phase']
+
+    def progress(self, phase, auth=None):
+        now = timezone.now().isoformat()
+        if self.phases:
+            self.phases[-1]['finished'] = now
+        self.phases.append({
+            'phase': phase,
+            'auth': auth.name if auth else None,
+            'started': now,
+            'finished': None,
+        })
+        self.mine().update(phases=self.phases, updated=timezone.now())
+
+    def beat(self, stop):
+        '''
+        Refreshes updated until the event stop is set, from a thread while
+        the job runs, the phases can take longer than TALLY_JOB_TIMEOUT
+        '''
+
+        try:
+            while not stop.wait(settings.TALLY_JOB_TIMEOUT / 3):
+                self.mine().update(updated=timezone.now())
+        finally:
+            connections.close_all()
+
+    def mine(self):
+        '''
+        The job while this worker has it, empty once other worker took it
+        '''
+
+        return TallyJob.objects.filter(pk=self.pk, worker=self.worker)
+
+    def finish(self, status, error=''):
+        self.finished = timezone.now()
+        if self.phases:
+            self.phases[-1]['finished'] = self.finished.isoformat()
+        self.status = status
+        self.error = error
+        self.token = ''
+        self.mine().update(status=status, error=error, token='', phases=self.phases,
+                           finished=self.finished, updated=self.finished)
+
+    def run(self):
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self.beat, args=(stop,), daemon=True)
+        heartbeat.start()
+        try:
+            self.voting.tally_votes(self.token, progress=self.progress)
+        except Exception:
+            self.finish(self.FAILED, traceback.format_exc())
+        else:
+            self.finish(self.DONE)
+        finally:
+            stop.set()
+            heartbeat.join()
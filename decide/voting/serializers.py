@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import Question, QuestionOption, Voting
+from .models import Question, QuestionOption, Voting, TallyJob
 from base.serializers import KeySerializer, AuthSerializer
 
 
@@ -25,7 +25,8 @@ class VotingSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Voting
         fields = ('id', 'name', 'desc', 'question', 'start_date',
-                  'end_date', 'pub_key', 'auths', 'tally', 'postproc')
+                  'end_date', 'pub_key', 'auths', 'tally_mode', 'curve', 'tally', 'postproc',
+                  'excluded_votes')
 
 
 class SimpleVotingSerializer(serializers.HyperlinkedModelSerializer):
@@ -33,4 +34,11 @@ class SimpleVotingSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Voting
-        fields = ('name', 'desc', 'question', 'start_date', 'end_date')
+        fields = ('name', 'desc', 'question', 'start_date', 'end_date', 'tally_mode')
+
+
+class TallyJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TallyJob
+        fields = ('id', 'voting', 'status', 'phase', 'phases', 'error',
+                  'created', 'started', 'finished', 'updated')
@@ -1,19 +1,30 @@
+import io
 import random
 import itertools
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from django.core.management import call_command
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.test import TestCase
+from django.test import override_settings
 from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 
 from base import mods
+from base import tracing
 from base.tests import BaseTestCase
 from census.models import Census
+from store.models import Vote
 from mixnet.mixcrypt import ElGamal
 from mixnet.mixcrypt import MixCrypt
-from mixnet.models import Auth
-from voting.models import Voting, Question, QuestionOption
+from mixnet.ecmixcrypt import EcMixCrypt
+from mixnet import proofs
+from mixnet.groups import get_group
+from mixnet.models import Auth, Mixnet
+from voting.models import Voting, Question, QuestionOption, TallyJob
 
 
 class VotingTestCase(BaseTestCase):
@@ -27,6 +38,10 @@ class VotingTestCase(BaseTestCase):
     def encrypt_msg(self, msg, v, bits=settings.KEYBITS):
         pk = v.pub_key
         p, g, y = (pk.p, pk.g, pk.y)
+        if pk.curve:
+            k = EcMixCrypt(curve=pk.curve)
+            k.k = k.construct((p, g, y), pk.curve)
+            return k.encrypt(k.encode(msg))
         k = MixCrypt(bits=bits)
         k.k = ElGamal.construct((p, g, y))
         return k.encrypt(msg)
@@ -105,6 +120,194 @@ class VotingTestCase(BaseTestCase):
 
         for q in v.postproc:
             self.assertEqual(tally.get(q["number"], 0), q["votes"])
+        self.assertEqual(v.excluded_votes, 0)
+
+    def test_tally_bad_votes(self):
+        v = self.create_voting()
+        self.create_voters(v)
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+        clear = self.store_votes(v)
+
+        # stored before the store checked them, out of the group of the key
+        for i, (a, b) in enumerate(((-1, 2), (2, 2**300))):
+            Vote(voting_id=v.id, voter_id=9000 + i, a=a, b=b).save()
+
+        self.login()
+        with self.assertLogs('voting.models', level='WARNING') as logs:
+            v.tally_votes(self.token)
+        for q in v.postproc:
+            self.assertEqual(clear.get(q["number"], 0), q["votes"])
+
+        # the auditors see that two stored votes aren't in the tally
+        self.assertIn('2 of', logs.output[0])
+        v.refresh_from_db()
+        self.assertEqual(v.excluded_votes, 2)
+        voting = mods.get('voting', params={'id': v.id}, cached=False)
+        self.assertEqual(voting[0]['excluded_votes'], 2)
+
+    @override_settings(MIXNET_WIRE='json')
+    def test_complete_voting_json_wire(self):
+        self.test_complete_voting()
+
+    def add_second_auth(self, v):
+        a, _ = Auth.objects.get_or_create(url='http://127.0.0.1:8000',
+                                          defaults={'me': False, 'name': 'auth2'})
+        v.auths.add(a)
+
+    def test_complete_voting_two_auths(self):
+        create_voting = self.create_voting
+
+        def create_voting_two_auths():
+            v = create_voting()
+            self.add_second_auth(v)
+            return v
+
+        self.create_voting = create_voting_two_auths
+        self.test_complete_voting()
+
+    @override_settings(MIXNET_STREAM_CHUNK_SIZE=7, MIXNET_STREAM_PIPELINE=False,
+                       MIXNET_STREAM_DIR=tempfile.mkdtemp())
+    def test_complete_voting_two_auths_stream(self):
+        self.test_complete_voting_two_auths()
+
+    @override_settings(TRACE_FILE=tempfile.mktemp())
+    def test_tally_trace(self):
+        self.test_complete_voting_two_auths()
+        v = Voting.objects.get()
+
+        spans = tracing.load([settings.TRACE_FILE])
+        trace = tracing.find(spans, 'tally', voting=v.id)[0]['trace']
+        names = [(depth, s['name']) for depth, s in tracing.tree(spans, trace)]
+        self.assertEqual(names[0], (0, 'tally'))
+        for op in ('shuffle', 'decrypt'):
+            for position in range(2):
+                self.assertIn((1, '{} {}'.format(op, position)), names)
+            self.assertEqual(names.count((2, op)), 2)
+        self.assertIn((2, 'serialize'), names)
+
+        out = io.StringIO()
+        with mock.patch('sys.stdout', out):
+            call_command('tallytrace', v.id)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('Trace {}'.format(trace)))
+        self.assertEqual(len(lines), len(names) + 1)
+        for auth in v.auths.all():
+            self.assertIn(auth.url, out.getvalue())
+
+    @override_settings(MIXNET_CHECKPOINT_DIR=tempfile.mkdtemp())
+    def test_tally_resume(self):
+        v = self.create_voting()
+        self.add_second_auth(v)
+        self.create_voters(v)
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+        clear = self.store_votes(v)
+        self.login()
+
+        decrypt = Mixnet.decrypt
+        def second_auth_down(mn, *args, **kwargs):
+            if mn.auth_position == 1:
+                raise RuntimeError('auth2 down')
+            return decrypt(mn, *args, **kwargs)
+
+        with mock.patch.object(Mixnet, 'decrypt', second_auth_down):
+            with self.assertRaises(RuntimeError):
+                v.tally_votes(self.token)
+        self.assertIsNone(v.tally)
+
+        # the shuffles and the decrypt of the first auth are checkpointed
+        shuffle_decrypt = MixCrypt.shuffle_decrypt
+        decrypted = []
+        def count(crypt, *args, **kwargs):
+            decrypted.append(crypt)
+            return shuffle_decrypt(crypt, *args, **kwargs)
+
+        with mock.patch.object(MixCrypt, 'shuffle', side_effect=AssertionError('shuffled')):
+            with mock.patch.object(MixCrypt, 'shuffle_decrypt', count):
+                v.tally_votes(self.token)
+        self.assertEqual(len(decrypted), 1)
+
+        for q in v.postproc:
+            self.assertEqual(clear.get(q["number"], 0), q["votes"])
+
+    @override_settings(MIXNET_STREAM_CHUNK_SIZE=7, MIXNET_STREAM_PIPELINE=False,
+                       MIXNET_STREAM_DIR=tempfile.mkdtemp())
+    def test_complete_voting_stream(self):
+        self.test_complete_voting()
+
+    def store_votes_homomorphic(self, v):
+        voters = list(Census.objects.filter(voting_id=v.id))
+        options = list(v.question.options.order_by('number'))
+        pk = v.pub_key
+        group = get_group(pk.p, pk.curve)
+
+        clear = {}
+        for choice, opt in enumerate(options):
+            clear[opt.number] = random.randint(0, 5)
+            for i in range(clear[opt.number]):
+                voter = voters.pop()
+                vote = proofs.encrypt_vote(group, (pk.p, pk.g, pk.y), choice, len(options),
+                                           context=('decide', v.id, voter.voter_id))
+                data = {
+                    'voting': v.id,
+                    'voter': voter.voter_id,
+                    'vote': vote,
+                }
+                user = self.get_or_create_user(voter.voter_id)
+                self.login(user=user.username)
+                response = mods.post('store', json=data, response=True)
+                self.assertEqual(response.status_code, 200)
+        return clear
+
+    @override_settings(MIXNET_DLOG_DIR=tempfile.mkdtemp())
+    def test_complete_voting_homomorphic(self):
+        v = self.create_voting()
+        v.tally_mode = Voting.HOMOMORPHIC
+        v.save()
+        self.create_voters(v)
+
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+
+        clear = self.store_votes_homomorphic(v)
+
+        self.login()  # set token
+        v.tally_votes(self.token)
+
+        for q in v.question.options.all():
+            self.assertEqual(v.tally[str(q.number)], clear[q.number])
+
+        for q in v.postproc:
+            self.assertEqual(clear[q["number"]], q["votes"])
+
+    @override_settings(MIXNET_DLOG_DIR=tempfile.mkdtemp())
+    def test_complete_voting_curve(self):
+        for mode in (Voting.MIXNET, Voting.HOMOMORPHIC):
+            v = self.create_voting()
+            v.curve = 'p256'
+            v.tally_mode = mode
+            v.save()
+            self.create_voters(v)
+
+            v.create_pubkey()
+            self.assertEqual(v.pub_key.curve, 'p256')
+            v.start_date = timezone.now()
+            v.save()
+
+            if mode == Voting.MIXNET:
+                clear = self.store_votes(v)
+            else:
+                clear = self.store_votes_homomorphic(v)
+
+            self.login()  # set token
+            v.tally_votes(self.token)
+
+            for q in v.postproc:
+                self.assertEqual(clear.get(q["number"], 0), q["votes"])
 
     def test_create_voting_from_api(self):
         data = {'name': 'Example'}
@@ -136,6 +339,7 @@ class VotingTestCase(BaseTestCase):
 
     def test_update_voting(self):
         voting = self.create_voting()
+        voting.create_pubkey()
 
         data = {'action': 'start'}
         #response = self.client.post('/voting/{}/'.format(voting.pk), data, format='json')
@@ -193,8 +397,17 @@ class VotingTestCase(BaseTestCase):
 
         data = {'action': 'tally'}
         response = self.client.put('/voting/{}/'.format(voting.pk), data, format='json')
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.json(), 'Voting tallied')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual(job['status'], TallyJob.PENDING)
+
+        # the same job until the worker runs it
+        response = self.client.put('/voting/{}/'.format(voting.pk), data, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['job'], job['job'])
+
+        call_command('tallyworker', once=True)
+        self.assertEqual(TallyJob.objects.get(pk=job['job']).status, TallyJob.DONE)
 
         # STATUS VOTING: tallied
         data = {'action': 'start'}
@@ -212,6 +425,139 @@ class VotingTestCase(BaseTestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json(), 'Voting already tallied')
 
+    def test_tally_job(self):
+        v = self.create_voting()
+        self.create_voters(v)
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+        clear = self.store_votes(v)
+        v.end_date = timezone.now()
+        v.save()
+
+        self.login()
+        data = {'action': 'tally'}
+        response = self.client.put('/voting/{}/'.format(v.pk), data, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_url = '/voting/tally/{}/'.format(response.json()['job'])
+
+        response = self.client.get(job_url)
+        self.assertEqual(response.json()['status'], TallyJob.PENDING)
+
+        call_command('tallyworker', once=True)
+
+        job = self.client.get(job_url).json()
+        self.assertEqual(job['status'], TallyJob.DONE)
+        self.assertEqual(job['phase'], TallyJob.POSTPROC)
+        auth = v.auths.first().name
+        self.assertEqual([(p['phase'], p['auth']) for p in job['phases']], [
+            (TallyJob.FETCH, None),
+            (TallyJob.SHUFFLE, auth),
+            (TallyJob.DECRYPT, auth),
+            (TallyJob.POSTPROC, None),
+        ])
+        self.assertTrue(all(p['finished'] for p in job['phases']))
+        self.assertEqual(TallyJob.objects.get().token, '')
+
+        v.refresh_from_db()
+        for q in v.postproc:
+            self.assertEqual(clear.get(q["number"], 0), q["votes"])
+
+        self.login(user='noadmin')
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, 403)
+
+    def tally_phases(self):
+        v = self.create_voting()
+        self.add_second_auth(v)
+        self.create_voters(v)
+        v.create_pubkey()
+        v.start_date = timezone.now()
+        v.save()
+        self.store_votes(v)
+
+        self.login()
+        phases = []
+        v.tally_votes(self.token, progress=lambda phase, auth=None:
+                      phases.append((phase, auth.name if auth else None)))
+        return v, phases
+
+    def test_tally_progress_per_auth(self):
+        v, phases = self.tally_phases()
+        auths = [a.name for a in v.auths.order_by('pk')]
+        self.assertEqual(phases, [
+            (TallyJob.FETCH, None),
+            (TallyJob.SHUFFLE, auths[0]),
+            (TallyJob.SHUFFLE, auths[1]),
+            (TallyJob.DECRYPT, auths[0]),
+            (TallyJob.DECRYPT, auths[1]),
+            (TallyJob.POSTPROC, None),
+        ])
+
+    @override_settings(MIXNET_STREAM_CHUNK_SIZE=7, MIXNET_STREAM_PIPELINE=False,
+                       MIXNET_STREAM_DIR=tempfile.mkdtemp())
+    def test_tally_progress_stream(self):
+        # the stream goes through all the auths at once
+        v, phases = self.tally_phases()
+        self.assertEqual(phases, [
+            (TallyJob.FETCH, None),
+            (TallyJob.SHUFFLE, None),
+            (TallyJob.DECRYPT, None),
+            (TallyJob.POSTPROC, None),
+        ])
+
+    def test_tally_job_failed(self):
+        v = self.create_voting()
+        job = TallyJob.enqueue(v, 'token')
+        self.assertEqual(TallyJob.take('worker'), job)
+        job = TallyJob.objects.get(pk=job.pk)
+        self.assertIsNone(TallyJob.take('worker'))
+
+        with mock.patch.object(Voting, 'tally_votes', side_effect=RuntimeError('auth down')):
+            job.run()
+        job.refresh_from_db()
+        self.assertEqual(job.status, TallyJob.FAILED)
+        self.assertIn('auth down', job.error)
+        self.assertEqual(job.token, '')
+
+    def test_tally_job_stale(self):
+        v = self.create_voting()
+        job = TallyJob.enqueue(v)
+        taken = TallyJob.take('worker')
+        self.assertEqual(taken, job)
+        self.assertEqual(TallyJob.enqueue(v), job)
+
+        # the worker stopped, other one takes the job
+        old = timezone.now() - timedelta(seconds=settings.TALLY_JOB_TIMEOUT + 1)
+        TallyJob.objects.filter(pk=job.pk).update(updated=old)
+        self.assertEqual(TallyJob.take('other').worker, 'other')
+        self.assertIsNone(TallyJob.take('worker'))
+
+        # the tally action doesn't queue other job for the stale one
+        TallyJob.objects.filter(pk=job.pk).update(updated=old)
+        self.assertEqual(TallyJob.enqueue(v), job)
+        self.assertEqual(TallyJob.objects.count(), 1)
+
+        # the worker that lost the job can't finish it
+        taken.finish(TallyJob.FAILED, 'lost')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), (TallyJob.RUNNING, 'other'))
+
+
+    @override_settings(MODS_CACHE_TTL={'voting': 60})
+    def test_voting_cache(self):
+        v = self.create_voting()
+        mods.reset_stats()
+        self.assertIsNone(mods.get('voting', params={'id': v.id})[0]['start_date'])
+        self.assertIsNone(mods.get('voting', params={'id': v.id})[0]['start_date'])
+        self.assertEqual(mods.stats()['cached'], 1)
+
+        # started, the cached voting is dropped
+        v.start_date = timezone.now()
+        v.save()
+        self.assertIsNotNone(mods.get('voting', params={'id': v.id})[0]['start_date'])
+
+
 class VotingModelTestCase(BaseTestCase):
     def setUp(self):
         
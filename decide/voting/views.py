@@ -5,8 +5,9 @@ from django.shortcuts import get_object_or_404
 from rest_framework import generics, status
 from rest_framework.response import Response
 
-from .models import Question, QuestionOption, Voting
-from .serializers import SimpleVotingSerializer, VotingSerializer
+from .models import Question, QuestionOption, Voting, TallyJob
+from .serializers import SimpleVotingSerializer, VotingSerializer, TallyJobSerializer
+from base import mods
 from base.perms import UserIsStaff
 from base.models import Auth
 
@@ -32,6 +33,12 @@ class VotingView(generics.ListCreateAPIView):
         for data in ['name', 'desc', 'question', 'question_opt']:
             if not data in request.data:
                 return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        tally_mode = request.data.get('tally_mode', Voting.MIXNET)
+        if tally_mode not in dict(Voting.TALLY_MODES):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
+        curve = request.data.get('curve', '')
+        if curve not in dict(Voting.CURVES):
+            return Response({}, status=status.HTTP_400_BAD_REQUEST)
 
         question = Question(desc=request.data.get('question'))
         question.save()
@@ -39,7 +46,7 @@ class VotingView(generics.ListCreateAPIView):
             opt = QuestionOption(question=question, option=q_opt, number=idx)
             opt.save()
         voting = Voting(name=request.data.get('name'), desc=request.data.get('desc'),
-                question=question)
+                question=question, tally_mode=tally_mode, curve=curve)
         voting.save()
 
         auth, _ = Auth.objects.get_or_create(url=settings.BASEURL,
@@ -89,13 +96,69 @@ class VotingUpdate(generics.RetrieveUpdateDestroyAPIView):
             elif not voting.end_date:
                 msg = 'Voting is not stopped'
                 st = status.HTTP_400_BAD_REQUEST
-            elif voting.tally:
+            elif voting.tally is not None:
                 msg = 'Voting already tallied'
                 st = status.HTTP_400_BAD_REQUEST
             else:
-                voting.tally_votes(request.auth.key)
-                msg = 'Voting tallied'
+                # the tallyworker command runs the tally, see TallyJob
+                job = TallyJob.enqueue(voting, request.auth.key)
+                msg = {'job': job.id, 'status': job.status}
+                st = status.HTTP_202_ACCEPTED
         else:
             msg = 'Action not found, try with start, stop or tally'
             st = status.HTTP_400_BAD_REQUEST
         return Response(msg, status=st)
+
+
+class TallyJobView(generics.RetrieveAPIView):
+    """
+    Status and progress of a tally job
+    """
+
+    queryset = TallyJob.objects.all()
+    serializer_class = TallyJobSerializer
+    permission_classes = (UserIsStaff,)
+    lookup_url_kwarg = 'job_id'
+
+
+class VoteValidationView(generics.GenericAPIView):
+    """
+    Everything the store checks before saving a vote in one query, for
+    a store in other host. The user and the census are looked up together,
+    in this process if their modules are here.
+
+     * voting: id
+     * voter: id
+     * token: str
+
+    The answer is the voting list, as the voting GET, the id of the user of
+    the token and if the voter is in the census:
+
+     * { "voting": [ {...} ], "voter": id / null, "census": bool }
+    """
+
+    queryset = Voting.objects.all()
+    serializer_class = VotingSerializer
+
+    def post(self, request, *args, **kwargs):
+        vid = request.data.get('voting')
+        uid = request.data.get('voter')
+        token = request.data.get('token', '')
+
+        try:
+            votings = self.get_queryset().filter(id=int(vid))
+        except (TypeError, ValueError):
+            votings = []
+        voting = self.get_serializer(votings, many=True).data
+        if not voting:
+            return Response({'voting': [], 'voter': None, 'census': False})
+
+        voter, perms = mods.run(
+            mods.apost('authentication', entry_point='/getuser/', json={'token': token}),
+            mods.aget('census/{}'.format(vid), params={'voter_id': uid}, response=True),
+        )
+        return Response({
+            'voting': voting,
+            'voter': voter.get('id', None),
+            'census': perms.status_code == 200,
+        })